@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     # Third-party apps
     "rest_framework",
+    "adrf",
     "corsheaders",
     # Local apps
     "users",
@@ -225,3 +226,188 @@ EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 RESEND_SMTP_PORT = 587
 RESEND_SMTP_USERNAME = "resend"
 RESEND_SMTP_HOST = "smtp.resend.com"
+
+# Instagram Graph API HTTP transport
+INSTAGRAM_HTTP_POOL_CONNECTIONS = int(
+    os.getenv("INSTAGRAM_HTTP_POOL_CONNECTIONS", "4")
+)
+INSTAGRAM_HTTP_POOL_MAXSIZE = int(
+    os.getenv("INSTAGRAM_HTTP_POOL_MAXSIZE", "20")
+)
+INSTAGRAM_HTTP_POOL_BLOCK = (
+    os.getenv("INSTAGRAM_HTTP_POOL_BLOCK", "False").lower() == "true"
+)
+# HTTP/2 for the async client, requires the httpx[http2] extra
+INSTAGRAM_HTTP2 = os.getenv("INSTAGRAM_HTTP2", "False").lower() == "true"
+
+# Instagram Graph API concurrency
+# Upper bound on concurrent upstream calls per access token
+INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN = int(
+    os.getenv("INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN", "5")
+)
+
+# Instagram Graph API rate limits
+# Nominal call budgets, paced down further as the usage headers returned
+# by the Graph API climb past the threshold (percent of quota)
+INSTAGRAM_RATE_LIMIT_APP_CALLS_PER_HOUR = int(
+    os.getenv("INSTAGRAM_RATE_LIMIT_APP_CALLS_PER_HOUR", "18000")
+)
+INSTAGRAM_RATE_LIMIT_TOKEN_CALLS_PER_HOUR = int(
+    os.getenv("INSTAGRAM_RATE_LIMIT_TOKEN_CALLS_PER_HOUR", "1000")
+)
+INSTAGRAM_RATE_LIMIT_THRESHOLD = float(
+    os.getenv("INSTAGRAM_RATE_LIMIT_THRESHOLD", "75")
+)
+# Longest a call is deferred before it fails instead
+INSTAGRAM_RATE_LIMIT_MAX_WAIT = float(
+    os.getenv("INSTAGRAM_RATE_LIMIT_MAX_WAIT", "10")
+)
+
+# Instagram Graph API retries and circuit breakers
+INSTAGRAM_RETRY_ATTEMPTS = int(os.getenv("INSTAGRAM_RETRY_ATTEMPTS", "2"))
+INSTAGRAM_RETRY_BACKOFF = float(os.getenv("INSTAGRAM_RETRY_BACKOFF", "0.5"))
+INSTAGRAM_RETRY_MAX_BACKOFF = float(
+    os.getenv("INSTAGRAM_RETRY_MAX_BACKOFF", "4")
+)
+INSTAGRAM_BREAKER_FAILURES = int(os.getenv("INSTAGRAM_BREAKER_FAILURES", "5"))
+INSTAGRAM_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("INSTAGRAM_BREAKER_RESET_TIMEOUT", "30")
+)
+# How long the last good response of a call is kept as breaker fallback
+INSTAGRAM_FALLBACK_TTL = int(os.getenv("INSTAGRAM_FALLBACK_TTL", "86400"))
+
+# Instagram Graph API request coalescing
+# Identical concurrent GETs share one upstream call, across workers too
+# when CACHES points at a shared cache (see REDIS_URL below)
+INSTAGRAM_COALESCE_REQUESTS = (
+    os.getenv("INSTAGRAM_COALESCE_REQUESTS", "True").lower() == "true"
+)
+# Longest a call waits for the identical call already in flight
+INSTAGRAM_COALESCE_TIMEOUT = float(
+    os.getenv("INSTAGRAM_COALESCE_TIMEOUT", "60")
+)
+# How long a shared response stays available to the waiting workers
+INSTAGRAM_COALESCE_RESULT_TTL = int(
+    os.getenv("INSTAGRAM_COALESCE_RESULT_TTL", "10")
+)
+
+# Cache shared by all workers, requires the redis package. Without it each
+# worker uses its own in-memory cache.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+
+# Instagram insights cache
+INSTAGRAM_CACHE_ENABLED = (
+    os.getenv("INSTAGRAM_CACHE_ENABLED", "True").lower() == "true"
+)
+# Entries of the in-process tier in front of CACHES, and the longest a
+# worker keeps a local copy (bounds how late it sees an invalidation)
+INSTAGRAM_CACHE_LOCAL_SIZE = int(
+    os.getenv("INSTAGRAM_CACHE_LOCAL_SIZE", "1024")
+)
+INSTAGRAM_CACHE_LOCAL_MAX_TTL = int(
+    os.getenv("INSTAGRAM_CACHE_LOCAL_MAX_TTL", "60")
+)
+# Dashboards are answered from expired entries up to this many seconds
+# past their expiry while a background refresh runs, then they block
+INSTAGRAM_CACHE_MAX_STALENESS = int(
+    os.getenv("INSTAGRAM_CACHE_MAX_STALENESS", "3600")
+)
+INSTAGRAM_CACHE_REFRESH_WORKERS = int(
+    os.getenv("INSTAGRAM_CACHE_REFRESH_WORKERS", "4")
+)
+# Longest a background refresh holds its lock
+INSTAGRAM_CACHE_REFRESH_TIMEOUT = int(
+    os.getenv("INSTAGRAM_CACHE_REFRESH_TIMEOUT", "120")
+)
+# Seconds like_count and the signed media URLs of a media item are cached,
+# its other fields are stored permanently
+INSTAGRAM_MEDIA_VOLATILE_TTL = int(
+    os.getenv("INSTAGRAM_MEDIA_VOLATILE_TTL", "300")
+)
+# Seconds each InstagramService result is cached, matching how often the
+# metrics behind it refresh upstream
+INSTAGRAM_CACHE_TTLS = {
+    "get_account_basic_insights": 900,
+    "get_followers_growth": 3600,
+    "get_current_month_likes": 900,
+    # Demographics are computed by Instagram at most once a day
+    "get_demographic_insights": 43200,
+    "get_engaged_audience_demographics": 43200,
+    "get_follower_demographics": 43200,
+    "get_follows_and_unfollows": 3600,
+    "get_audience_demographics": 43200,
+    # Account totals and demographics are fetched together for dashboards
+    "get_dashboard_insights": 900,
+}
+
+# Instagram insights store
+# Seconds between two incremental syncs of an account's daily metrics
+INSTAGRAM_INSIGHTS_SYNC_INTERVAL = int(
+    os.getenv("INSTAGRAM_INSIGHTS_SYNC_INTERVAL", "900")
+)
+# Days fetched on the first sync, and at most per sync (Graph API limit)
+INSTAGRAM_INSIGHTS_SYNC_DAYS = int(
+    os.getenv("INSTAGRAM_INSIGHTS_SYNC_DAYS", "30")
+)
+# Syncs of the local stores run at once per process, started in the
+# background of the requests finding an account due for one
+INSTAGRAM_STORE_SYNC_WORKERS = int(
+    os.getenv("INSTAGRAM_STORE_SYNC_WORKERS", "2")
+)
+
+# Instagram media catalog
+# Seconds between two incremental syncs of an account's media
+INSTAGRAM_MEDIA_SYNC_INTERVAL = int(
+    os.getenv("INSTAGRAM_MEDIA_SYNC_INTERVAL", "900")
+)
+# Days before the newest catalogued post that each sync goes back over,
+# refreshing their listed fields (like_count, media URLs)
+INSTAGRAM_MEDIA_REFRESH_DAYS = int(
+    os.getenv("INSTAGRAM_MEDIA_REFRESH_DAYS", "7")
+)
+
+# Instagram media refresh scheduling
+# Bounds of the interval between two refreshes of a media item's counters
+INSTAGRAM_REFRESH_MIN_INTERVAL = int(
+    os.getenv("INSTAGRAM_REFRESH_MIN_INTERVAL", "900")
+)
+INSTAGRAM_REFRESH_MAX_INTERVAL = int(
+    os.getenv("INSTAGRAM_REFRESH_MAX_INTERVAL", "604800")
+)
+# Engagements a media item may gain between two refreshes at its
+# observed rate
+INSTAGRAM_REFRESH_TARGET_CHANGE = float(
+    os.getenv("INSTAGRAM_REFRESH_TARGET_CHANGE", "20")
+)
+# Media items refreshed at most per account and sync
+INSTAGRAM_REFRESH_MAX_PER_SYNC = int(
+    os.getenv("INSTAGRAM_REFRESH_MAX_PER_SYNC", "500")
+)
+
+# Instagram insights backfill
+# Days of daily metrics history fetched for an account, by default and
+# at most
+INSTAGRAM_BACKFILL_DAYS = int(os.getenv("INSTAGRAM_BACKFILL_DAYS", "730"))
+# Backfill jobs run at once per process, each fetching its windows with
+# up to INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN concurrent calls
+INSTAGRAM_BACKFILL_WORKERS = int(os.getenv("INSTAGRAM_BACKFILL_WORKERS", "2"))
+# Seconds without progress after which the sync worker resumes a job
+INSTAGRAM_BACKFILL_STALL_TIMEOUT = int(
+    os.getenv("INSTAGRAM_BACKFILL_STALL_TIMEOUT", "600")
+)
+
+# Instagram sync worker (manage.py sync_instagram)
+INSTAGRAM_SYNC_PROCESSES = int(os.getenv("INSTAGRAM_SYNC_PROCESSES", "1"))
+INSTAGRAM_SYNC_THREADS = int(os.getenv("INSTAGRAM_SYNC_THREADS", "4"))
+# Seconds between the start of two passes over all accounts
+INSTAGRAM_SYNC_INTERVAL = int(os.getenv("INSTAGRAM_SYNC_INTERVAL", "900"))
+# Progress is reported every this many accounts
+INSTAGRAM_SYNC_PROGRESS_EVERY = int(
+    os.getenv("INSTAGRAM_SYNC_PROGRESS_EVERY", "50")
+)
@@ -1,3 +1,43 @@
+"""
+Register models to Admin
+"""
+
 from django.contrib import admin
+from .models import (
+    BackfillJob,
+    EngagementRollup,
+    InsightPoint,
+    InstagramMedia,
+)
+
+
+@admin.register(InstagramMedia)
+class InstagramMediaAdmin(admin.ModelAdmin):
+    """Instagram media metadata"""
+
+    list_display = ("media_id", "media_type", "username", "timestamp")
+    search_fields = ("media_id", "username")
+
+
+@admin.register(InsightPoint)
+class InsightPointAdmin(admin.ModelAdmin):
+    """Daily Instagram metric values"""
+
+    list_display = ("account", "metric", "date", "value")
+    list_filter = ("metric",)
+
+
+@admin.register(EngagementRollup)
+class EngagementRollupAdmin(admin.ModelAdmin):
+    """Monthly and weekly engagement totals"""
+
+    list_display = ("account", "period", "start", "post_count")
+    list_filter = ("period",)
+
+
+@admin.register(BackfillJob)
+class BackfillJobAdmin(admin.ModelAdmin):
+    """Daily metrics history fetches"""
 
-# Register your models here.
+    list_display = ("account", "since", "status", "points", "created_at")
+    list_filter = ("status",)
@@ -0,0 +1,467 @@
+"""
+Async Instagram Service to call Instagram API from ASGI views
+"""
+
+import asyncio
+import json
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlencode
+import httpx
+from django.conf import settings
+from . import demographics, media_store, transport
+from .cache import cached
+from .instagram_service import InstagramService
+
+
+class AsyncInstagramService:
+    """
+    Async counterpart of InstagramService
+
+    Only covers the calls the async views make live: the OAuth exchange,
+    media, account insights and demographics. Each method has the same
+    arguments and return value as the InstagramService method of the
+    same name, and shares its parsing helpers, so both services produce
+    identical payloads. Time series, media pages and post engagements
+    have no async counterpart, the async views serve them from the
+    local stores instead.
+    """
+
+    @staticmethod
+    async def get_access_token(code: str):
+        token_payload = {
+            "client_id": settings.INSTAGRAM_CLIENT_ID,
+            "client_secret": settings.INSTAGRAM_CLIENT_SECRET,
+            "grant_type": "authorization_code",
+            "redirect_uri": settings.INSTAGRAM_REDIRECT_URI,
+            "code": code,
+        }
+
+        token_response = await transport.async_post(
+            InstagramService.TOKEN_URL, data=token_payload
+        )
+
+        return token_response.json()
+
+    @staticmethod
+    async def get_long_lived_token(access_token: str) -> Dict[str, Any]:
+        """Get a long-lived token valid for 60 days"""
+
+        endpoint = InstagramService.HOST_URL + "/access_token"
+        params = {
+            "grant_type": "ig_exchange_token",
+            "client_secret": settings.INSTAGRAM_CLIENT_SECRET,
+            "access_token": access_token,
+        }
+
+        response = await transport.async_get(
+            endpoint, params=params, timeout=10
+        )
+
+        return response.json()
+
+    @staticmethod
+    async def get_user_profile(long_lived_token: str) -> Dict[str, Any]:
+        """
+        Get user profile with long lived token
+        """
+
+        endpoint = f"{InstagramService.HOST_URL}/me"
+        params = {"fields": "id,username", "access_token": long_lived_token}
+        response = await transport.async_get(endpoint, params=params)
+
+        return response.json()
+
+    @staticmethod
+    async def batch_get(
+        relative_urls: List[str], access_token: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Send several GET requests as Graph API batch requests
+
+        Raises:
+            httpx.HTTPError if a batch call fails
+        """
+        size = InstagramService.BATCH_SIZE
+        chunks = [
+            relative_urls[i:i + size]
+            for i in range(0, len(relative_urls), size)
+        ]
+
+        async def send(chunk):
+            batch = [
+                {
+                    "method": "GET",
+                    "relative_url": f"{InstagramService.API_VERSION}/{url}",
+                }
+                for url in chunk
+            ]
+            data = {
+                "access_token": access_token,
+                "batch": json.dumps(batch),
+                "include_headers": "false",
+            }
+
+            response = await transport.async_post(
+                InstagramService.BATCH_URL, data=data, timeout=60
+            )
+            response.raise_for_status()
+
+            return [
+                InstagramService._parse_batch_item(item)
+                for item in response.json()
+            ]
+
+        results = []
+        for chunk_results in await asyncio.gather(*map(send, chunks)):
+            results.extend(chunk_results)
+
+        return results
+
+    @staticmethod
+    async def get_user_media(
+        ig_id: str,
+        access_token: str,
+        limit: Optional[int] = None,
+        fields: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Fetch a user's media from Instagram
+        """
+        try:
+            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/media"
+            params = {
+                "access_token": access_token,
+            }
+            if limit:
+                params["limit"] = limit
+            if fields:
+                params["fields"] = fields
+            if after:
+                params["after"] = after
+
+            response = await transport.async_get(
+                endpoint, params=params, timeout=60
+            )
+            response.raise_for_status()
+
+            return response.json()
+
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+    @staticmethod
+    async def _get_media_fields(
+        media_id: str, access_token: str, fields: str
+    ) -> Dict[str, Any]:
+        endpoint = f"{InstagramService.BASE_URL}/{media_id}"
+        params = {"access_token": access_token, "fields": fields}
+
+        response = await transport.async_get(
+            endpoint, params=params, timeout=60
+        )
+        response.raise_for_status()
+
+        return response.json()
+
+    @staticmethod
+    async def get_media_details(
+        media_id: str, access_token: str, fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch details for a specific media item
+        """
+        fields = fields or InstagramService.MEDIA_DETAIL_FIELDS
+        with_children = "children" in fields
+        try:
+            media, volatile = await media_store.aload(media_id, access_token)
+
+            if media is None or (
+                with_children and media_store.missing_children(media)
+            ):
+                data = await AsyncInstagramService._get_media_fields(
+                    media_id,
+                    access_token,
+                    ",".join(InstagramService.MEDIA_FIELDS),
+                )
+                if (
+                    with_children
+                    and data.get("media_type") == media_store.CAROUSEL
+                ):
+                    data.update(
+                        await AsyncInstagramService._get_media_fields(
+                            media_id,
+                            access_token,
+                            InstagramService._media_children_field(),
+                        )
+                    )
+                media = await media_store.asave_immutable(data)
+                volatile = await media_store.asave_volatile(
+                    media_id, access_token, data
+                )
+
+            elif volatile is None:
+                # The volatile entry is cached per token, without it this
+                # token was never accepted upstream for the stored item
+                data = await AsyncInstagramService._get_media_fields(
+                    media_id, access_token, media_store.volatile_fields(media)
+                )
+                volatile = await media_store.asave_volatile(
+                    media_id, access_token, data
+                )
+
+            return media_store.merge(media, volatile, fields)
+
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+    @staticmethod
+    @cached("get_account_basic_insights")
+    async def get_account_basic_insights(
+        ig_id: str, access_token: str, fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch basic account insights including follower count,
+        engagement rate, etc., narrowed to fields like the sync method
+        """
+        fields = fields or InstagramService.ACCOUNT_INSIGHT_FIELDS
+        account_metrics = InstagramService._account_metrics(fields)
+        media_metrics = InstagramService._average_metrics(fields)
+
+        async def account_insights():
+            if not account_metrics:
+                return {}
+            response = await transport.async_get(
+                f"{InstagramService.BASE_URL}/{ig_id}/insights",
+                params={
+                    "metric": ",".join(account_metrics),
+                    "period": "day",
+                    "metric_type": "total_value",
+                    "access_token": access_token,
+                },
+                timeout=60,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        async def recent_media():
+            if not InstagramService._needs_recent_media(fields):
+                return {}
+            return await AsyncInstagramService.get_user_media(
+                ig_id, access_token, limit=10, fields="id,like_count"
+            )
+
+        try:
+            # Account insights and the media list do not depend on each
+            # other, so fetch them together
+            insights_data, media_response = await asyncio.gather(
+                account_insights(), recent_media()
+            )
+
+            if "error" in media_response:
+                return media_response
+
+            media_items = media_response.get("data", [])[:10]
+            insights_by_media = {}
+            if media_items and media_metrics:
+                insights_by_media = (
+                    await AsyncInstagramService.get_media_insights_batch(
+                        [item["id"] for item in media_items],
+                        access_token,
+                        media_metrics,
+                    )
+                )
+
+            return InstagramService._summarize_account_insights(
+                insights_data, media_items, insights_by_media, fields
+            )
+
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+    @staticmethod
+    @cached("get_engaged_audience_demographics")
+    async def get_engaged_audience_demographics(
+        ig_id: str,
+        access_token: str,
+        timeframe: str,
+    ) -> Dict[str, Any]:
+        """
+        Fetch engaged audience demographics
+        """
+        endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+        params = {
+            "metric": "engaged_audience_demographics",
+            "period": "lifetime",
+            "timeframe": timeframe,
+            "metric_type": "total_value",
+            "access_token": access_token,
+        }
+
+        response = await transport.async_get(
+            endpoint, params=params, timeout=60
+        )
+        response.raise_for_status()
+
+        return demographics.format_breakdowns(
+            response.json(), "engaged_audience_demographics"
+        )
+
+    @staticmethod
+    @cached("get_follows_and_unfollows")
+    async def get_follows_and_unfollows(
+        ig_id: str,
+        access_token: str,
+    ) -> Dict[str, Any]:
+        """
+        Fetch follows and unfollows split by follow type
+        """
+        endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+        params = {
+            "metric": "follows_and_unfollows",
+            "period": "day",
+            "breakdown": "follow_type",
+            "metric_type": "total_value",
+            "access_token": access_token,
+        }
+
+        response = await transport.async_get(
+            endpoint, params=params, timeout=60
+        )
+        response.raise_for_status()
+
+        return demographics.format_breakdowns(
+            response.json(), "follows_and_unfollows"
+        )
+
+    @staticmethod
+    @cached("get_follower_demographics")
+    async def get_follower_demographics(
+        ig_id: str,
+        access_token: str,
+        timeframe: str,
+        breakdown: str,
+    ) -> Dict[str, Any]:
+        """
+        Follower demographics
+        breakdown: age, country, city, gender
+        timeframe: this_month, this_week
+        """
+        endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+        params = {
+            "metric": "follower_demographics",
+            "period": "lifetime",
+            "metric_type": "total_value",
+            "timeframe": timeframe,
+            "breakdown": breakdown,
+            "access_token": access_token,
+        }
+
+        response = await transport.async_get(
+            endpoint, params=params, timeout=60
+        )
+        response.raise_for_status()
+
+        return demographics.format_breakdowns(
+            response.json(), "follower_demographics"
+        )
+
+    @staticmethod
+    async def get_media_insights(
+        media_id: str, access_token: str, metrics: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch insights for a specific media item
+        """
+        metrics = metrics or InstagramService.MEDIA_INSIGHT_METRICS
+        try:
+            endpoint = f"{InstagramService.BASE_URL}/{media_id}/insights"
+            params = {
+                "metric": ",".join(metrics),
+                "access_token": access_token,
+            }
+
+            response = await transport.async_get(
+                endpoint, params=params, timeout=60
+            )
+            response.raise_for_status()
+
+            return InstagramService._format_media_insights(response.json())
+
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+    @staticmethod
+    async def get_media_insights_batch(
+        media_ids: List[str],
+        access_token: str,
+        metrics: Optional[List[str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch insights for several media items with batch requests
+        """
+        if not media_ids:
+            return {}
+
+        metrics = metrics or InstagramService.MEDIA_INSIGHT_METRICS
+        query = urlencode({"metric": ",".join(metrics)})
+        relative_urls = [
+            f"{media_id}/insights?{query}" for media_id in media_ids
+        ]
+
+        try:
+            bodies = await AsyncInstagramService.batch_get(
+                relative_urls, access_token
+            )
+        except httpx.HTTPError:
+            # Batch endpoint unavailable, fall back to one call per media
+            results = await asyncio.gather(
+                *(
+                    AsyncInstagramService.get_media_insights(
+                        media_id, access_token, metrics
+                    )
+                    for media_id in media_ids
+                )
+            )
+            return dict(zip(media_ids, results))
+
+        return {
+            media_id: (
+                body
+                if "error" in body
+                else InstagramService._format_media_insights(body)
+            )
+            for media_id, body in zip(media_ids, bodies)
+        }
+
+    @staticmethod
+    @cached("get_demographic_insights")
+    async def get_demographic_insights(
+        ig_id: str, access_token: str, fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Get demographic insights including location
+        by country, city, gender, and age, narrowed to fields like the
+        sync method
+        """
+        try:
+            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+            request = InstagramService._follower_demographics_request(fields)
+            params = {
+                "metric": ",".join(request["metrics"]),
+                **request["params"],
+                "access_token": access_token,
+            }
+
+            response = await transport.async_get(
+                endpoint, params=params, timeout=60
+            )
+            response.raise_for_status()
+
+            return InstagramService._demographic_fields(
+                demographics.format_follower_demographics(response.json()),
+                fields,
+            )
+
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
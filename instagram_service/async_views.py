@@ -0,0 +1,175 @@
+"""
+Async insight APIs for ASGI deployments
+"""
+
+import logging
+from abc import ABCMeta, abstractmethod
+from asgiref.sync import sync_to_async
+from adrf.views import APIView
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from . import insights_store, media_catalog
+from .async_instagram_service import AsyncInstagramService
+from .instagram_service import InstagramService
+from .utils import (
+    age_headers,
+    aget_instagram_account,
+    fields_param,
+    int_param,
+    post_engagements_params,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncInsightsView(APIView, metaclass=ABCMeta):
+    """
+    Base view serving one AsyncInstagramService call for the user's account
+
+    The upstream round trip does not hold a worker thread, so a single ASGI
+    worker can serve many dashboards at once. Views of stored insights
+    read the same stores as their sync counterparts.
+    """
+
+    permission_classes = [IsAuthenticated]
+    error_message = "Failed to fetch insights"
+    # Fields clients can narrow the result to with fields=, parsed into
+    # self.fields, None if the call has no sparse fieldsets
+    fieldset = None
+
+    def parse_params(self, request):
+        """
+        Parse the view's own query params into attributes
+
+        Returns:
+            An error response if some param is invalid, None otherwise
+        """
+        return None
+
+    @abstractmethod
+    async def fetch(self, request, account):
+        """
+        Result of the view's call, or a dict with an error, and its age in
+        seconds, None if unknown
+        """
+
+    async def get(self, request):
+        try:
+            account, error_response = await aget_instagram_account(request)
+            if error_response:
+                return error_response
+
+            self.fields = None
+            if self.fieldset:
+                self.fields, error_response = fields_param(
+                    request, self.fieldset
+                )
+                if error_response:
+                    return error_response
+
+            error_response = self.parse_params(request)
+            if error_response:
+                return error_response
+
+            data, age = await self.fetch(request, account)
+
+            if "error" in data:
+                logger.error(
+                    "Error in %s: %s", self.__class__.__name__, data["error"]
+                )
+                return Response(
+                    {"error": self.error_message},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                )
+
+            return Response(
+                data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age) if age is not None else None,
+            )
+
+        except Exception as e:
+            logger.exception(
+                "Unexpected error in %s %s", self.__class__.__name__, e
+            )
+            return Response(
+                {"error": "An unexpected error occurred"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
+class AsyncInstagramAccountInsightsView(AsyncInsightsView):
+    """
+    Async view to get basic account insights from Instagram
+    """
+
+    error_message = "Failed to fetch account insights"
+    fieldset = InstagramService.ACCOUNT_INSIGHT_FIELDS
+
+    async def fetch(self, request, account):
+        insights = await AsyncInstagramService.get_account_basic_insights(
+            account.provider_account_id, account.access_token, self.fields
+        )
+        return insights, None
+
+
+class AsyncInstagramFollowersGrowthView(AsyncInsightsView):
+    """
+    Async view to get followers growth data from Instagram
+    """
+
+    error_message = "Failed to fetch followers growth data"
+
+    async def fetch(self, request, account):
+        days = int_param(request, "days", 30)
+        return await sync_to_async(insights_store.get_followers_growth)(
+            account, days
+        )
+
+
+class AsyncInstagramPostEngagementsView(AsyncInsightsView):
+    """
+    Async view to get post engagements data from the media catalog
+    """
+
+    error_message = "Failed to fetch post engagements data"
+
+    def parse_params(self, request):
+        self.period, self.count, error_response = post_engagements_params(
+            request
+        )
+        return error_response
+
+    async def fetch(self, request, account):
+        return await sync_to_async(media_catalog.get_post_engagements)(
+            account, self.count, self.period
+        )
+
+
+class AsyncInstagramCurrentMonthLikesView(AsyncInsightsView):
+    """
+    Async view to get current month likes data from Instagram
+    """
+
+    error_message = "Failed to fetch current month likes data"
+
+    async def fetch(self, request, account):
+        return await sync_to_async(insights_store.get_current_month_likes)(
+            account
+        )
+
+
+class AsyncInstagramDemographicsView(AsyncInsightsView):
+    """
+    Async view to get demographic insights from Instagram
+    """
+
+    error_message = "Failed to fetch demographic insights"
+    fieldset = InstagramService.DEMOGRAPHIC_FIELDS
+
+    async def fetch(self, request, account):
+        demographics = await AsyncInstagramService.get_demographic_insights(
+            account.provider_account_id, account.access_token, self.fields
+        )
+        return demographics, None
@@ -0,0 +1,41 @@
+"""
+Background syncs of the local stores
+
+Requests finding an account due for a sync serve what is stored and
+start the sync here, on a pool shared by the process, instead of waiting
+for upstream. Each sync closes its database connections when it ends.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def submit(name: str, sync: Callable[[], None]):
+    """Run a sync in the background of this process"""
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.INSTAGRAM_STORE_SYNC_WORKERS,
+                thread_name_prefix="store-sync",
+            )
+
+    def run():
+        try:
+            sync()
+        except Exception:
+            logger.exception("Background %s failed", name)
+        finally:
+            connections.close_all()
+
+    _executor.submit(run)
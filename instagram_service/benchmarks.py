@@ -0,0 +1,480 @@
+"""
+Benchmarks of the Instagram service against a local fake Graph API
+
+Each benchmark returns rows of measurements, printed by the
+benchmark_instagram management command. Caching and coalescing are
+turned off while they run, so every call reaches the fake API.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+from unittest import mock
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from users.models import Account, User
+from . import async_views, bucketing, media_refresh, transport, views
+from .fake_graph import TIMESTAMP_FORMAT, FakeGraph
+from .instagram_service import InstagramService
+from .models import InstagramMedia
+
+Row = Dict[str, Any]
+
+IG_ID = "fake"
+ACCESS_TOKEN = "fake-token"
+
+
+@contextmanager
+def _uncached():
+    with override_settings(
+        INSTAGRAM_CACHE_ENABLED=False, INSTAGRAM_COALESCE_REQUESTS=False
+    ):
+        yield
+
+
+def _unpooled_session() -> requests.Session:
+    """Session of a single call, as module-level requests.get uses"""
+    session = requests.Session()
+    session.headers["Connection"] = "close"
+    return session
+
+
+def _dashboard_load():
+    """Live upstream calls of a dashboard load"""
+    InstagramService.get_account_basic_insights(IG_ID, ACCESS_TOKEN)
+    InstagramService.get_followers_growth(IG_ID, ACCESS_TOKEN, 30)
+    InstagramService.get_current_month_likes(IG_ID, ACCESS_TOKEN)
+    InstagramService.get_demographic_insights(IG_ID, ACCESS_TOKEN)
+
+
+def handshakes(loads: int = 20, handshake_ms: float = 50) -> List[Row]:
+    """
+    Connections opened per dashboard load, with a connection per call
+    and with the pooled transport
+
+    Args:
+        loads: Dashboard loads per transport
+        handshake_ms: Time the fake API takes to accept a connection,
+            standing for the TCP and TLS handshakes
+    """
+    rows = []
+    transports = {
+        "per call": mock.patch.object(
+            transport, "get_session", _unpooled_session
+        ),
+        "pooled": mock.patch.object(
+            transport, "_session", transport._build_session()
+        ),
+    }
+    for name, patch in transports.items():
+        graph = FakeGraph(handshake_delay=handshake_ms / 1000)
+        with graph, graph.patched(), _uncached(), patch, mock.patch.object(
+            transport, "_session_pid", transport.os.getpid()
+        ):
+            started = time.perf_counter()
+            for _ in range(loads):
+                _dashboard_load()
+            elapsed = time.perf_counter() - started
+
+        rows.append(
+            {
+                "transport": name,
+                "requests/load": graph.requests / loads,
+                "connections/load": graph.connections / loads,
+                "ms/load": round(elapsed / loads * 1000, 1),
+            }
+        )
+    return rows
+
+
+def batching(media: int = 100, latency_ms: float = 20) -> List[Row]:
+    """
+    Upstream calls and time to fetch the insights of media items, one
+    call per item as before batch requests and with batch requests
+
+    Args:
+        media: Media items
+        latency_ms: Time the fake API takes to answer each call
+    """
+    media_ids = [f"m{index}" for index in range(media)]
+    fetches = {
+        "per media": lambda: [
+            InstagramService.get_media_insights(media_id, ACCESS_TOKEN)
+            for media_id in media_ids
+        ],
+        "batch": lambda: InstagramService.get_media_insights_batch(
+            media_ids, ACCESS_TOKEN
+        ),
+    }
+
+    rows = []
+    for name, fetch in fetches.items():
+        graph = FakeGraph(media_count=media, delay=latency_ms / 1000)
+        with graph, graph.patched(), _uncached():
+            started = time.perf_counter()
+            fetch()
+            elapsed = time.perf_counter() - started
+
+        rows.append(
+            {
+                "fetch": name,
+                "upstream calls": graph.requests,
+                "ms": round(elapsed * 1000, 1),
+            }
+        )
+    return rows
+
+
+@contextmanager
+def _signed_in():
+    """
+    Requests authenticated as an unsaved user, each with an account of
+    its own, so that no database is needed and no token's in-flight limit
+    is shared
+    """
+    user = User(pk=1, email="benchmark@example.com")
+    numbers = itertools.count()
+
+    def account():
+        number = next(numbers)
+        return (
+            Account(
+                user=user,
+                provider="instagram",
+                provider_account_id=f"fake{number}",
+                access_token=f"fake-token-{number}",
+            ),
+            None,
+        )
+
+    async def async_account(request):
+        return account()
+
+    with mock.patch.object(
+        JWTAuthentication, "authenticate", return_value=(user, None)
+    ), mock.patch.object(
+        views,
+        "get_instagram_account",
+        side_effect=lambda request: account(),
+    ), mock.patch.object(
+        async_views, "aget_instagram_account", async_account
+    ), override_settings(
+        ALLOWED_HOSTS=["localhost"]
+    ):
+        yield
+
+
+def _wsgi_load(path: str, calls: int, concurrency: int) -> List[int]:
+    """Statuses of calls to a path, on a pool of concurrency threads"""
+    handler = WSGIHandler()
+    environ = RequestFactory(HTTP_HOST="localhost")._base_environ(
+        PATH_INFO=path, REQUEST_METHOD="GET"
+    )
+
+    def call(_):
+        statuses = []
+        response = handler(
+            dict(environ), lambda status, headers: statuses.append(status)
+        )
+        b"".join(response)
+        response.close()
+        return int(statuses[0].split()[0])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(call, range(calls)))
+
+
+def _asgi_load(path: str, calls: int, concurrency: int) -> List[int]:
+    """Statuses of calls to a path, concurrency of them at a time"""
+    handler = ASGIHandler()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+        statuses = []
+
+        async def call():
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+
+            async with slots:
+                await handler(dict(scope), receive, send)
+
+        await asyncio.gather(*(call() for _ in range(calls)))
+        await transport.get_async_client().aclose()
+        return statuses
+
+    return asyncio.run(run())
+
+
+def asgi(
+    calls: int = 300, concurrency: int = 100, latency_ms: float = 100
+) -> List[Row]:
+    """
+    Requests/sec and memory per concurrent request of the account
+    insights view, sync under WSGI with a thread per concurrent request
+    and async under ASGI
+
+    Memory is the peak of Python allocations during a second, traced run,
+    thread stacks are not included.
+
+    Args:
+        calls: Requests made to each deployment
+        concurrency: Requests in flight at once
+        latency_ms: Time the fake API takes to answer each call
+    """
+    deployments = {
+        "wsgi": (_wsgi_load, "/api/instagram/insights/account/"),
+        "asgi": (_asgi_load, "/api/instagram/async/insights/account/"),
+    }
+
+    rows = []
+    for name, (load, path) in deployments.items():
+        graph = FakeGraph(delay=latency_ms / 1000)
+        with graph, graph.patched(), _uncached(), _signed_in():
+            started = time.perf_counter()
+            statuses = load(path, calls, concurrency)
+            elapsed = time.perf_counter() - started
+
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            load(path, calls, concurrency)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        rows.append(
+            {
+                "deployment": name,
+                "ok": statuses.count(200),
+                "req/s": round(calls / elapsed, 1),
+                "KiB/concurrent request": round(
+                    (peak - baseline) / concurrency / 1024, 1
+                ),
+            }
+        )
+    return rows
+
+
+# Hours over which a synthetic post gains most of its engagement
+ENGAGEMENT_DECAY_HOURS = 24
+
+
+def _engagement_at(totals, age_hours):
+    """Engagement of synthetic posts, saturating towards their totals"""
+    return totals * (
+        1 - np.exp(-np.maximum(age_hours, 0) / ENGAGEMENT_DECAY_HOURS)
+    )
+
+
+def _percentile(values, percent: float) -> float:
+    return (
+        round(float(np.percentile(values, percent)), 1) if len(values) else 0.0
+    )
+
+
+def refresh(
+    posts: int = 100_000, days: int = 7, history_days: int = 365
+) -> List[Row]:
+    """
+    Media insights refreshed, and batch requests made, over a number of
+    days by the adaptive schedule of media_refresh and by polling every
+    post at the minimum interval, with the engagement each refresh finds
+    as a measure of staleness
+
+    Posts are published uniformly over the history and gain engagement
+    that saturates after about a day. Refreshes happen in sync passes,
+    one every minimum interval, each refreshing the posts then due.
+
+    Args:
+        posts: Synthetic posts
+        days: Days simulated
+        history_days: Days over which the posts were published
+    """
+    tick = settings.INSTAGRAM_REFRESH_MIN_INTERVAL
+    ticks = days * 86400 // tick
+    batch = InstagramService.BATCH_SIZE
+    rng = random.Random(0)
+    started = timezone.now()
+    ages = np.array([rng.uniform(0, history_days * 24) for _ in range(posts)])
+    totals = np.array(
+        [rng.lognormvariate(math.log(200), 1) for _ in range(posts)]
+    )
+
+    # Uniform polling, posts in chunks to bound memory
+    changes = []
+    for first in range(0, posts, 1000):
+        hours = (
+            ages[first:first + 1000, None]
+            + np.arange(ticks + 1) * tick / 3600
+        )
+        engagement = np.floor(
+            _engagement_at(totals[first:first + 1000, None], hours)
+        )
+        changes.append(np.diff(engagement, axis=1).ravel())
+    changes = np.concatenate(changes)
+    rows = [
+        {
+            "schedule": "uniform",
+            "refreshes": posts * (ticks + 1),
+            "batch requests": math.ceil(posts / batch) * (ticks + 1),
+            "requests saved": "0%",
+            "p99 change": _percentile(changes, 99),
+            "max change": _percentile(changes, 100),
+        }
+    ]
+
+    # Adaptive schedule, as refresh_media plans it
+    media = [
+        InstagramMedia(timestamp=started - timedelta(hours=float(age)))
+        for age in ages
+    ]
+    due = [(0, index) for index in range(posts)]
+    refreshes = requests_made = 0
+    changes = []
+    for step in range(ticks + 1):
+        now = started + timedelta(seconds=step * tick)
+        indexes = []
+        while due and due[0][0] <= step:
+            indexes.append(heapq.heappop(due)[1])
+        requests_made += math.ceil(len(indexes) / batch)
+        for index in indexes:
+            item = media[index]
+            previous = item.likes
+            item.likes = int(
+                _engagement_at(totals[index], ages[index] + step * tick / 3600)
+            )
+            if item.insights_updated_at is not None:
+                changes.append(item.likes - previous)
+            media_refresh.schedule(item, previous, now)
+            heapq.heappush(
+                due,
+                (
+                    math.ceil(
+                        (item.next_refresh_at - started).total_seconds() / tick
+                    ),
+                    index,
+                ),
+            )
+        refreshes += len(indexes)
+
+    rows.append(
+        {
+            "schedule": "adaptive",
+            "refreshes": refreshes,
+            "batch requests": requests_made,
+            "requests saved": (
+                f"{1 - requests_made / max(rows[0]['batch requests'], 1):.1%}"
+            ),
+            "p99 change": _percentile(changes, 99),
+            "max change": _percentile(changes, 100),
+        }
+    )
+    return rows
+
+
+def _python_monthly_means(timestamps: List[str], values, start, end, tz):
+    """Mean per month of the posts in the window, one post at a time"""
+    months = {}
+    for timestamp, value in zip(timestamps, values):
+        moment = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S%z")
+        if start <= moment <= end:
+            local = moment.astimezone(tz)
+            count, total = months.get((local.year, local.month), (0, 0))
+            months[(local.year, local.month)] = (count + 1, total + value)
+    return {month: total / count for month, (count, total) in months.items()}
+
+
+def calendar_buckets(sizes: str = "1000,100000,1000000") -> List[Row]:
+    """
+    Time to bucket posts by calendar month and average a metric per
+    month, with bucketing from Graph API timestamps and one post at a time
+    in Python as before
+
+    Posts are spread over the last two years, in the current timezone.
+
+    Args:
+        sizes: Comma-separated numbers of posts
+    """
+    tz = timezone.get_current_timezone()
+    end = timezone.now()
+    start = bucketing.window_start(end, "month", 24)
+    span = int((end - start).total_seconds())
+
+    rows = []
+    for posts in [int(size) for size in sizes.split(",")]:
+        rng = np.random.default_rng(0)
+        seconds = int(start.timestamp()) + rng.integers(0, span, posts)
+        timestamps = [
+            time.strftime(TIMESTAMP_FORMAT, time.gmtime(second))
+            for second in seconds.tolist()
+        ]
+        values = rng.integers(0, 1000, posts)
+
+        started = time.perf_counter()
+        _python_monthly_means(timestamps, values.tolist(), start, end, tz)
+        python = time.perf_counter() - started
+
+        started = time.perf_counter()
+        parsed = bucketing.parse_timestamps(timestamps)
+        parsing = time.perf_counter() - started
+        bucketing.aggregate(
+            parsed,
+            {"engagement": values},
+            "month",
+            start,
+            end,
+            tz,
+            statistics=["mean"],
+        )
+        bucketed = time.perf_counter() - started
+
+        rows.append(
+            {
+                "posts": posts,
+                "python ms": round(python * 1000, 1),
+                "parse ms": round(parsing * 1000, 1),
+                "parse+aggregate ms": round(bucketed * 1000, 1),
+                "speedup": f"{python / bucketed:.1f}x",
+            }
+        )
+    return rows
+
+
+BENCHMARKS = {
+    "handshakes": handshakes,
+    "batching": batching,
+    "asgi": asgi,
+    "refresh": refresh,
+    "bucketing": calendar_buckets,
+}
@@ -0,0 +1,234 @@
+"""
+Calendar-aware time bucketing of columnar engagement data
+
+Timestamps are assigned to day, week, month or quarter buckets of a given
+timezone with one binary search against the bucket boundaries, which are
+computed per bucket in that timezone, so months have their real length
+and days their real length across DST changes. Per-bucket count, sum,
+mean and median of every metric are then computed with array operations
+only, however many posts there are.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from django.utils import timezone
+
+GRANULARITIES = ["day", "week", "month", "quarter"]
+STATISTICS = ["count", "sum", "mean", "median"]
+
+
+def _floor(day: date, granularity: str) -> date:
+    """First day of the bucket containing day"""
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+
+def _shift(day: date, granularity: str, buckets: int = 1) -> date:
+    """
+    First day of the bucket that many buckets after the one starting on
+    day, before it if negative
+    """
+    if granularity == "day":
+        return day + timedelta(days=buckets)
+    if granularity == "week":
+        return day + timedelta(weeks=buckets)
+
+    months = buckets if granularity == "month" else 3 * buckets
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def _midnight(day: date, tz) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=tz)
+
+
+def floor(moment: datetime, granularity: str, tz=None) -> date:
+    """First day of the bucket containing moment, in tz"""
+    tz = tz or timezone.get_current_timezone()
+    return _floor(moment.astimezone(tz).date(), granularity)
+
+
+def window_start(
+    end: datetime, granularity: str, buckets: int, tz=None
+) -> datetime:
+    """
+    Start of the window made of the bucket containing end and the
+    buckets - 1 before it
+    """
+    tz = tz or timezone.get_current_timezone()
+    day = _shift(floor(end, granularity, tz), granularity, 1 - buckets)
+    return _midnight(day, tz)
+
+
+def bucket_starts(
+    start: datetime, end: datetime, granularity: str, tz=None
+) -> List[datetime]:
+    """
+    Start of every bucket from the one containing start to the one
+    containing end
+
+    Args:
+        start: First moment to cover, aware
+        end: Last moment to cover, aware
+        granularity: One of GRANULARITIES
+        tz: Timezone of the calendar, the current timezone by default
+
+    Returns:
+        Aware datetimes at local midnight of the first day of each bucket
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+
+    tz = tz or timezone.get_current_timezone()
+    day = floor(start, granularity, tz)
+    last = end.astimezone(tz).date()
+
+    starts = []
+    while day <= last:
+        starts.append(_midnight(day, tz))
+        day = _shift(day, granularity)
+    return starts
+
+
+def _offset_seconds(offset: str) -> int:
+    """Seconds east of UTC of an offset like +0000, -05:30 or Z"""
+    offset = offset.replace(":", "")
+    if offset in ("", "Z"):
+        return 0
+    seconds = int(offset[1:3]) * 3600 + int(offset[3:5] or 0) * 60
+    return -seconds if offset[0] == "-" else seconds
+
+
+def parse_timestamps(values: Iterable[str]) -> np.ndarray:
+    """
+    Epoch seconds of Graph API timestamps, e.g. 2024-05-01T10:00:00+0000
+
+    Date parts are parsed by NumPy, and UTC offsets once per distinct
+    offset.
+    """
+    values = list(values)
+    if not values:
+        return np.empty(0, dtype=np.int64)
+
+    local = np.array([value[:19] for value in values], dtype="datetime64[s]")
+    offsets, inverse = np.unique(
+        [value[19:] for value in values], return_inverse=True
+    )
+    seconds = np.array([_offset_seconds(offset) for offset in offsets])
+    return local.astype(np.int64) - seconds[inverse]
+
+
+def _median(values: np.ndarray, index: np.ndarray, counts: np.ndarray):
+    """Median of values per bucket, NaN for empty buckets"""
+    order = np.lexsort((values, index))
+    ordered = values[order].astype(np.float64)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    median = np.full(len(counts), np.nan)
+    filled = counts > 0
+    low = offsets[filled] + (counts[filled] - 1) // 2
+    high = offsets[filled] + counts[filled] // 2
+    median[filled] = (ordered[low] + ordered[high]) / 2
+    return median
+
+
+def _epoch_seconds(timestamps: Any) -> np.ndarray:
+    seconds = np.asarray(timestamps)
+    if np.issubdtype(seconds.dtype, np.datetime64):
+        seconds = seconds.astype("datetime64[s]")
+    return seconds.astype(np.int64)
+
+
+def assign(
+    timestamps: Any,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    tz=None,
+) -> Tuple[List[datetime], np.ndarray]:
+    """
+    Bucket of every timestamp
+
+    Args:
+        timestamps: Epoch seconds, or datetime64, of each post
+        granularity: One of GRANULARITIES
+        start: First moment to cover
+        end: Last moment to cover
+        tz: Timezone of the calendar, the current timezone by default
+
+    Returns:
+        Tuple of the bucket starts and the bucket index of every
+        timestamp, -1 for timestamps outside start and end, so for every
+        timestamp when start is after end
+    """
+    seconds = _epoch_seconds(timestamps)
+    starts = bucket_starts(start, end, granularity, tz)
+    if not starts:
+        return starts, np.full(len(seconds), -1, dtype=np.int64)
+
+    last = _midnight(_shift(starts[-1].date(), granularity), starts[-1].tzinfo)
+    bounds = np.array(
+        [moment.timestamp() for moment in starts + [last]], dtype=np.int64
+    )
+
+    index = np.searchsorted(bounds, seconds, side="right") - 1
+    outside = (seconds < int(start.timestamp())) | (
+        seconds > int(end.timestamp())
+    )
+    index[outside] = -1
+    return starts, index
+
+
+def aggregate(
+    timestamps: Any,
+    metrics: Dict[str, Any],
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    tz=None,
+    statistics: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Bucket posts by publish time and aggregate their metrics
+
+    Args:
+        timestamps: Epoch seconds, or datetime64, of each post
+        metrics: Metric name to the array of its value for each post
+        granularity: One of GRANULARITIES
+        start: First moment to cover, earlier posts are ignored
+        end: Last moment to cover, later posts are ignored
+        tz: Timezone of the calendar, the current timezone by default
+        statistics: Subset of STATISTICS to compute, all by default
+
+    Returns:
+        Dict with the bucket starts, the post count of every bucket and,
+        for every metric, an array per requested statistic. Means and
+        medians of empty buckets are NaN.
+    """
+    statistics = statistics or STATISTICS
+    starts, index = assign(timestamps, granularity, start, end, tz)
+    inside = index >= 0
+    index = index[inside]
+    counts = np.bincount(index, minlength=len(starts))
+
+    result = {"start": starts, "count": counts, "metrics": {}}
+    for name, values in metrics.items():
+        values = np.asarray(values)[inside]
+        stats = {}
+        sums = np.bincount(index, weights=values, minlength=len(starts))
+        if "sum" in statistics:
+            stats["sum"] = sums
+        if "mean" in statistics:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stats["mean"] = np.where(counts > 0, sums / counts, np.nan)
+        if "median" in statistics:
+            stats["median"] = _median(values, index, counts)
+        result["metrics"][name] = stats
+
+    return result
@@ -0,0 +1,322 @@
+"""
+Tiered cache of Instagram insights
+
+Results of the account-level InstagramService calls are kept in a small
+in-process LRU in front of Django's cache framework, each for as long as
+the metrics behind it take to refresh upstream (INSTAGRAM_CACHE_TTLS).
+Entries of an account are dropped when its token changes.
+
+Expired entries are kept for INSTAGRAM_CACHE_MAX_STALENESS more seconds,
+so dashboards can be answered from them while they are refreshed in the
+background (stale-while-revalidate).
+"""
+
+import functools
+import hashlib
+import inspect
+import threading
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Size-bounded in-process cache with per-entry expiry
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InsightsCache:
+    """
+    In-process LRU in front of the shared Django cache
+
+    Entries are stored with the time they were fetched. Local copies live
+    at most INSTAGRAM_CACHE_LOCAL_MAX_TTL seconds, so invalidations made
+    by another worker reach this one within that time.
+    """
+
+    def __init__(self):
+        self._local = None
+        self._lock = threading.Lock()
+        self._counters = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "expired_hits": 0,
+            "misses": 0,
+            "stale_served": 0,
+            "refreshes": 0,
+        }
+        self._refreshing = set()
+        self._executor = None
+
+    @property
+    def local(self) -> LRUCache:
+        if self._local is None:
+            self._local = LRUCache(settings.INSTAGRAM_CACHE_LOCAL_SIZE)
+        return self._local
+
+    def _incr(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _version_key(ig_id: str) -> str:
+        return f"instagram:insights:{ig_id}:version"
+
+    @staticmethod
+    def call_key(ig_id: str, method: str, params: Dict[str, Any]) -> str:
+        """Key of a call, from its account, method and normalized params"""
+        query = urlencode(sorted(params.items()))
+        digest = hashlib.sha256(query.encode()).hexdigest()[:16]
+        return f"instagram:insights:{ig_id}:{method}:{digest}"
+
+    def _shared_key(self, ig_id: str, key: str) -> str:
+        version = cache.get_or_set(self._version_key(ig_id), 1, None)
+        return f"{key}:v{version}"
+
+    def get(self, ig_id: str, key: str) -> Optional[Tuple[Any, float, float]]:
+        """
+        Cached entry of a call, expired entries included
+
+        Returns:
+            Tuple of the value, the time it was fetched and the time it
+            expires, None on a miss
+        """
+        entry = self.local.get(key)
+        tier = "local"
+        if entry is None:
+            entry = cache.get(self._shared_key(ig_id, key))
+            tier = "shared"
+            if entry is not None:
+                self.local.set(key, entry, self._local_ttl(entry[2]))
+
+        if entry is None:
+            self._incr("misses")
+        elif entry[2] > time.time():
+            self._incr(f"{tier}_hits")
+        else:
+            self._incr("expired_hits")
+
+        return entry
+
+    def set(self, ig_id: str, key: str, value: Any, ttl: int):
+        now = time.time()
+        entry = (value, now, now + ttl)
+        cache.set(
+            self._shared_key(ig_id, key),
+            entry,
+            ttl + settings.INSTAGRAM_CACHE_MAX_STALENESS,
+        )
+        self.local.set(key, entry, self._local_ttl(entry[2]))
+
+    @staticmethod
+    def _local_ttl(expires_at: float) -> float:
+        return min(
+            settings.INSTAGRAM_CACHE_LOCAL_MAX_TTL,
+            expires_at + settings.INSTAGRAM_CACHE_MAX_STALENESS - time.time(),
+        )
+
+    def revalidate(self, key: str, refresh: Callable[[], Any]):
+        """
+        Run refresh in the background, once per key across all workers
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            if not cache.add(
+                f"{key}:refresh", 1, settings.INSTAGRAM_CACHE_REFRESH_TIMEOUT
+            ):
+                return
+            self._refreshing.add(key)
+            self._counters["refreshes"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.INSTAGRAM_CACHE_REFRESH_WORKERS,
+                    thread_name_prefix="insights-refresh",
+                )
+
+        def run():
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                cache.delete(f"{key}:refresh")
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def served_stale(self):
+        self._incr("stale_served")
+
+    def invalidate(self, ig_id: str):
+        """Drop every cached call of an account, in all workers"""
+        try:
+            cache.incr(self._version_key(ig_id))
+        except ValueError:
+            # No version yet, so nothing cached in the shared tier
+            pass
+        self.local.delete_prefix(f"instagram:insights:{ig_id}:")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["local_size"] = len(self.local)
+        stats["local_evictions"] = self.local.evictions
+        return stats
+
+
+insights_cache = InsightsCache()
+
+
+def _call_params(signature, args, kwargs) -> Tuple[str, Dict[str, Any]]:
+    """Account ID and the remaining arguments of a service call"""
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = dict(bound.arguments)
+    params.pop("access_token", None)
+    return str(params.pop("ig_id")), params
+
+
+def cached(method: str):
+    """
+    Cache the results of an account-level service method
+
+    The method takes ig_id and access_token first, sync or async, and its
+    results are kept for INSTAGRAM_CACHE_TTLS[method] seconds. Error
+    results, and results with partial errors, are never cached.
+
+    Sync methods also get a with_age variant returning the result and its
+    age in seconds, which answers from an expired entry while refreshing
+    it in the background, unless the entry is more than
+    INSTAGRAM_CACHE_MAX_STALENESS seconds past its expiry, and a refresh
+    variant that always calls upstream.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def call_key(args, kwargs):
+            ig_id, params = _call_params(signature, args, kwargs)
+            return ig_id, InsightsCache.call_key(ig_id, method, params)
+
+        def lookup(args, kwargs):
+            if not settings.INSTAGRAM_CACHE_ENABLED:
+                return None, None, None
+            ig_id, key = call_key(args, kwargs)
+            return ig_id, key, insights_cache.get(ig_id, key)
+
+        def store(ig_id, key, result):
+            if (
+                key
+                and isinstance(result, dict)
+                and "error" not in result
+                and not result.get("errors")
+            ):
+                insights_cache.set(
+                    ig_id, key, result, settings.INSTAGRAM_CACHE_TTLS[method]
+                )
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                ig_id, key, entry = await sync_to_async(lookup)(args, kwargs)
+                if entry is not None and entry[2] > time.time():
+                    return entry[0]
+
+                result = await func(*args, **kwargs)
+                await sync_to_async(store)(ig_id, key, result)
+                return result
+
+            return async_wrapper
+
+        def call(args, kwargs, stale_ok):
+            ig_id, key, entry = lookup(args, kwargs)
+            now = time.time()
+
+            if entry is not None:
+                value, stored_at, expires_at = entry
+                if expires_at > now:
+                    return value, now - stored_at
+
+                if (
+                    stale_ok
+                    and now - expires_at
+                    <= settings.INSTAGRAM_CACHE_MAX_STALENESS
+                ):
+                    insights_cache.served_stale()
+                    insights_cache.revalidate(
+                        key,
+                        lambda: store(ig_id, key, func(*args, **kwargs)),
+                    )
+                    return value, now - stored_at
+
+            result = func(*args, **kwargs)
+            store(ig_id, key, result)
+            return result, 0.0
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return call(args, kwargs, stale_ok=False)[0]
+
+        def with_age(*args, **kwargs):
+            return call(args, kwargs, stale_ok=True)
+
+        def refresh(*args, **kwargs):
+            """Call upstream and cache the result, whatever is cached"""
+            result = func(*args, **kwargs)
+            if settings.INSTAGRAM_CACHE_ENABLED:
+                store(*call_key(args, kwargs), result)
+            return result
+
+        wrapper.with_age = with_age
+        wrapper.refresh = refresh
+        return wrapper
+
+    return decorator
@@ -0,0 +1,196 @@
+"""
+Single-flight coalescing of identical Graph API calls
+
+Identical GETs (same endpoint, params and token) made while one of them is
+in flight wait for that call and share its response instead of going
+upstream again. Calls of different tokens never share a response, which
+may hold data or a permission error only one of them is entitled to.
+Inside a process the waiters block on the in-flight call directly;
+across gunicorn workers the leader holds a lock in the shared cache and
+publishes its response there for the others.
+Only successful responses are shared, a waiter whose leader failed makes
+its own call.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from .concurrency import token_key
+
+# How often waiters in other workers look for the leader's response
+POLL_INTERVAL = 0.05
+
+
+def coalesce_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+    """Key of a call, with the fingerprint of the token that sends it"""
+    params = dict(params or {})
+    access_token = params.pop("access_token", None)
+    query = urlencode(sorted(params.items()))
+    token = token_key(access_token) if access_token else ""
+    return hashlib.sha256(f"{token} {url}?{query}".encode()).hexdigest()
+
+
+def _freeze(response) -> Dict[str, Any]:
+    return {
+        "status_code": response.status_code,
+        "content_type": response.headers.get(
+            "Content-Type", "application/json"
+        ),
+        "content": response.content,
+    }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls of the sync transport
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key: str, fetch: Callable, thaw: Callable):
+        """
+        Run fetch, or wait for the identical call already in flight
+
+        Args:
+            key: Key from coalesce_key
+            fetch: Sends the call and returns its response
+            thaw: Rebuilds a response from the shared cache
+
+        Returns:
+            Response of this call or of the one it joined
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait(settings.INSTAGRAM_COALESCE_TIMEOUT)
+            response = flight.response
+            if response is not None and response.status_code == 200:
+                return response
+            return fetch()
+
+        try:
+            flight.response = self._across_workers(key, fetch, thaw)
+            return flight.response
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _across_workers(self, key: str, fetch: Callable, thaw: Callable):
+        lock_key = f"instagram:flight:{key}"
+        flight_id = uuid.uuid4().hex
+
+        if cache.add(lock_key, flight_id, settings.INSTAGRAM_COALESCE_TIMEOUT):
+            try:
+                response = fetch()
+                if response.status_code == 200:
+                    cache.set(
+                        f"{lock_key}:{flight_id}",
+                        _freeze(response),
+                        settings.INSTAGRAM_COALESCE_RESULT_TTL,
+                    )
+                return response
+            finally:
+                cache.delete(lock_key)
+
+        # Another worker is sending the same call
+        deadline = time.monotonic() + settings.INSTAGRAM_COALESCE_TIMEOUT
+        leader_id = cache.get(lock_key)
+        while leader_id and time.monotonic() < deadline:
+            frozen = cache.get(f"{lock_key}:{leader_id}")
+            if frozen:
+                return thaw(frozen)
+
+            time.sleep(POLL_INTERVAL)
+            if cache.get(lock_key) != leader_id:
+                # Leader finished, its response was shared if successful
+                frozen = cache.get(f"{lock_key}:{leader_id}")
+                return thaw(frozen) if frozen else fetch()
+
+        return fetch()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces identical calls of the async transport
+    """
+
+    def __init__(self):
+        # asyncio futures are bound to the loop that created them
+        self._flights = weakref.WeakKeyDictionary()
+
+    async def do(self, key: str, fetch: Callable, thaw: Callable):
+        """Async counterpart of SingleFlight.do, fetch is a coroutine"""
+        flights = self._flights.setdefault(asyncio.get_running_loop(), {})
+        flight = flights.get(key)
+
+        if flight is not None:
+            response = await asyncio.shield(flight)
+            if response is not None and response.status_code == 200:
+                return response
+            return await fetch()
+
+        flight = flights[key] = asyncio.get_running_loop().create_future()
+        response = None
+        try:
+            response = await self._across_workers(key, fetch, thaw)
+            return response
+        finally:
+            del flights[key]
+            flight.set_result(response)
+
+    async def _across_workers(self, key: str, fetch: Callable, thaw: Callable):
+        lock_key = f"instagram:flight:{key}"
+        flight_id = uuid.uuid4().hex
+
+        if await cache.aadd(
+            lock_key, flight_id, settings.INSTAGRAM_COALESCE_TIMEOUT
+        ):
+            try:
+                response = await fetch()
+                if response.status_code == 200:
+                    await cache.aset(
+                        f"{lock_key}:{flight_id}",
+                        _freeze(response),
+                        settings.INSTAGRAM_COALESCE_RESULT_TTL,
+                    )
+                return response
+            finally:
+                await cache.adelete(lock_key)
+
+        deadline = time.monotonic() + settings.INSTAGRAM_COALESCE_TIMEOUT
+        leader_id = await cache.aget(lock_key)
+        while leader_id and time.monotonic() < deadline:
+            frozen = await cache.aget(f"{lock_key}:{leader_id}")
+            if frozen:
+                return thaw(frozen)
+
+            await asyncio.sleep(POLL_INTERVAL)
+            if await cache.aget(lock_key) != leader_id:
+                frozen = await cache.aget(f"{lock_key}:{leader_id}")
+                return thaw(frozen) if frozen else await fetch()
+
+        return await fetch()
+
+
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
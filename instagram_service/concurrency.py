@@ -0,0 +1,84 @@
+"""
+Bounded concurrency for fanning out Graph API calls
+"""
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, TypeVar
+from django.conf import settings
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_lock = threading.Lock()
+# Slots and number of holders or waiters, per token key
+_token_slots = {}
+
+
+def token_key(access_token: str) -> str:
+    """Stable, non-reversible key for an access token"""
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+def _enter(key: str) -> threading.BoundedSemaphore:
+    with _lock:
+        entry = _token_slots.get(key)
+        if entry is None:
+            entry = [
+                threading.BoundedSemaphore(
+                    settings.INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN
+                ),
+                0,
+            ]
+            _token_slots[key] = entry
+        entry[1] += 1
+    return entry[0]
+
+
+def _leave(key: str):
+    with _lock:
+        entry = _token_slots[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del _token_slots[key]
+
+
+@contextmanager
+def token_slot(access_token: str):
+    """
+    Hold one of the in-flight slots of an access token
+
+    Every upstream call made with a token goes through here, so the limit
+    applies across requests and threads of the same process. The slots of
+    a token are dropped once nobody holds or waits for them.
+    """
+    key = token_key(access_token)
+    slots = _enter(key)
+    try:
+        with slots:
+            yield
+    finally:
+        _leave(key)
+
+
+def fan_out(func: Callable[[T], R], items: Iterable[T]) -> List[R]:
+    """
+    Call func for every item concurrently
+
+    Args:
+        func: Callable run once per item
+        items: Items to process
+
+    Returns:
+        List of results in the same order as items
+    """
+    items = list(items)
+    workers = min(len(items), settings.INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN)
+
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
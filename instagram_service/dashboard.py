@@ -0,0 +1,261 @@
+"""
+Dashboard of an account, every panel built in one request
+
+Panels are built concurrently for an account resolved once by the view.
+Panels served from the same store run one after the other in a single
+task, so the first one syncs the store and the others read what it
+stored instead of racing it. Live panels are fetched together, with one
+planned insights call per dashboard build, see
+InstagramService.get_dashboard_insights, made by the first of them to
+need it. The averages of the account insights panel come from the media
+catalog, which the post engagements panel syncs first, so a build lists
+the account's media once. A panel that fails only fails itself: its
+error is reported next to the other panels, each with how long it took.
+
+Panels are handed over as soon as each one is built, so they can be
+streamed to the client, from a sync iterator under WSGI or an async one
+under ASGI.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from users.models import Account
+from . import insights_store, media_catalog
+from .instagram_service import InstagramService
+
+logger = logging.getLogger(__name__)
+
+PanelResult = Tuple[Dict[str, Any], float]
+
+
+def _account_insights(account: Account, params: Dict[str, Any]) -> PanelResult:
+    live, age = params["live_insights"]()
+    totals = live["account_totals"]
+    if "error" in totals:
+        return totals, 0
+    return media_catalog.get_account_insights(account, totals), age
+
+
+def _followers_growth(account: Account, params: Dict[str, Any]) -> PanelResult:
+    return insights_store.get_followers_growth(account, params["days"])
+
+
+def _current_month_likes(
+    account: Account, params: Dict[str, Any]
+) -> PanelResult:
+    return insights_store.get_current_month_likes(account)
+
+
+def _post_engagements(account: Account, params: Dict[str, Any]) -> PanelResult:
+    return media_catalog.get_post_engagements(
+        account, params["count"], params["period"]
+    )
+
+
+def _demographics(account: Account, params: Dict[str, Any]) -> PanelResult:
+    live, age = params["live_insights"]()
+    return live["demographics"], age
+
+
+PANELS: Dict[str, Callable[[Account, Dict[str, Any]], PanelResult]] = {
+    "account_insights": _account_insights,
+    "followers_growth": _followers_growth,
+    "current_month_likes": _current_month_likes,
+    "post_engagements": _post_engagements,
+    "demographics": _demographics,
+}
+
+# Part of InstagramService.get_dashboard_insights each live panel needs
+LIVE_INSIGHTS = {
+    "account_insights": "account_totals",
+    "demographics": "demographics",
+}
+
+# Panels reading the same store, built in this order by one task
+SHARED_SYNCS = [
+    ["followers_growth", "current_month_likes"],
+    ["post_engagements", "account_insights"],
+]
+
+
+def _tasks(panels: List[str]) -> List[List[str]]:
+    """Panels grouped into tasks, those sharing a store together"""
+    tasks = []
+    grouped = set()
+    for group in SHARED_SYNCS:
+        task = [name for name in group if name in panels]
+        if task:
+            tasks.append(task)
+            grouped.update(task)
+    tasks.extend([name] for name in panels if name not in grouped)
+    return tasks
+
+
+def _once(fetch: Callable[[], Any]) -> Callable[[], Any]:
+    """fetch, called by the first caller, the others wait for its result"""
+    lock = threading.Lock()
+    results = []
+
+    def get():
+        with lock:
+            if not results:
+                results.append(fetch())
+        return results[0]
+
+    return get
+
+
+def _live_insights(account: Account, panels: List[str]):
+    """Fetch of the live insights the panels need, made once per build"""
+    parts = [LIVE_INSIGHTS[name] for name in panels if name in LIVE_INSIGHTS]
+    return _once(
+        lambda: InstagramService.get_dashboard_insights.with_age(
+            account.provider_account_id, account.access_token, parts
+        )
+    )
+
+
+def _build_panel(
+    account: Account, name: str, params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """One panel with its data, or its error, and timing"""
+    started = time.perf_counter()
+    try:
+        data, age = PANELS[name](account, params)
+    except Exception:
+        logger.exception("Unexpected error building dashboard panel %s", name)
+        data, age = {"error": "An unexpected error occurred"}, 0
+
+    panel = {"duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+    if "error" in data:
+        logger.error(
+            "Error building dashboard panel %s of account %s: %s",
+            name,
+            account.pk,
+            data["error"],
+        )
+        panel["error"] = f"Failed to fetch {name.replace('_', ' ')}"
+    else:
+        panel["age"] = int(age)
+        panel["data"] = data
+    return panel
+
+
+def _start(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> queue.Queue:
+    """
+    Start building panels in worker threads
+
+    Returns:
+        Queue receiving a (name, panel) tuple as each panel is built
+    """
+    built = queue.Queue()
+    tasks = _tasks(panels)
+    params = {**params, "live_insights": _live_insights(account, panels)}
+
+    def run(task):
+        try:
+            for name in task:
+                built.put((name, _build_panel(account, name, params)))
+        finally:
+            connections.close_all()
+
+    # Workers finish their panels even if the client goes away, filling
+    # the caches for the next request
+    executor = ThreadPoolExecutor(
+        max_workers=max(
+            min(len(tasks), settings.INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN), 1
+        ),
+        thread_name_prefix="dashboard",
+    )
+    for task in tasks:
+        executor.submit(run, task)
+    executor.shutdown(wait=False)
+    return built
+
+
+def iter_panels(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(name, panel) tuples of the requested panels, as they are built"""
+    built = _start(account, panels, params)
+    for _ in panels:
+        yield built.get()
+
+
+async def aiter_panels(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Async counterpart of iter_panels, for ASGI responses"""
+    built = _start(account, panels, params)
+    # Waiting must not hold the thread shared by sync code
+    get = sync_to_async(built.get, thread_sensitive=False)
+    for _ in panels:
+        yield await get()
+
+
+def summary(
+    built: Dict[str, Dict[str, Any]], started: float
+) -> Dict[str, Any]:
+    """Names of the failed panels and the total duration"""
+    return {
+        "errors": [name for name, panel in built.items() if "error" in panel],
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def events(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Events of a streamed dashboard: a "panel" event per panel as soon as
+    it is built, then a "done" event with the summary
+    """
+    started = time.perf_counter()
+    built = {}
+    for name, panel in iter_panels(account, panels, params):
+        built[name] = panel
+        yield "panel", {"name": name, **panel}
+    yield "done", summary(built, started)
+
+
+async def aevents(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Async counterpart of events, for ASGI responses"""
+    started = time.perf_counter()
+    built = {}
+    async for name, panel in aiter_panels(account, panels, params):
+        built[name] = panel
+        yield "panel", {"name": name, **panel}
+    yield "done", summary(built, started)
+
+
+def build(
+    account: Account, panels: List[str], params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Build the requested panels of an account's dashboard
+
+    Args:
+        account: Connected Instagram account
+        panels: Names of the panels, from PANELS
+        params: Panel params: days of follower growth, period and count
+            of post engagements
+
+    Returns:
+        Dict with the panels by name, the names of those that failed and
+        the total duration
+    """
+    started = time.perf_counter()
+    built = dict(iter_panels(account, panels, params))
+    ordered = {name: built[name] for name in panels}
+    return {"panels": ordered, **summary(ordered, started)}
@@ -0,0 +1,127 @@
+"""
+Decoder of Graph API insights breakdowns
+
+Every breakdown of a total_value metric is turned into a columnar table:
+its dimensions in a fixed order, one tuple of dimension values per row and
+the values in a separate list. The position of each dimension in the
+results is resolved once per breakdown rather than once per row, so large
+city breakdowns decode in a single pass. The per-dimension lists of the
+demographics view are built from these tables.
+"""
+
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List
+
+# Order of the dimensions in decoded tables, whatever the order requested
+DIMENSIONS = ["age", "gender", "country", "city", "follow_type"]
+
+
+def _ordered(dimension_keys: List[str]) -> List[str]:
+    """Known dimensions in DIMENSIONS order, then unknown ones as given"""
+    known = [key for key in DIMENSIONS if key in dimension_keys]
+    return known + [key for key in dimension_keys if key not in DIMENSIONS]
+
+
+def decode_breakdown(breakdown: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Columnar table of one breakdown
+
+    Returns:
+        Dict with the dimensions, the tuple of dimension values of every
+        row (keys) and the value of every row (values)
+    """
+    dimension_keys = breakdown.get("dimension_keys", [])
+    dimensions = _ordered(dimension_keys)
+    results = breakdown.get("results", [])
+
+    positions = [dimension_keys.index(key) for key in dimensions]
+    if not positions:
+        # itemgetter needs at least one item, rows without dimensions
+        keys = [() for result in results]
+    elif len(positions) == 1:
+        position = positions[0]
+        keys = [(result["dimension_values"][position],) for result in results]
+    else:
+        getter = itemgetter(*positions)
+        keys = [getter(result["dimension_values"]) for result in results]
+
+    return {
+        "dimensions": dimensions,
+        "keys": keys,
+        "values": [result["value"] for result in results],
+    }
+
+
+def _breakdowns(data: Dict[str, Any], metric: str) -> Iterator[Dict[str, Any]]:
+    for item in data.get("data", []):
+        if item.get("name") == metric:
+            yield from item.get("total_value", {}).get("breakdowns", [])
+
+
+def decode(data: Dict[str, Any], metric: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Tables of every breakdown of a metric in an insights response
+
+    Returns:
+        Dict mapping the comma-separated dimensions of each table, e.g.
+        "age,gender", to the table
+    """
+    tables = {}
+    for breakdown in _breakdowns(data, metric):
+        table = decode_breakdown(breakdown)
+        tables[",".join(table["dimensions"])] = table
+    return tables
+
+
+def _rows(table: Dict[str, Any], *dimensions: str) -> List[Dict[str, Any]]:
+    """Rows of a table as dicts of the given dimensions and the value"""
+    if len(dimensions) == 1:
+        name = dimensions[0]
+        position = table["dimensions"].index(name)
+        return [
+            {name: key[position], "value": value}
+            for key, value in zip(table["keys"], table["values"])
+        ]
+
+    positions = [table["dimensions"].index(name) for name in dimensions]
+    return [
+        {
+            **{
+                name: key[position]
+                for name, position in zip(dimensions, positions)
+            },
+            "value": value,
+        }
+        for key, value in zip(table["keys"], table["values"])
+    ]
+
+
+def format_breakdowns(data: Dict[str, Any], metric: str) -> Dict[str, Any]:
+    """Response of a demographics method, its breakdowns as tables"""
+    return {"breakdowns": decode(data, metric)}
+
+
+def format_follower_demographics(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Split follower demographics into per-dimension lists, the shape served
+    by the demographics view
+    """
+    demographics = {
+        "countries": [],
+        "cities": [],
+        "gender_split": [],
+        "age_gender_split": [],
+    }
+
+    for table in decode(data, "follower_demographics").values():
+        dimensions = table["dimensions"]
+        if "country" in dimensions:
+            demographics["countries"] = _rows(table, "country")
+        if "city" in dimensions:
+            demographics["cities"] = _rows(table, "city")
+        if "gender" in dimensions and "age" not in dimensions:
+            demographics["gender_split"] = _rows(table, "gender")
+        if "gender" in dimensions and "age" in dimensions:
+            demographics["age_gender_split"] = _rows(table, "gender", "age")
+
+    return demographics
@@ -0,0 +1,127 @@
+"""
+Monthly and weekly engagement totals of each account's posts
+
+Posts are bucketed by the calendar month and week they were published
+in, in TIME_ZONE. Buckets are updated with deltas whenever the counters
+of a media item are refreshed, so engagement charts for any number of
+months are a single range query on EngagementRollup.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from django.db.models import F
+from django.utils import timezone
+from users.models import Account
+from . import bucketing
+from .models import EngagementRollup
+
+ENGAGEMENT_FIELDS = ["likes", "comments", "shares", "saved"]
+ROLLUP_FIELDS = ENGAGEMENT_FIELDS + ["reach"]
+PERIODS = [EngagementRollup.MONTH, EngagementRollup.WEEK]
+
+# (publish time, counters before the refresh or None if the media item
+# was never counted, counters after the refresh)
+Change = Tuple[datetime, Optional[Dict[str, int]], Dict[str, int]]
+
+
+def period_start(moment: datetime, period: str) -> date:
+    """First day of the month or week containing moment, in TIME_ZONE"""
+    return bucketing.floor(moment, period)
+
+
+def _previous_starts(period: str, count: int) -> List[date]:
+    """Starts of the current period and the count - 1 before, oldest first"""
+    now = timezone.now()
+    return [
+        start.date()
+        for start in bucketing.bucket_starts(
+            bucketing.window_start(now, period, count), now, period
+        )
+    ]
+
+
+def apply(account: Account, changes: Iterable[Change]):
+    """
+    Add the counter changes of refreshed media items to their buckets
+
+    Must run in the transaction that stores the new counters, so a
+    change is never counted twice or lost.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for published, old, new in changes:
+        if published is None:
+            continue
+        for period in PERIODS:
+            delta = deltas[(period, period_start(published, period))]
+            if old is None:
+                delta["post_count"] += 1
+            for field in ROLLUP_FIELDS:
+                delta[field] += new[field] - (old or {}).get(field, 0)
+
+    if not deltas:
+        return
+
+    EngagementRollup.objects.bulk_create(
+        [
+            EngagementRollup(account=account, period=period, start=start)
+            for period, start in deltas
+        ],
+        ignore_conflicts=True,
+    )
+    for (period, start), delta in deltas.items():
+        changed = {
+            field: F(field) + value for field, value in delta.items() if value
+        }
+        if changed:
+            account.engagement_rollups.filter(
+                period=period, start=start
+            ).update(updated_at=timezone.now(), **changed)
+
+
+def post_engagements(
+    account: Account, period: str, count: int
+) -> Tuple[Dict[str, Any], float]:
+    """
+    Average engagement per post for the last count months or weeks
+
+    Returns:
+        Tuple of the engagements, one item per month or week with its
+        average engagement and post count, and the seconds since the
+        buckets last changed
+    """
+    starts = _previous_starts(period, count)
+    rollups = {
+        rollup.start: rollup
+        for rollup in account.engagement_rollups.filter(
+            period=period, start__gte=starts[0]
+        )
+    }
+
+    result = []
+    for start in starts:
+        rollup = rollups.get(start)
+        post_count = rollup.post_count if rollup else 0
+        engagement = (
+            sum(getattr(rollup, field) for field in ENGAGEMENT_FIELDS)
+            if rollup
+            else 0
+        )
+        result.append(
+            {
+                period: (
+                    start.strftime("%Y-%m")
+                    if period == EngagementRollup.MONTH
+                    else start.isoformat()
+                ),
+                "average_engagement": (
+                    engagement / post_count if post_count > 0 else 0
+                ),
+                "post_count": post_count,
+            }
+        )
+
+    updated = [rollup.updated_at for rollup in rollups.values()]
+    age = (timezone.now() - max(updated)).total_seconds() if updated else 0
+
+    return {f"post_engagements_by_{period}": result}, age
@@ -0,0 +1,339 @@
+"""
+Local fake of the Instagram Graph API, for tests and benchmarks
+
+Serves canned responses to the calls InstagramService makes, batch
+requests included, over plain HTTP on a local port. Media IDs are "m"
+followed by their index, newest first, one post every three days. The
+server counts the requests it answers and the TCP connections they
+arrive on, and can delay responses and new connections, the latter
+standing for the TCP and TLS handshakes of the real API, add headers
+such as the usage headers, or fail a number of responses.
+"""
+
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from .instagram_service import InstagramService
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S+0000"
+DAY = 86400
+
+
+class FakeGraph:
+    """
+    Fake Graph API server, started by entering it
+
+        with FakeGraph(media_count=100) as graph, graph.patched():
+            InstagramService.get_account_basic_insights(...)
+    """
+
+    def __init__(
+        self,
+        media_count: int = 30,
+        delay: float = 0.0,
+        handshake_delay: float = 0.0,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.media_count = media_count
+        self.delay = delay
+        self.handshake_delay = handshake_delay
+        self.headers = headers or {}
+        # Responses still to fail, with a 500 and a transient error
+        self.failures = 0
+        self.requests = 0
+        self.connections = 0
+        self.paths: List[str] = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGraph":
+        graph = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.graph = graph
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeGraph":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextmanager
+    def patched(self):
+        """Point InstagramService, and so AsyncInstagramService, here"""
+        with mock.patch.multiple(
+            InstagramService,
+            BASE_URL=f"{self.url}/{InstagramService.API_VERSION}",
+            HOST_URL=self.url,
+            BATCH_URL=self.url,
+        ):
+            yield self
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.connections = 0
+            self.paths = []
+
+    def _count(self, path: str) -> bool:
+        """Count a request, True if it must fail"""
+        with self._lock:
+            self.requests += 1
+            self.paths.append(path)
+            if self.failures > 0:
+                self.failures -= 1
+                return True
+        return False
+
+    def _timestamp(self, index: int) -> str:
+        return time.strftime(
+            TIMESTAMP_FORMAT, time.gmtime(time.time() - index * 3 * DAY)
+        )
+
+    def _media(self, index: int) -> Dict[str, Any]:
+        media = {
+            "id": f"m{index}",
+            "media_type": "CAROUSEL_ALBUM" if index % 2 else "IMAGE",
+            "media_url": f"https://cdn.example.com/m{index}.jpg",
+            "like_count": index,
+            "permalink": f"https://www.instagram.com/p/m{index}/",
+            "timestamp": self._timestamp(index),
+            "username": "fake",
+        }
+        if index % 2:
+            media["children"] = {
+                "data": [
+                    {
+                        "id": f"m{index}c{child}",
+                        "media_type": "IMAGE",
+                        "media_url": (
+                            f"https://cdn.example.com/m{index}c{child}.jpg"
+                        ),
+                    }
+                    for child in range(2)
+                ]
+            }
+        return media
+
+    @staticmethod
+    def _select(data: Dict[str, Any], fields: Optional[str]):
+        """Fields of a node, with children{...} expansions"""
+        if not fields:
+            return data
+
+        selected = {"id": data["id"]}
+        for name, sub_fields in re.findall(r"(\w+)(?:\{([^}]*)\})?", fields):
+            if name not in data:
+                continue
+            if name == "children" and sub_fields:
+                names = sub_fields.split(",")
+                selected[name] = {
+                    "data": [
+                        {key: child[key] for key in names if key in child}
+                        for child in data[name]["data"]
+                    ]
+                }
+            else:
+                selected[name] = data[name]
+        return selected
+
+    def _media_page(self, query: Dict[str, str]) -> Dict[str, Any]:
+        start = int(query.get("after") or 0)
+        limit = int(query.get("limit") or 25)
+        end = min(start + limit, self.media_count)
+        page = {
+            "data": [
+                self._select(self._media(index), query.get("fields"))
+                for index in range(start, end)
+            ],
+            "paging": {"cursors": {"before": str(start), "after": str(end)}},
+        }
+        if end < self.media_count:
+            page["paging"]["next"] = f"{self.url}/media?after={end}"
+        return page
+
+    @staticmethod
+    def _media_insights(index: int, query: Dict[str, str]):
+        metrics = (query.get("metric") or "").split(",")
+        return {
+            "data": [
+                {"name": metric, "values": [{"value": index + offset}]}
+                for offset, metric in enumerate(metrics)
+                if metric
+            ]
+        }
+
+    @staticmethod
+    def _account_insights(query: Dict[str, str]) -> Dict[str, Any]:
+        data = []
+        for metric in (query.get("metric") or "").split(","):
+            if query.get("metric_type") == "time_series":
+                since, until = int(query["since"]), int(query["until"])
+                data.append(
+                    {
+                        "name": metric,
+                        "period": "day",
+                        "values": [
+                            {
+                                "value": 100 + day,
+                                "end_time": time.strftime(
+                                    TIMESTAMP_FORMAT,
+                                    time.gmtime(since + (day + 1) * DAY),
+                                ),
+                            }
+                            for day in range((until - since) // DAY)
+                        ],
+                    }
+                )
+            elif query.get("breakdown"):
+                data.append(
+                    {
+                        "name": metric,
+                        "total_value": {
+                            "breakdowns": [
+                                {
+                                    "dimension_keys": [key],
+                                    "results": [
+                                        {
+                                            "dimension_values": [f"{key}{n}"],
+                                            "value": n + 1,
+                                        }
+                                        for n in range(5)
+                                    ],
+                                }
+                                for key in query["breakdown"].split(",")
+                            ]
+                        },
+                    }
+                )
+            else:
+                data.append({"name": metric, "total_value": {"value": 1000}})
+        return {"data": data}
+
+    def respond(self, path: str, query: Dict[str, str]) -> Dict[str, Any]:
+        """Body of a GET, relative to the host"""
+        version = InstagramService.API_VERSION
+        match = re.match(rf"^/{version}/(\w+)/media$", path)
+        if match:
+            return self._media_page(query)
+
+        match = re.match(rf"^/{version}/m(\d+)/insights$", path)
+        if match:
+            return self._media_insights(int(match.group(1)), query)
+
+        match = re.match(rf"^/{version}/m(\d+)$", path)
+        if match:
+            return self._select(
+                self._media(int(match.group(1))), query.get("fields")
+            )
+
+        match = re.match(rf"^/{version}/(\w+)/insights$", path)
+        if match:
+            return self._account_insights(query)
+
+        return {"id": path.rsplit("/", 1)[-1]}
+
+    def respond_batch(self, batch: List[Dict[str, Any]]):
+        items = []
+        for request in batch:
+            url = urlparse("/" + request["relative_url"].lstrip("/"))
+            body = self.respond(url.path, _query(url.query))
+            items.append({"code": 200, "body": json.dumps(body)})
+        return items
+
+
+def _query(query_string: str) -> Dict[str, str]:
+    return {name: values[0] for name, values in parse_qs(query_string).items()}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for the connections of load benchmarks
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so connections are only opened when clients need them
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written apart, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+    graph: FakeGraph
+
+    def setup(self):
+        with self.graph._lock:
+            self.graph.connections += 1
+        if self.graph.handshake_delay:
+            time.sleep(self.graph.handshake_delay)
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, status: int = 200):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in self.graph.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _fail(self):
+        self._send(
+            {
+                "error": {
+                    "message": "An unexpected error has occurred",
+                    "code": 2,
+                    "is_transient": True,
+                }
+            },
+            500,
+        )
+
+    def do_GET(self):
+        fail = self.graph._count(self.path)
+        if self.graph.delay:
+            time.sleep(self.graph.delay)
+        if fail:
+            return self._fail()
+
+        url = urlparse(self.path)
+        self._send(self.graph.respond(url.path, _query(url.query)))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = _query(self.rfile.read(length).decode())
+        fail = self.graph._count(f"POST {self.path}")
+        if self.graph.delay:
+            time.sleep(self.graph.delay)
+        if fail:
+            return self._fail()
+
+        if "batch" in form:
+            return self._send(
+                self.graph.respond_batch(json.loads(form["batch"]))
+            )
+        self._send({"access_token": "fake-token", "user_id": "fake"})
@@ -0,0 +1,230 @@
+"""
+Backfill of an account's daily metrics history
+
+The history is split into windows the Graph API accepts, which are
+fetched concurrently, paced by the rate limiter and in-flight limit of
+the account's token, and upserted into InsightPoint as each completes,
+so overlapping days are stored once. Completed windows are recorded on
+the BackfillJob: a job interrupted with its process is resumed by the
+sync_instagram worker with only the remaining windows.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+import requests
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from users.models import Account
+from . import insights_planner, insights_store
+from .concurrency import fan_out
+from .instagram_service import InstagramService
+from .models import BackfillJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = [BackfillJob.PENDING, BackfillJob.RUNNING]
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _submit(job_pk: int):
+    """Run a job in the background of this process"""
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.INSTAGRAM_BACKFILL_WORKERS,
+                thread_name_prefix="insights-backfill",
+            )
+
+    def run_job():
+        try:
+            run(job_pk)
+        except Exception as e:
+            logger.exception("Backfill job %s failed", job_pk)
+            BackfillJob.objects.filter(pk=job_pk).update(
+                status=BackfillJob.FAILED,
+                error=str(e),
+                finished_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+        finally:
+            connections.close_all()
+
+    _executor.submit(run_job)
+
+
+def start(account: Account, days: int) -> Tuple[BackfillJob, bool]:
+    """
+    Start backfilling the last days of an account's daily metrics
+
+    Returns:
+        Tuple of the job and whether it was started, False if a job of
+        the account was already active
+    """
+    until = timezone.now()
+    since = until - timedelta(days=days)
+
+    with transaction.atomic():
+        # Serializes concurrent starts for the same account
+        Account.objects.select_for_update().filter(pk=account.pk).first()
+        job = account.backfill_jobs.filter(status__in=ACTIVE).first()
+        if job is not None:
+            return job, False
+
+        # Resume a failed job covering the range, keeping its progress,
+        # with windows added for the days since it was planned
+        job = (
+            account.backfill_jobs.filter(
+                status=BackfillJob.FAILED, since__lte=since
+            )
+            .order_by("-created_at")
+            .first()
+        )
+        if job is not None:
+            job.windows += insights_planner.windows(
+                int(job.until.timestamp()), int(until.timestamp())
+            )
+            job.until = until
+            job.status = BackfillJob.PENDING
+            job.save(
+                update_fields=["windows", "until", "status", "updated_at"]
+            )
+        else:
+            job = BackfillJob.objects.create(
+                account=account,
+                since=since,
+                until=until,
+                windows=insights_planner.windows(
+                    int(since.timestamp()), int(until.timestamp())
+                ),
+            )
+
+    transaction.on_commit(lambda: _submit(job.pk))
+    return job, True
+
+
+def _record(job_pk: int, window: int, points: int):
+    """Mark a window as completed"""
+    with transaction.atomic():
+        job = BackfillJob.objects.select_for_update().get(pk=job_pk)
+        if window not in job.done_windows:
+            job.done_windows.append(window)
+            job.points += points
+            job.save(update_fields=["done_windows", "points", "updated_at"])
+
+
+def _fetch(job: BackfillJob, window: int) -> Optional[str]:
+    """
+    Fetch and store one window
+
+    Returns:
+        Error message if the window could not be fetched, None otherwise
+    """
+    since, until = job.windows[window]
+    try:
+        data = InstagramService.get_time_series(
+            job.account.provider_account_id,
+            job.account.access_token,
+            insights_store.TIME_SERIES_METRICS,
+            since,
+            until,
+        )
+        points = insights_store.upsert_points(
+            insights_store.parse_points(job.account, data, timezone.now())
+        )
+        _record(job.pk, window, points)
+        return None
+    except requests.exceptions.RequestException as e:
+        return str(e)
+    finally:
+        # fan_out threads do not outlive the job
+        connections.close_all()
+
+
+def run(job_pk: int) -> BackfillJob:
+    """
+    Fetch the windows of a job that are not completed yet
+
+    The job fails if any window fails, running it again retries those.
+    """
+    job = BackfillJob.objects.select_related("account").get(pk=job_pk)
+    done = set(job.done_windows)
+    pending = [i for i in range(len(job.windows)) if i not in done]
+
+    job.status = BackfillJob.RUNNING
+    job.error = None
+    job.save(update_fields=["status", "error", "updated_at"])
+
+    errors = [
+        error for error in fan_out(lambda i: _fetch(job, i), pending) if error
+    ]
+
+    job.refresh_from_db()
+    job.status = BackfillJob.FAILED if errors else BackfillJob.DONE
+    job.error = errors[0] if errors else None
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at", "updated_at"])
+
+    logger.info(
+        "Backfill job %s of account %s %s: %s points, %s/%s windows",
+        job.pk,
+        job.account_id,
+        job.status,
+        job.points,
+        len(job.done_windows),
+        len(job.windows),
+    )
+    return job
+
+
+def resume_stalled(account: Account) -> int:
+    """
+    Run the active jobs of an account that made no progress for
+    INSTAGRAM_BACKFILL_STALL_TIMEOUT seconds, e.g. after a restart
+
+    Returns:
+        Number of jobs resumed
+    """
+    stalled_before = timezone.now() - timedelta(
+        seconds=settings.INSTAGRAM_BACKFILL_STALL_TIMEOUT
+    )
+    jobs = account.backfill_jobs.filter(
+        status__in=ACTIVE, updated_at__lt=stalled_before
+    )
+
+    resumed = 0
+    for job in jobs:
+        # Another worker may have picked it up meanwhile
+        claimed = BackfillJob.objects.filter(
+            pk=job.pk, updated_at=job.updated_at
+        ).update(status=BackfillJob.RUNNING, updated_at=timezone.now())
+        if claimed:
+            run(job.pk)
+            resumed += 1
+    return resumed
+
+
+def progress(job: BackfillJob) -> Dict[str, Any]:
+    """Job state as served by the backfill endpoint"""
+    total = len(job.windows)
+    done = len(job.done_windows)
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "since": job.since,
+        "until": job.until,
+        "windows": total,
+        "windows_done": done,
+        "progress": done / total if total else 1.0,
+        "points": job.points,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
@@ -0,0 +1,156 @@
+"""
+Planner of account insights calls
+
+Callers describe the metrics they need as logical requests, each with the
+insights params it would be sent with. Requests sharing their period,
+metric type, timeframe and breakdown are merged into a single call asking
+for the union of their metrics, over the union of their windows for time
+series as long as it stays within the Graph API limit. Responses are then
+split back per request, in the shape of a plain insights response, so
+the usual formatters apply unchanged. Calls are sent by
+InstagramService.get_insights.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from django.utils.dateparse import parse_datetime
+
+# Params that must be equal for two requests to share a call
+GROUPING_PARAMS = ["period", "metric_type", "timeframe", "breakdown"]
+# Longest since/until window the Graph API accepts for time series
+MAX_WINDOW_SECONDS = 30 * 86400
+
+
+def metric_request(metrics: List[str], **params) -> Dict[str, Any]:
+    """
+    Logical request for some metrics of an account
+
+    Args:
+        metrics: Metric names
+        **params: Insights params, e.g. period, metric_type, since, until
+    """
+    return {"metrics": list(metrics), "params": params}
+
+
+def windows(since: int, until: int) -> List[Tuple[int, int]]:
+    """Split since/until into consecutive windows the Graph API accepts"""
+    chunks = []
+    while since < until:
+        end = min(since + MAX_WINDOW_SECONDS, until)
+        chunks.append((since, end))
+        since = end
+    return chunks
+
+
+def _group_key(request: Dict[str, Any]) -> tuple:
+    return tuple(request["params"].get(name) for name in GROUPING_PARAMS)
+
+
+def _window(request: Dict[str, Any]) -> Optional[tuple]:
+    params = request["params"]
+    if "since" not in params and "until" not in params:
+        return None
+    return int(params["since"]), int(params["until"])
+
+
+def _fits(call: Dict[str, Any], request: Dict[str, Any]) -> bool:
+    """Whether request can join call without breaking the window limit"""
+    window = _window(request)
+    if window is None or call["window"] is None:
+        return window == call["window"]
+
+    since = min(call["window"][0], window[0])
+    until = max(call["window"][1], window[1])
+    return until - since <= MAX_WINDOW_SECONDS
+
+
+def plan(requests_by_name: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Fewest calls answering every request
+
+    Returns:
+        Calls, each with its query params (without access token) and the
+        names of the requests it answers
+    """
+    calls = []
+    for name, request in requests_by_name.items():
+        key = _group_key(request)
+        call = next(
+            (
+                call
+                for call in calls
+                if call["key"] == key and _fits(call, request)
+            ),
+            None,
+        )
+        if call is None:
+            call = {
+                "key": key,
+                "metrics": [],
+                "window": _window(request),
+                "params": dict(request["params"]),
+                "members": [],
+            }
+            calls.append(call)
+
+        window = _window(request)
+        if window is not None:
+            call["window"] = (
+                min(call["window"][0], window[0]),
+                max(call["window"][1], window[1]),
+            )
+        call["metrics"].extend(
+            metric
+            for metric in request["metrics"]
+            if metric not in call["metrics"]
+        )
+        call["members"].append(name)
+
+    planned = []
+    for call in calls:
+        params = {**call["params"], "metric": ",".join(call["metrics"])}
+        if call["window"] is not None:
+            params["since"], params["until"] = call["window"]
+        planned.append({"params": params, "members": call["members"]})
+    return planned
+
+
+def _in_window(value: Dict[str, Any], window: tuple) -> bool:
+    """Whether the day ending at a value's end_time overlaps the window"""
+    end_time = parse_datetime(value.get("end_time") or "")
+    if end_time is None:
+        return True
+    since, until = window
+    return since < end_time.timestamp() < until + 86400
+
+
+def split(
+    body: Dict[str, Any], call: Dict[str, Any], request: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Part of the response of a planned call answering one request
+
+    Time series values are only filtered when the call covered a wider
+    window than the request.
+    """
+    if "error" in body:
+        return body
+
+    window = _window(request)
+    if window == _window(call):
+        window = None
+
+    data = []
+    for item in body.get("data", []):
+        if item.get("name") not in request["metrics"]:
+            continue
+        if "values" in item and window is not None:
+            item = {
+                **item,
+                "values": [
+                    value
+                    for value in item["values"]
+                    if _in_window(value, window)
+                ],
+            }
+        data.append(item)
+    return {"data": data}
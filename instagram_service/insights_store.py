@@ -0,0 +1,256 @@
+"""
+Local store of daily Instagram account metrics
+
+Time series are synced into InsightPoint incrementally: each sync only
+asks the Graph API for the days after the last stored point, and charts
+are then served with a range query on the store. An account is synced at
+most once per INSTAGRAM_INSIGHTS_SYNC_INTERVAL seconds, in the background
+of the request finding it due unless nothing is stored for it yet.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from users.models import Account
+from . import background
+from .instagram_service import InstagramService
+from .models import InsightPoint
+
+logger = logging.getLogger(__name__)
+
+# Daily metrics kept in the store, fetched together in one call
+TIME_SERIES_METRICS = ["follower_count", "reach", "likes"]
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def _sync_key(account: Account) -> str:
+    return f"instagram:insights-sync:{account.pk}"
+
+
+def _sync_since(account: Account, until: datetime) -> datetime:
+    """
+    Start of the window to fetch: the last stored day of the metric that
+    is furthest behind, refetched as its value may not have been final
+    """
+    earliest = until - timedelta(days=settings.INSTAGRAM_INSIGHTS_SYNC_DAYS)
+
+    latest = dict(
+        InsightPoint.objects.filter(
+            account=account, metric__in=TIME_SERIES_METRICS
+        )
+        .values("metric")
+        .annotate(last=Max("end_time"))
+        .values_list("metric", "last")
+    )
+    if len(latest) < len(TIME_SERIES_METRICS):
+        return earliest
+
+    return max(earliest, min(latest.values()) - timedelta(days=1))
+
+
+def parse_points(
+    account: Account, data: Dict[str, Any], now: datetime
+) -> List[InsightPoint]:
+    """Points of a time series insights response, not saved yet"""
+    points = []
+    for metric in data.get("data", []):
+        for value in metric.get("values", []):
+            end_time = parse_datetime(value.get("end_time", ""))
+            if end_time is None:
+                continue
+            points.append(
+                InsightPoint(
+                    account=account,
+                    metric=metric["name"],
+                    date=end_time.date(),
+                    end_time=end_time,
+                    value=value.get("value", 0) or 0,
+                    updated_at=now,
+                )
+            )
+    return points
+
+
+def upsert_points(points: List[InsightPoint]) -> int:
+    """Insert points, or update the stored ones for the same day"""
+    InsightPoint.objects.bulk_create(
+        points,
+        update_conflicts=True,
+        unique_fields=["account", "metric", "date"],
+        update_fields=["end_time", "value", "updated_at"],
+    )
+    return len(points)
+
+
+def sync_account(account: Account) -> int:
+    """
+    Fetch the daily metrics of an account added since the last sync
+
+    Returns:
+        Number of points stored
+
+    Raises:
+        requests.exceptions.RequestException if the upstream call fails
+    """
+    now = timezone.now()
+    since = _sync_since(account, now)
+
+    data = InstagramService.get_time_series(
+        account.provider_account_id,
+        account.access_token,
+        TIME_SERIES_METRICS,
+        int(since.timestamp()),
+        int(now.timestamp()),
+    )
+
+    return upsert_points(parse_points(account, data, now))
+
+
+def mark_synced(account: Account):
+    """Record a sync made elsewhere, e.g. by the sync_instagram worker"""
+    cache.set(_sync_key(account), 1, settings.INSTAGRAM_INSIGHTS_SYNC_INTERVAL)
+
+
+def _sync(account: Account, key: str) -> Optional[str]:
+    try:
+        sync_account(account)
+    except requests.exceptions.RequestException as e:
+        # Let the next request try again
+        cache.delete(key)
+        return str(e)
+    return None
+
+
+def _sync_in_background(account: Account, key: str):
+    error = _sync(account, key)
+    if error:
+        logger.warning(
+            "Sync of the daily metrics of account %s failed: %s",
+            account.pk,
+            error,
+        )
+
+
+def ensure_synced(account: Account) -> Optional[str]:
+    """
+    Sync an account unless it was synced recently
+
+    The sync runs in the background while the stored points are served,
+    and on the caller's thread only for an account with none stored yet.
+
+    Returns:
+        Error message if a sync on the caller's thread failed, None
+        otherwise
+    """
+    key = _sync_key(account)
+    if not cache.add(key, 1, settings.INSTAGRAM_INSIGHTS_SYNC_INTERVAL):
+        return None
+
+    if InsightPoint.objects.filter(account=account).exists():
+        background.submit(
+            "daily metrics sync", lambda: _sync_in_background(account, key)
+        )
+        return None
+
+    return _sync(account, key)
+
+
+def time_series(
+    account: Account, metric: str, since: datetime
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Stored daily values of a metric after since
+
+    Returns:
+        Tuple of the values, formatted like the Graph API time series, and
+        the seconds since they were last synced
+    """
+    points = InsightPoint.objects.filter(
+        account=account, metric=metric, end_time__gt=since
+    ).order_by("end_time")
+
+    values = []
+    last_synced = None
+    for point in points:
+        values.append(
+            {
+                "date": point.end_time.strftime(TIMESTAMP_FORMAT),
+                "value": point.value,
+            }
+        )
+        last_synced = max(last_synced or point.updated_at, point.updated_at)
+
+    age = (timezone.now() - last_synced).total_seconds() if last_synced else 0
+    return values, age
+
+
+def covers(account: Account, metric: str, since: datetime) -> bool:
+    """Whether the stored daily values of a metric go back to since"""
+    first = InsightPoint.objects.filter(
+        account=account, metric=metric
+    ).aggregate(first=Min("end_time"))["first"]
+    # Values are daily, the first one ends within a day of the range start
+    return first is not None and first <= since + timedelta(days=1)
+
+
+def _stored_series(
+    account: Account,
+    metric: str,
+    since: datetime,
+    name: str,
+    live: Callable[[], Tuple[Dict[str, Any], float]],
+) -> Tuple[Dict[str, Any], float]:
+    # Only fails for an account with nothing stored to serve
+    error = ensure_synced(account)
+    if error:
+        return {"error": error}, 0
+
+    if not covers(account, metric, since):
+        return live()
+
+    values, age = time_series(account, metric, since)
+    return {name: values}, age
+
+
+def get_followers_growth(
+    account: Account, days: int = 30
+) -> Tuple[Dict[str, Any], float]:
+    """
+    Stored counterpart of InstagramService.get_followers_growth, which
+    fetches the days before the stored ones
+    """
+    since = timezone.now() - timedelta(days=days)
+    return _stored_series(
+        account,
+        "follower_count",
+        since,
+        "follower_growth",
+        lambda: InstagramService.get_followers_growth.with_age(
+            account.provider_account_id, account.access_token, days
+        ),
+    )
+
+
+def get_current_month_likes(account: Account) -> Tuple[Dict[str, Any], float]:
+    """
+    Stored counterpart of InstagramService.get_current_month_likes, which
+    fetches the month if its first days are not stored
+    """
+    start_of_month = timezone.now().replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    return _stored_series(
+        account,
+        "likes",
+        start_of_month,
+        "current_month_likes",
+        lambda: InstagramService.get_current_month_likes.with_age(
+            account.provider_account_id, account.access_token
+        ),
+    )
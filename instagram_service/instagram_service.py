@@ -2,11 +2,22 @@
 Instagram Service to call Instagram API
 """
 
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+from urllib.parse import urlencode
 import requests
 from django.conf import settings
+from . import (
+    demographics,
+    insights_planner,
+    media_store,
+    transport,
+)
+from .cache import cached
+from .concurrency import fan_out
 
 
 class InstagramService:
@@ -17,6 +28,183 @@ class InstagramService:
     BASE_URL = "https://graph.instagram.com/v22.0"
     TOKEN_URL = "https://api.instagram.com/oauth/access_token"
     HOST_URL = "https://graph.instagram.com"
+    API_VERSION = "v22.0"
+    BATCH_URL = "https://graph.instagram.com"
+    # Graph API accepts at most 50 requests per batch
+    BATCH_SIZE = 50
+    MEDIA_FIELDS = [
+        "id",
+        "media_type",
+        "media_url",
+        "like_count",
+        "permalink",
+        "thumbnail_url",
+        "timestamp",
+        "username",
+    ]
+    MEDIA_CHILDREN_FIELDS = [
+        "id",
+        "media_type",
+        "media_url",
+        "thumbnail_url",
+    ]
+    ACCOUNT_INSIGHT_METRICS = [
+        "accounts_engaged",
+        "follower_count",
+        "online_followers",
+        "reach",
+        "total_interactions",
+        "likes",
+        "comments",
+        "shares",
+        "saves",
+    ]
+    MEDIA_INSIGHT_METRICS = [
+        "likes",
+        "comments",
+        "shares",
+        "saved",
+        "impressions",
+        "reach",
+    ]
+    # Demographics breakdowns and timeframes of the audience insights
+    DEMOGRAPHIC_BREAKDOWNS = ["age", "gender", "country", "city"]
+    DEMOGRAPHIC_TIMEFRAMES = ["this_week", "this_month"]
+    AUDIENCE_METRICS = {
+        "followers": "follower_demographics",
+        "engaged": "engaged_audience_demographics",
+    }
+    # Live insights of the dashboard, see get_dashboard_insights
+    DASHBOARD_INSIGHTS = ["account_totals", "demographics"]
+    # Fields of get_media_details and get_account_basic_insights results,
+    # which callers can narrow with their fields argument
+    MEDIA_DETAIL_FIELDS = MEDIA_FIELDS + ["children"]
+    ACCOUNT_INSIGHT_FIELDS = [
+        "follower_count",
+        "avg_likes",
+        "avg_comments",
+        "avg_saves",
+        "avg_shares",
+        "engagement_rate",
+        "raw_insights",
+    ]
+    # Breakdown dimensions behind each list of get_demographic_insights
+    # results, which callers can narrow with their fields argument
+    DEMOGRAPHIC_BREAKDOWNS = {
+        "countries": ["country"],
+        "cities": ["city"],
+        "gender_split": ["gender"],
+        "age_gender_split": ["gender", "age"],
+    }
+    DEMOGRAPHIC_FIELDS = list(DEMOGRAPHIC_BREAKDOWNS)
+    # Media insight metric behind each average of the account insights
+    AVERAGE_METRICS = {
+        "avg_comments": "comments",
+        "avg_saves": "saved",
+        "avg_shares": "shares",
+    }
+
+    @staticmethod
+    def expand_field(
+        name: str, fields: Optional[List[str]] = None, **modifiers
+    ) -> str:
+        """
+        Build a nested field expansion for the fields parameter
+
+        expand_field("insights", metric=["likes", "reach"]) gives
+        insights.metric(likes,reach) and expand_field("children", ["id"])
+        gives children{id}
+
+        Args:
+            name: Field or edge name
+            fields: Sub-fields to request on the edge
+            modifiers: Edge modifiers such as metric or limit
+
+        Returns:
+            Field expression usable in a fields parameter
+        """
+        expansion = name
+        for modifier, values in modifiers.items():
+            if isinstance(values, (list, tuple)):
+                values = ",".join(values)
+            expansion += f".{modifier}({values})"
+
+        if fields:
+            expansion += "{" + ",".join(fields) + "}"
+
+        return expansion
+
+    @staticmethod
+    def _parse_batch_item(item: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Parse a single response of a batch request"""
+        # Graph API returns null for requests that did not complete
+        if item is None:
+            return {"error": "Batch request did not complete"}
+
+        try:
+            body = json.loads(item.get("body") or "{}")
+        except ValueError:
+            return {"error": "Invalid batch response body"}
+
+        if item.get("code") != 200:
+            error = body.get("error", {}) if isinstance(body, dict) else {}
+            return {"error": error.get("message", f"HTTP {item.get('code')}")}
+
+        return body
+
+    @staticmethod
+    def batch_get(
+        relative_urls: List[str], access_token: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Send several GET requests as Graph API batch requests
+
+        Args:
+            relative_urls: Paths relative to the API version, with query
+            access_token: Instagram user access token
+
+        Returns:
+            One parsed body per relative url, in order. Items that failed
+            upstream are returned as {"error": message}
+
+        Raises:
+            requests.exceptions.RequestException if a batch call fails
+        """
+        size = InstagramService.BATCH_SIZE
+        chunks = [
+            relative_urls[i:i + size]
+            for i in range(0, len(relative_urls), size)
+        ]
+
+        def send(chunk):
+            batch = [
+                {
+                    "method": "GET",
+                    "relative_url": f"{InstagramService.API_VERSION}/{url}",
+                }
+                for url in chunk
+            ]
+            data = {
+                "access_token": access_token,
+                "batch": json.dumps(batch),
+                "include_headers": "false",
+            }
+
+            response = transport.post(
+                InstagramService.BATCH_URL, data=data, timeout=60
+            )
+            response.raise_for_status()
+
+            return [
+                InstagramService._parse_batch_item(item)
+                for item in response.json()
+            ]
+
+        results = []
+        for chunk_results in fan_out(send, chunks):
+            results.extend(chunk_results)
+
+        return results
 
     @staticmethod
     def get_access_token(code: str):
@@ -28,7 +216,7 @@ class InstagramService:
             "code": code,
         }
 
-        token_response = requests.post(
+        token_response = transport.post(
             InstagramService.TOKEN_URL, data=token_payload
         )
 
@@ -47,7 +235,7 @@ class InstagramService:
             f"client_secret={client_secret}&access_token={access_token}"
         )
 
-        long_lived_token_response = requests.get(
+        long_lived_token_response = transport.get(
             long_lived_token_url,
             timeout=10,
         )
@@ -61,7 +249,7 @@ class InstagramService:
         """
 
         profile_url = f"{InstagramService.HOST_URL}/me?fields=id,username&access_token={long_lived_token}"
-        profile_response = requests.get(profile_url)
+        profile_response = transport.get(profile_url)
 
         return profile_response.json()
 
@@ -69,6 +257,9 @@ class InstagramService:
     def get_user_media(
         ig_id: str,
         access_token: str,
+        limit: Optional[int] = None,
+        fields: Optional[str] = None,
+        after: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Fetch a user's media from Instagram
@@ -77,6 +268,8 @@ class InstagramService:
             ig_id: Instagram user ID
             access_token: Instagram user access token
             limit: Number of media items to fetch (default 25)
+            fields: Media fields to request, nested expansions allowed
+            after: Cursor of the page to fetch, from paging.cursors.after
 
         Returns:
             Dict containing media data or error message
@@ -86,8 +279,14 @@ class InstagramService:
             params = {
                 "access_token": access_token,
             }
-
-            response = requests.get(endpoint, params=params, timeout=60)
+            if limit:
+                params["limit"] = limit
+            if fields:
+                params["fields"] = fields
+            if after:
+                params["after"] = after
+
+            response = transport.get(endpoint, params=params, timeout=60)
             response.raise_for_status()  # 4XX/5XX responses
 
             return response.json()
@@ -97,54 +296,180 @@ class InstagramService:
             return {"error": str(e)}
 
     @staticmethod
-    def get_media_details(media_id: str, access_token: str) -> Dict[str, Any]:
+    def _next_cursor(page: Dict[str, Any]) -> Optional[str]:
+        """Cursor of the page after this one, None on the last page"""
+        paging = page.get("paging", {})
+        if not paging.get("next") or not page.get("data"):
+            return None
+        return paging.get("cursors", {}).get("after")
+
+    @staticmethod
+    def iter_media_pages(
+        ig_id: str,
+        access_token: str,
+        limit: Optional[int] = None,
+        fields: Optional[str] = None,
+        after: Optional[str] = None,
+        read_ahead: bool = True,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the pages of a user's media, following the cursors
+
+        The next page is fetched in the background while the caller works
+        on the current one, and at most these two pages are held at once.
+
+        Args:
+            ig_id: Instagram user ID
+            access_token: Instagram user access token
+            limit: Page size
+            fields: Media fields to request, nested expansions allowed
+            after: Cursor to start from, the first page by default
+            read_ahead: Prefetch the next page, turn off when the caller
+                usually stops early
+
+        Yields:
+            Media pages as returned by get_user_media
+
+        Raises:
+            requests.exceptions.RequestException if a page cannot be fetched
+        """
+
+        def fetch(cursor):
+            page = InstagramService.get_user_media(
+                ig_id, access_token, limit=limit, fields=fields, after=cursor
+            )
+            if "error" in page:
+                raise requests.exceptions.RequestException(page["error"])
+            return page
+
+        if not read_ahead:
+            while True:
+                page = fetch(after)
+                yield page
+                after = InstagramService._next_cursor(page)
+                if not after:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(fetch, after)
+            while pending is not None:
+                page = pending.result()
+                cursor = InstagramService._next_cursor(page)
+                pending = executor.submit(fetch, cursor) if cursor else None
+                try:
+                    yield page
+                except GeneratorExit:
+                    if pending is not None:
+                        pending.cancel()
+                    raise
+
+    @staticmethod
+    def iter_user_media(
+        ig_id: str,
+        access_token: str,
+        limit: Optional[int] = None,
+        fields: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over all of a user's media items, see iter_media_pages
+        """
+        for page in InstagramService.iter_media_pages(
+            ig_id, access_token, limit=limit, fields=fields, after=after
+        ):
+            yield from page.get("data", [])
+
+    @staticmethod
+    def _get_media_fields(
+        media_id: str, access_token: str, fields: str
+    ) -> Dict[str, Any]:
+        endpoint = f"{InstagramService.BASE_URL}/{media_id}"
+        params = {"access_token": access_token, "fields": fields}
+
+        response = transport.get(endpoint, params=params, timeout=60)
+        response.raise_for_status()
+
+        return response.json()
+
+    @staticmethod
+    def get_media_details(
+        media_id: str, access_token: str, fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
         """
         Fetch details for a specific media item
 
+        Fields fixed at publish time are fetched once and kept in the
+        media store, later calls only refresh like_count and the media
+        URLs once their short-lived cache entry expires. That entry is
+        kept per token, so stored fields are only served to a token the
+        Graph API accepted for the item, even when only they are asked
+        for. Carousel items are only requested for carousels, and when
+        children are wanted.
+
         Args:
             media_id: Instagram media ID
             access_token: Instagram user access token
+            fields: Fields to return, from MEDIA_DETAIL_FIELDS, all by
+                default. The id is always returned
 
         Returns:
             Dict containing media details or error message
         """
+        fields = fields or InstagramService.MEDIA_DETAIL_FIELDS
+        with_children = "children" in fields
         try:
-            endpoint = f"{InstagramService.BASE_URL}/{media_id}"
-            media_fields = [
-                "id",
-                "media_type",
-                "media_url",
-                "like_count",
-                "permalink",
-                "thumbnail_url",
-                "timestamp",
-                "username",
-            ]
-            children_fields = [
-                "id",
-                "media_type",
-                "media_url",
-                "thumbnail_url",
-            ]
-            media_fields = ",".join(media_fields)
-            children_fields = ",".join(children_fields)
-            params = {
-                "access_token": access_token,
-                "fields": media_fields + "," + "children"
-                "{" + children_fields + "}",
-            }
+            media, volatile = media_store.load(media_id, access_token)
+
+            if media is None or (
+                with_children and media_store.missing_children(media)
+            ):
+                data = InstagramService._get_media_fields(
+                    media_id,
+                    access_token,
+                    ",".join(InstagramService.MEDIA_FIELDS),
+                )
+                if (
+                    with_children
+                    and data.get("media_type") == media_store.CAROUSEL
+                ):
+                    data.update(
+                        InstagramService._get_media_fields(
+                            media_id,
+                            access_token,
+                            InstagramService._media_children_field(),
+                        )
+                    )
+                media = media_store.save_immutable(data)
+                volatile = media_store.save_volatile(
+                    media_id, access_token, data
+                )
 
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
+            elif volatile is None:
+                # The volatile entry is cached per token, without it this
+                # token was never accepted upstream for the stored item
+                data = InstagramService._get_media_fields(
+                    media_id, access_token, media_store.volatile_fields(media)
+                )
+                volatile = media_store.save_volatile(
+                    media_id, access_token, data
+                )
 
-            return response.json()
+            return media_store.merge(media, volatile, fields)
 
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
     @staticmethod
+    def _media_children_field() -> str:
+        """Carousel items of a media item, expanded inline"""
+        return InstagramService.expand_field(
+            "children", InstagramService.MEDIA_CHILDREN_FIELDS
+        )
+
+    @staticmethod
+    @cached("get_account_basic_insights")
     def get_account_basic_insights(
-        ig_id: str, access_token: str
+        ig_id: str, access_token: str, fields: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """
         Fetch basic account insights including follower count,
@@ -153,107 +478,190 @@ class InstagramService:
         Args:
             ig_id: Instagram user ID
             access_token: Instagram user access token
+            fields: Fields to return, from ACCOUNT_INSIGHT_FIELDS, all by
+                default. Only the metrics and media they need are fetched
 
         Returns:
             Dict containing basic account insights or error message
         """
-        try:
-            # Get follower count and other metrics
-            field_values = [
-                "accounts_engaged",
-                "follower_count",
-                "online_followers",
-                "reach",
-                "total_interactions",
-                "likes",
-                "comments",
-                "shares",
-                "saves",
-            ]
-            metrics = ",".join(field_values)
-            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
-            params = {
-                "metric": metrics,
-                "period": "day",
-                "metric_type": "total_value",
-                "access_token": access_token,
-            }
+        fields = fields or InstagramService.ACCOUNT_INSIGHT_FIELDS
+        insights_data = {}
+        if InstagramService._account_metrics(fields):
+            insights_data = InstagramService.get_insights(
+                ig_id,
+                access_token,
+                {"account": InstagramService._account_totals_request(fields)},
+            )["account"]
+            if "error" in insights_data:
+                return insights_data
+
+        return InstagramService._account_insights(
+            ig_id, access_token, insights_data, fields
+        )
 
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
-            insights_data = response.json()
+    @staticmethod
+    def _account_metrics(fields: List[str]) -> List[str]:
+        """Account metrics needed for some account insights fields"""
+        if "raw_insights" in fields:
+            return InstagramService.ACCOUNT_INSIGHT_METRICS
+        if "follower_count" in fields or "engagement_rate" in fields:
+            return ["follower_count"]
+        return []
 
-            # Get user media to calculate average likes
-            media_response = InstagramService.get_user_media(
-                ig_id, access_token
-            )
-            media_ids = [
-                item["id"] for item in media_response.get("data", [])
-            ][
-                :10
-            ]  # Get recent 10 posts
-
-            # Calculate engagement metrics
-            total_likes = 0
-            total_comments = 0
-            total_saves = 0
-            total_shares = 0
-
-            for media_id in media_ids:
-                media_details = InstagramService.get_media_details(
-                    media_id, access_token
-                )
-                total_likes += media_details.get("like_count", 0)
+    @staticmethod
+    def _average_metrics(fields: List[str]) -> List[str]:
+        """Media insight metrics needed for some account insights fields"""
+        return [
+            metric
+            for field, metric in InstagramService.AVERAGE_METRICS.items()
+            if field in fields or "engagement_rate" in fields
+        ]
 
-                # Get media insights
-                media_insights = InstagramService.get_media_insights(
-                    media_id, access_token
-                )
-                total_comments += media_insights.get("comments", {}).get(
-                    "value", 0
+    @staticmethod
+    def _needs_recent_media(fields: List[str]) -> bool:
+        return "avg_likes" in fields or bool(
+            InstagramService._average_metrics(fields)
+        )
+
+    @staticmethod
+    def _account_totals_request(
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        return insights_planner.metric_request(
+            InstagramService._account_metrics(
+                fields or InstagramService.ACCOUNT_INSIGHT_FIELDS
+            ),
+            period="day",
+            metric_type="total_value",
+        )
+
+    @staticmethod
+    def _account_insights(
+        ig_id: str,
+        access_token: str,
+        insights_data: Dict[str, Any],
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """Basic account insights from the account totals response"""
+        fields = fields or InstagramService.ACCOUNT_INSIGHT_FIELDS
+        media_items = []
+        insights_by_media = {}
+        try:
+            if InstagramService._needs_recent_media(fields):
+                # Get recent 10 posts with their like counts expanded
+                # inline, so no per-media details call is needed
+                media_response = InstagramService.get_user_media(
+                    ig_id, access_token, limit=10, fields="id,like_count"
                 )
-                total_saves += media_insights.get("saved", {}).get("value", 0)
-                total_shares += media_insights.get("shares", {}).get(
-                    "value", 0
+                if "error" in media_response:
+                    return media_response
+                media_items = media_response.get("data", [])[:10]
+                media_ids = [item["id"] for item in media_items]
+
+            metrics = InstagramService._average_metrics(fields)
+            if media_items and metrics:
+                # Insights for all posts in a single batch request
+                insights_by_media = InstagramService.get_media_insights_batch(
+                    media_ids, access_token, metrics
                 )
 
-            avg_likes = total_likes / len(media_ids) if media_ids else 0
-            avg_comments = total_comments / len(media_ids) if media_ids else 0
-            avg_saves = total_saves / len(media_ids) if media_ids else 0
-            avg_shares = total_shares / len(media_ids) if media_ids else 0
-
-            # Calculate engagement rate
-            # (likes + comments + saves + shares) / followers * 100
-            follower_count = 0
-            for metric in insights_data.get("data", []):
-                if metric["name"] == "follower_count":
-                    follower_count = metric["total_value"]["value"]
-                    break
-
-            engagement_rate = (
-                (
-                    (avg_likes + avg_comments + avg_saves + avg_shares)
-                    / follower_count
-                    * 100
-                )
-                if follower_count
-                else 0
+            return InstagramService._summarize_account_insights(
+                insights_data, media_items, insights_by_media, fields
             )
 
-            return {
-                "follower_count": follower_count,
-                "avg_likes": avg_likes,
-                "avg_comments": avg_comments,
-                "avg_saves": avg_saves,
-                "avg_shares": avg_shares,
-                "engagement_rate": engagement_rate,
-                "raw_insights": insights_data,
-            }
-
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
     @staticmethod
+    def _summarize_account_insights(
+        insights_data: Dict[str, Any],
+        media_items: List[Dict[str, Any]],
+        insights_by_media: Dict[str, Dict[str, Any]],
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Compute average engagement and engagement rate
+
+        Media whose insights could not be fetched are left out of the
+        averages, counting them as zero would understate them, and
+        reported under errors.
+
+        Args:
+            insights_data: Raw account insights response
+            media_items: Recent media with their like_count
+            insights_by_media: Formatted insights keyed by media ID
+            fields: Fields to return, all by default
+
+        Returns:
+            Dict containing basic account insights, and the errors of the
+            media left out if any
+        """
+        errors = []
+        counted = []
+        for item in media_items:
+            error = insights_by_media.get(item["id"], {}).get("error")
+            if error:
+                errors.append({"media_id": item["id"], "error": error})
+            else:
+                counted.append(item)
+
+        # Calculate engagement metrics
+        total_likes = 0
+        total_comments = 0
+        total_saves = 0
+        total_shares = 0
+
+        for item in counted:
+            media_insights = insights_by_media.get(item["id"], {})
+            total_likes += item.get("like_count", 0)
+            total_comments += media_insights.get("comments", {}).get(
+                "value", 0
+            )
+            total_saves += media_insights.get("saved", {}).get("value", 0)
+            total_shares += media_insights.get("shares", {}).get("value", 0)
+
+        media_count = len(counted)
+        avg_likes = total_likes / media_count if media_count else 0
+        avg_comments = total_comments / media_count if media_count else 0
+        avg_saves = total_saves / media_count if media_count else 0
+        avg_shares = total_shares / media_count if media_count else 0
+
+        # Calculate engagement rate
+        # (likes + comments + saves + shares) / followers * 100
+        follower_count = 0
+        for metric in insights_data.get("data", []):
+            if metric["name"] == "follower_count":
+                follower_count = metric["total_value"]["value"]
+                break
+
+        engagement_rate = (
+            (
+                (avg_likes + avg_comments + avg_saves + avg_shares)
+                / follower_count
+                * 100
+            )
+            if follower_count
+            else 0
+        )
+
+        summary = {
+            "follower_count": follower_count,
+            "avg_likes": avg_likes,
+            "avg_comments": avg_comments,
+            "avg_saves": avg_saves,
+            "avg_shares": avg_shares,
+            "engagement_rate": engagement_rate,
+            "raw_insights": insights_data,
+        }
+        if fields is not None:
+            summary = {field: summary[field] for field in fields}
+        if errors:
+            # Partial results are not cached, see cached()
+            summary["errors"] = errors
+        return summary
+
+    @staticmethod
+    @cached("get_engaged_audience_demographics")
     def get_engaged_audience_demographics(
         ig_id: str,
         access_token: str,
@@ -265,6 +673,10 @@ class InstagramService:
             Args:
                 ig_id: Instagram user ID
                 access_token: Instagram user access token
+
+            Returns:
+                Dict with the breakdowns decoded into columnar tables, see
+                demographics.decode
         """
         # Get follower count and other metrics
         endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
@@ -277,13 +689,15 @@ class InstagramService:
             "access_token": access_token,
         }
 
-        response = requests.get(endpoint, params=params, timeout=60)
+        response = transport.get(endpoint, params=params, timeout=60)
         response.raise_for_status()
-        data = response.json()
 
-        return data
+        return demographics.format_breakdowns(
+            response.json(), "engaged_audience_demographics"
+        )
 
     @staticmethod
+    @cached("get_follows_and_unfollows")
     def get_follows_and_unfollows(
         ig_id: str,
         access_token: str,
@@ -294,6 +708,10 @@ class InstagramService:
             Args:
                 ig_id: Instagram user ID
                 access_token: Instagram user access token
+
+            Returns:
+                Dict with the breakdowns decoded into columnar tables, see
+                demographics.decode
         """
         # Get follower count and other metrics
         endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
@@ -306,13 +724,15 @@ class InstagramService:
             "access_token": access_token,
         }
 
-        response = requests.get(endpoint, params=params, timeout=60)
+        response = transport.get(endpoint, params=params, timeout=60)
         response.raise_for_status()
-        data = response.json()
 
-        return data
+        return demographics.format_breakdowns(
+            response.json(), "follows_and_unfollows"
+        )
 
     @staticmethod
+    @cached("get_follower_demographics")
     def get_follower_demographics(
         ig_id: str,
         access_token: str,
@@ -327,6 +747,10 @@ class InstagramService:
             Args:
                 ig_id: Instagram user ID
                 access_token: Instagram user access token
+
+            Returns:
+                Dict with the breakdowns decoded into columnar tables, see
+                demographics.decode
         """
         # Get follower count and other metrics
         endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
@@ -340,194 +764,400 @@ class InstagramService:
             "access_token": access_token,
         }
 
-        response = requests.get(endpoint, params=params, timeout=60)
+        response = transport.get(endpoint, params=params, timeout=60)
         response.raise_for_status()
-        data = response.json()
 
-        return data
+        return demographics.format_breakdowns(
+            response.json(), "follower_demographics"
+        )
 
     @staticmethod
-    def get_media_insights(media_id: str, access_token: str) -> Dict[str, Any]:
+    def _audience_demographics_requests(
+        breakdowns: List[str], timeframes: List[str], audiences: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        Fetch insights for a specific media item
+        Logical requests of a matrix of demographics, by audience,
+        timeframe and breakdown
+
+        The Graph API takes one breakdown and one timeframe per call, the
+        planner asks for the metrics of all audiences in that call.
+        """
+        return {
+            f"{audience}:{timeframe}:{breakdown}": (
+                insights_planner.metric_request(
+                    [InstagramService.AUDIENCE_METRICS[audience]],
+                    period="lifetime",
+                    metric_type="total_value",
+                    timeframe=timeframe,
+                    breakdown=breakdown,
+                )
+            )
+            for audience in audiences
+            for timeframe in timeframes
+            for breakdown in breakdowns
+        }
+
+    @staticmethod
+    def _get_insights(
+        ig_id: str, access_token: str, params: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """Single insights call, errors returned as {"error": message}"""
+        try:
+            response = transport.get(
+                f"{InstagramService.BASE_URL}/{ig_id}/insights",
+                params={**params, "access_token": access_token},
+                timeout=60,
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+
+    @staticmethod
+    def _send_insights_calls(
+        ig_id: str, access_token: str, calls: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Send several insights calls at once
+
+        A single call is sent as a plain GET, several together as Graph
+        batch requests, or concurrently if the batch endpoint fails.
 
         Args:
-            media_id: Instagram media ID
+            ig_id: Instagram user ID
             access_token: Instagram user access token
+            calls: Query params of each call, without the access token
 
         Returns:
-            Dict containing media insights or error message
+            One response body per call, in order, {"error": message} for
+            the calls that failed
         """
+
+        def get(params):
+            return InstagramService._get_insights(ig_id, access_token, params)
+
+        if len(calls) == 1:
+            return [get(calls[0])]
+
         try:
-            endpoint = f"{InstagramService.BASE_URL}/{media_id}/insights"
-            params = {
-                "metric": "likes,comments,shares,saved,impressions,reach",
-                "access_token": access_token,
-            }
+            return InstagramService.batch_get(
+                [f"{ig_id}/insights?{urlencode(params)}" for params in calls],
+                access_token,
+            )
+        except requests.exceptions.RequestException:
+            return fan_out(get, calls)
 
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-
-            # Format data into a more usable structure
-            formatted_data = {}
-            for metric in data.get("data", []):
-                metric_name = metric["name"]
-                metric_value = (
-                    metric["values"][0]["value"] if metric.get("values") else 0
-                )
-                formatted_data[metric_name] = {
-                    "value": metric_value,
-                    "title": metric.get("title", ""),
-                    "description": metric.get("description", ""),
-                }
+    @staticmethod
+    def get_insights(
+        ig_id: str,
+        access_token: str,
+        requests_by_name: Dict[str, Dict[str, Any]],
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Answer logical metric requests with the fewest insights calls
 
-            return formatted_data
+        Args:
+            ig_id: Instagram user ID
+            access_token: Instagram user access token
+            requests_by_name: Requests built with
+                insights_planner.metric_request, by name
 
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+        Returns:
+            Insights response of every request by name, {"error": message}
+            for the requests whose call failed
+        """
+        calls = insights_planner.plan(requests_by_name)
+        bodies = InstagramService._send_insights_calls(
+            ig_id, access_token, [call["params"] for call in calls]
+        )
+
+        results = {}
+        for call, body in zip(calls, bodies):
+            for name in call["members"]:
+                results[name] = insights_planner.split(
+                    body, call, requests_by_name[name]
+                )
+        return results
 
     @staticmethod
-    def get_followers_growth(
-        ig_id: str, access_token: str, days: int = 30
+    @cached("get_audience_demographics")
+    def get_audience_demographics(
+        ig_id: str,
+        access_token: str,
+        breakdowns: List[str],
+        timeframes: List[str],
+        audiences: List[str],
     ) -> Dict[str, Any]:
         """
-        Get follower growth data for the last specified number of days
+        Demographics of several audiences, breakdowns and timeframes at once
+
+        The requests of _audience_demographics_requests are planned and
+        sent together by get_insights.
 
         Args:
             ig_id: Instagram user ID
             access_token: Instagram user access token
-            days: Number of days to look back (default 30)
+            breakdowns: Some of DEMOGRAPHIC_BREAKDOWNS
+            timeframes: Some of DEMOGRAPHIC_TIMEFRAMES
+            audiences: Some of the AUDIENCE_METRICS keys
 
         Returns:
-            Dict containing follower growth data or error message
+            Dict with the tables, see demographics.decode, by audience,
+            timeframe and breakdown, and the errors of the calls that
+            failed, or an error message if they all failed
         """
-        try:
-            current_time = int(time.time())
-            past_time = int(
-                (datetime.now() - timedelta(days=days)).timestamp()
+        responses = InstagramService.get_insights(
+            ig_id,
+            access_token,
+            InstagramService._audience_demographics_requests(
+                breakdowns, timeframes, audiences
+            ),
+        )
+
+        result = {
+            audience: {timeframe: {} for timeframe in timeframes}
+            for audience in audiences
+        }
+        errors = {}
+        for name, body in responses.items():
+            audience, timeframe, breakdown = name.split(":")
+            if "error" in body:
+                # The audiences of a timeframe and breakdown share a call
+                errors[(timeframe, breakdown)] = {
+                    "timeframe": timeframe,
+                    "breakdown": breakdown,
+                    "error": body["error"],
+                }
+                continue
+
+            tables = demographics.decode(
+                body, InstagramService.AUDIENCE_METRICS[audience]
+            )
+            result[audience][timeframe][breakdown] = tables.get(
+                breakdown,
+                {"dimensions": [breakdown], "keys": [], "values": []},
             )
 
-            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+        errors = list(errors.values())
+        if errors and len(errors) == len(breakdowns) * len(timeframes):
+            return {"error": errors[0]["error"]}
+
+        return {"demographics": result, "errors": errors}
+
+    @staticmethod
+    def get_media_insights(
+        media_id: str, access_token: str, metrics: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch insights for a specific media item
+
+        Args:
+            media_id: Instagram media ID
+            access_token: Instagram user access token
+            metrics: Metrics to fetch, MEDIA_INSIGHT_METRICS by default
+
+        Returns:
+            Dict containing media insights or error message
+        """
+        metrics = metrics or InstagramService.MEDIA_INSIGHT_METRICS
+        try:
+            endpoint = f"{InstagramService.BASE_URL}/{media_id}/insights"
             params = {
-                "metric": "follower_count",
-                "period": "day",
-                "metric_type": "time_series",
-                "since": past_time,
-                "until": current_time,
+                "metric": ",".join(metrics),
                 "access_token": access_token,
             }
 
-            response = requests.get(endpoint, params=params, timeout=60)
+            response = transport.get(endpoint, params=params, timeout=60)
             response.raise_for_status()
 
-            data = response.json()
-            formatted_data = []
-
-            if "data" in data and data["data"]:
-                for metric in data["data"]:
-                    if metric["name"] == "follower_count":
-                        for value in metric.get("values", []):
-                            formatted_data.append(
-                                {
-                                    "date": value.get("end_time", ""),
-                                    "value": value.get("value", 0),
-                                }
-                            )
-
-            return {"follower_growth": formatted_data}
+            return InstagramService._format_media_insights(response.json())
 
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
     @staticmethod
-    def get_post_engagements(
-        ig_id: str, access_token: str, months: int = 6
-    ) -> Dict[str, Any]:
+    def _format_media_insights(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Format media insights into a more usable structure"""
+        formatted_data = {}
+        for metric in data.get("data", []):
+            metric_name = metric["name"]
+            metric_value = (
+                metric["values"][0]["value"] if metric.get("values") else 0
+            )
+            formatted_data[metric_name] = {
+                "value": metric_value,
+                "title": metric.get("title", ""),
+                "description": metric.get("description", ""),
+            }
+
+        return formatted_data
+
+    @staticmethod
+    def get_media_insights_batch(
+        media_ids: List[str],
+        access_token: str,
+        metrics: Optional[List[str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        Get engagement data for posts from the last specified number of months
+        Fetch insights for several media items with batch requests
 
         Args:
-            ig_id: Instagram user ID
+            media_ids: Instagram media IDs
             access_token: Instagram user access token
-            months: Number of months to look back (default 6)
+            metrics: Metrics to fetch, MEDIA_INSIGHT_METRICS by default
 
         Returns:
-            Dict containing post engagement data or error message
+            Dict mapping each media ID to the same structure returned by
+            get_media_insights, including per-item error messages
         """
+        if not media_ids:
+            return {}
+
+        metrics = metrics or InstagramService.MEDIA_INSIGHT_METRICS
+        query = urlencode({"metric": ",".join(metrics)})
+        relative_urls = [
+            f"{media_id}/insights?{query}" for media_id in media_ids
+        ]
+
         try:
-            # Get media from the last few months
-            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/media"
-            params = {
-                "access_token": access_token,
-                "fields": "id,timestamp",
-                "limit": 50,  # Get a reasonable number to analyze
-            }
+            bodies = InstagramService.batch_get(relative_urls, access_token)
+        except requests.exceptions.RequestException:
+            # Batch endpoint unavailable, fall back to one call per media
+            results = fan_out(
+                lambda media_id: InstagramService.get_media_insights(
+                    media_id, access_token, metrics
+                ),
+                media_ids,
+            )
+            return dict(zip(media_ids, results))
 
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
+        return {
+            media_id: (
+                body
+                if "error" in body
+                else InstagramService._format_media_insights(body)
+            )
+            for media_id, body in zip(media_ids, bodies)
+        }
 
-            cutoff_date = datetime.now() - timedelta(days=30 * months)
-            media_data = response.json().get("data", [])
+    @staticmethod
+    @cached("get_followers_growth")
+    def get_followers_growth(
+        ig_id: str, access_token: str, days: int = 30
+    ) -> Dict[str, Any]:
+        """
+        Get follower growth data for the last specified number of days
 
-            monthly_data = {}
-            for month_idx in range(months):
-                month = (
-                    datetime.now() - timedelta(days=30 * month_idx)
-                ).strftime("%Y-%m")
-                monthly_data[month] = {"count": 0, "total_engagement": 0}
+        Longer periods than the Graph API accepts in one call are fetched
+        window by window, together.
 
-            for media in media_data:
-                media_date = datetime.strptime(
-                    media["timestamp"], "%Y-%m-%dT%H:%M:%S%z"
-                )
-                if media_date.replace(tzinfo=None) < cutoff_date:
-                    continue
+        Args:
+            ig_id: Instagram user ID
+            access_token: Instagram user access token
+            days: Number of days to look back (default 30)
 
-                month_key = media_date.strftime("%Y-%m")
-                if month_key not in monthly_data:
-                    continue
+        Returns:
+            Dict containing follower growth data or error message
+        """
+        responses = InstagramService.get_insights(
+            ig_id,
+            access_token,
+            InstagramService._followers_growth_requests(days),
+        )
+        return InstagramService._merge_followers_growth(responses.values())
 
-                # Get engagement metrics for this post
-                insights = InstagramService.get_media_insights(
-                    media["id"], access_token
-                )
-                engagement = (
-                    insights.get("likes", {}).get("value", 0)
-                    + insights.get("comments", {}).get("value", 0)
-                    + insights.get("shares", {}).get("value", 0)
-                    + insights.get("saved", {}).get("value", 0)
-                )
+    @staticmethod
+    def _merge_followers_growth(
+        responses: Iterable[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Follower growth from the responses of its windows"""
+        # Windows are consecutive, a day on their boundary may be in both
+        follower_growth = {}
+        for response in responses:
+            if "error" in response:
+                return response
+            for point in InstagramService._format_time_series(
+                response, "follower_count"
+            ):
+                follower_growth[point["date"]] = point
+
+        return {
+            "follower_growth": sorted(
+                follower_growth.values(), key=lambda point: point["date"]
+            )
+        }
 
-                monthly_data[month_key]["count"] += 1
-                monthly_data[month_key]["total_engagement"] += engagement
+    @staticmethod
+    def _followers_growth_requests(days: int) -> Dict[str, Dict[str, Any]]:
+        """
+        Follower count series of the last days, one request per window
+        the Graph API accepts, sent together by get_insights
+        """
+        since = int((datetime.now() - timedelta(days=days)).timestamp())
+        return {
+            f"growth:{window_since}": insights_planner.metric_request(
+                ["follower_count"],
+                period="day",
+                metric_type="time_series",
+                since=window_since,
+                until=window_until,
+            )
+            for window_since, window_until in insights_planner.windows(
+                since, int(time.time())
+            )
+        }
 
-            # Calculate the average engagement per post per month
-            result = []
-            for month, data in monthly_data.items():
-                avg_engagement = (
-                    data["total_engagement"] / data["count"]
-                    if data["count"] > 0
-                    else 0
-                )
-                result.append(
-                    {
-                        "month": month,
-                        "average_engagement": avg_engagement,
-                        "post_count": data["count"],
-                    }
-                )
+    @staticmethod
+    def get_time_series(
+        ig_id: str,
+        access_token: str,
+        metrics: List[str],
+        since: int,
+        until: int,
+    ) -> Dict[str, Any]:
+        """
+        Fetch the daily values of account metrics between two timestamps
 
-            return {
-                "post_engagements_by_month": sorted(
-                    result, key=lambda x: x["month"]
-                )
-            }
+        Raises:
+            requests.exceptions.RequestException if the call fails
+        """
+        endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
+        params = {
+            "metric": ",".join(metrics),
+            "period": "day",
+            "metric_type": "time_series",
+            "since": since,
+            "until": until,
+            "access_token": access_token,
+        }
 
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+        response = transport.get(endpoint, params=params, timeout=60)
+        response.raise_for_status()
+
+        return response.json()
 
     @staticmethod
+    def _format_time_series(
+        data: Dict[str, Any], metric_name: str
+    ) -> List[Dict[str, Any]]:
+        """Flatten the values of a time series metric into date/value"""
+        formatted_data = []
+
+        if "data" in data and data["data"]:
+            for metric in data["data"]:
+                if metric["name"] == metric_name:
+                    for value in metric.get("values", []):
+                        formatted_data.append(
+                            {
+                                "date": value.get("end_time", ""),
+                                "value": value.get("value", 0),
+                            }
+                        )
+
+        return formatted_data
+
+    @staticmethod
+    @cached("get_current_month_likes")
     def get_current_month_likes(
         ig_id: str, access_token: str
     ) -> Dict[str, Any]:
@@ -541,48 +1171,37 @@ class InstagramService:
         Returns:
             Dict containing likes data for current month or error message
         """
-        try:
-            # Get start and end time for the current month
-            now = datetime.now()
-            start_of_month = datetime(now.year, now.month, 1)
-            start_timestamp = int(start_of_month.timestamp())
-            current_timestamp = int(now.timestamp())
-
-            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
-            params = {
-                "metric": "likes",
-                "period": "day",
-                "metric_type": "time_series",
-                "since": start_timestamp,
-                "until": current_timestamp,
-                "access_token": access_token,
-            }
-
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
-
-            data = response.json()
-            likes_data = []
-
-            if "data" in data and data["data"]:
-                for metric in data["data"]:
-                    if metric["name"] == "likes":
-                        for value in metric.get("values", []):
-                            likes_data.append(
-                                {
-                                    "date": value.get("end_time", ""),
-                                    "value": value.get("value", 0),
-                                }
-                            )
-
-            return {"current_month_likes": likes_data}
+        response = InstagramService.get_insights(
+            ig_id,
+            access_token,
+            {"likes": InstagramService._current_month_likes_request()},
+        )["likes"]
+        if "error" in response:
+            return response
+
+        return {
+            "current_month_likes": InstagramService._format_time_series(
+                response, "likes"
+            )
+        }
 
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+    @staticmethod
+    def _current_month_likes_request() -> Dict[str, Any]:
+        # Get start and end time for the current month
+        now = datetime.now()
+        start_of_month = datetime(now.year, now.month, 1)
+        return insights_planner.metric_request(
+            ["likes"],
+            period="day",
+            metric_type="time_series",
+            since=int(start_of_month.timestamp()),
+            until=int(now.timestamp()),
+        )
 
     @staticmethod
+    @cached("get_demographic_insights")
     def get_demographic_insights(
-        ig_id: str, access_token: str
+        ig_id: str, access_token: str, fields: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """
         Get demographic insights including location
@@ -591,118 +1210,92 @@ class InstagramService:
         Args:
             ig_id: Instagram user ID
             access_token: Instagram user access token
+            fields: Fields to return, from DEMOGRAPHIC_FIELDS, all by
+                default. Only the breakdowns they need are fetched
 
         Returns:
             Dict containing demographic insights or error message
         """
-        try:
-            endpoint = f"{InstagramService.BASE_URL}/{ig_id}/insights"
-            params = {
-                "metric": "follower_demographics",
-                "period": "lifetime",
-                "timeframe": "this_month",
-                "breakdown": "country,city,gender,age",
-                "metric_type": "total_value",
-                "access_token": access_token,
-            }
+        request = InstagramService._follower_demographics_request(fields)
+        response = InstagramService.get_insights(
+            ig_id, access_token, {"demographics": request}
+        )["demographics"]
+        if "error" in response:
+            return response
+
+        return InstagramService._demographic_fields(
+            demographics.format_follower_demographics(response), fields
+        )
 
-            response = requests.get(endpoint, params=params, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-
-            # Process demographic data
-            countries = []
-            cities = []
-            gender_data = []
-            age_gender_data = []
-
-            if "data" in data:
-                for metric in data["data"]:
-                    if metric["name"] == "follower_demographics":
-                        breakdowns = metric.get("total_value", {}).get(
-                            "breakdowns", []
-                        )
+    @staticmethod
+    def _follower_demographics_request(
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        dimensions = {
+            dimension
+            for field in fields or InstagramService.DEMOGRAPHIC_FIELDS
+            for dimension in InstagramService.DEMOGRAPHIC_BREAKDOWNS[field]
+        }
+        return insights_planner.metric_request(
+            ["follower_demographics"],
+            period="lifetime",
+            timeframe="this_month",
+            breakdown=",".join(
+                dimension
+                for dimension in ["country", "city", "gender", "age"]
+                if dimension in dimensions
+            ),
+            metric_type="total_value",
+        )
 
-                        for breakdown in breakdowns:
-                            dimension_keys = breakdown.get(
-                                "dimension_keys", []
-                            )
-
-                            # Process country data
-                            if "country" in dimension_keys:
-                                countries = []
-                                for result in breakdown.get("results", []):
-                                    country_idx = dimension_keys.index(
-                                        "country"
-                                    )
-                                    country = result["dimension_values"][
-                                        country_idx
-                                    ]
-                                    countries.append(
-                                        {
-                                            "country": country,
-                                            "value": result["value"],
-                                        }
-                                    )
-
-                            # Process city data
-                            if "city" in dimension_keys:
-                                cities = []
-                                for result in breakdown.get("results", []):
-                                    city_idx = dimension_keys.index("city")
-                                    city = result["dimension_values"][city_idx]
-                                    cities.append(
-                                        {
-                                            "city": city,
-                                            "value": result["value"],
-                                        }
-                                    )
-
-                            # Process gender data
-                            if (
-                                "gender" in dimension_keys
-                                and "age" not in dimension_keys
-                            ):
-                                gender_data = []
-                                for result in breakdown.get("results", []):
-                                    gender_idx = dimension_keys.index("gender")
-                                    gender = result["dimension_values"][
-                                        gender_idx
-                                    ]
-                                    gender_data.append(
-                                        {
-                                            "gender": gender,
-                                            "value": result["value"],
-                                        }
-                                    )
-
-                            # Process age and gender data
-                            if (
-                                "gender" in dimension_keys
-                                and "age" in dimension_keys
-                            ):
-                                age_gender_data = []
-                                for result in breakdown.get("results", []):
-                                    gender_idx = dimension_keys.index("gender")
-                                    age_idx = dimension_keys.index("age")
-                                    gender = result["dimension_values"][
-                                        gender_idx
-                                    ]
-                                    age = result["dimension_values"][age_idx]
-                                    age_gender_data.append(
-                                        {
-                                            "gender": gender,
-                                            "age": age,
-                                            "value": result["value"],
-                                        }
-                                    )
-
-            return {
-                "countries": countries,
-                "cities": cities,
-                "gender_split": gender_data,
-                "age_gender_split": age_gender_data,
-            }
+    @staticmethod
+    def _demographic_fields(
+        result: Dict[str, Any], fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Demographics narrowed to fields, all of them by default"""
+        if fields is None:
+            return result
+        return {field: result[field] for field in fields}
 
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+    @staticmethod
+    @cached("get_dashboard_insights")
+    def get_dashboard_insights(
+        ig_id: str, access_token: str, parts: List[str]
+    ) -> Dict[str, Any]:
+        """
+        Live insights of the dashboard, planned as one get_insights call
+        so that they are fetched with a single batch request
+
+        Args:
+            ig_id: Instagram user ID
+            access_token: Instagram user access token
+            parts: Some of DASHBOARD_INSIGHTS: "account_totals", the
+                response get_account_basic_insights starts from, and
+                "demographics", the result of get_demographic_insights
+
+        Returns:
+            Dict with each part, {"error": message} if its call failed,
+            and the names of the parts that failed
+        """
+        requests_by_part = {
+            "account_totals": InstagramService._account_totals_request(),
+            "demographics": InstagramService._follower_demographics_request(),
+        }
+        responses = InstagramService.get_insights(
+            ig_id,
+            access_token,
+            {part: requests_by_part[part] for part in parts},
+        )
+
+        if "error" not in responses.get("demographics", {"error": None}):
+            responses["demographics"] = (
+                demographics.format_follower_demographics(
+                    responses["demographics"]
+                )
+            )
+
+        # Partial results are not cached, see cached()
+        responses["errors"] = [
+            part for part in parts if "error" in responses[part]
+        ]
+        return responses
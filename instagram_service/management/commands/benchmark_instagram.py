@@ -0,0 +1,56 @@
+"""
+Run a benchmark of the Instagram service against a local fake Graph API
+"""
+
+import inspect
+from django.core.management.base import BaseCommand, CommandError
+from instagram_service import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the Instagram service against a local fake Graph API, "
+        "see instagram_service.benchmarks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("benchmark", choices=list(benchmarks.BENCHMARKS))
+        parser.add_argument(
+            "--option",
+            "-o",
+            action="append",
+            default=[],
+            metavar="NAME=VALUE",
+            help="Argument of the benchmark, such as loads=50",
+        )
+
+    def handle(self, *args, **options):
+        benchmark = benchmarks.BENCHMARKS[options["benchmark"]]
+        parameters = inspect.signature(benchmark).parameters
+
+        kwargs = {}
+        for option in options["option"]:
+            name, _, value = option.partition("=")
+            if name not in parameters:
+                raise CommandError(
+                    f"Unknown option {name}, choose from "
+                    f"{', '.join(parameters)}"
+                )
+            kwargs[name] = type(parameters[name].default)(value)
+
+        rows = benchmark(**kwargs)
+        columns = list(rows[0])
+        widths = [
+            max(
+                len(str(row[column]))
+                for row in rows + [dict(zip(columns, columns))]
+            )
+            for column in columns
+        ]
+        for row in [dict(zip(columns, columns))] + rows:
+            self.stdout.write(
+                "  ".join(
+                    str(row[column]).rjust(width)
+                    for column, width in zip(columns, widths)
+                )
+            )
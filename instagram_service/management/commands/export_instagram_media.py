@@ -0,0 +1,120 @@
+"""
+Export every catalogued media item of an account with its insights
+"""
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from users.models import Account
+from instagram_service import media_catalog, media_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the media of an Instagram account with their insights, as "
+        "NDJSON or CSV, resumable with --after"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "account",
+            help="Instagram account ID (provider_account_id)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=media_export.FORMATS,
+            default="ndjson",
+        )
+        parser.add_argument(
+            "--fields",
+            help="Comma-separated fields to export, all by default",
+        )
+        parser.add_argument(
+            "--after",
+            help=(
+                "Resume after this media ID, the last one exported. Output "
+                "is appended and the CSV header left out"
+            ),
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help=(
+                "Compress the output. The stream of an interrupted export "
+                "is cut short, resume it into another file"
+            ),
+        )
+        parser.add_argument(
+            "--output",
+            "-o",
+            help="File to write to, standard output by default",
+        )
+
+    def handle(self, *args, **options):
+        account = Account.objects.filter(
+            provider_account_id=options["account"],
+            provider__in=["instagram", "instagram_business"],
+        ).first()
+        if account is None:
+            raise CommandError(f"No Instagram account {options['account']}")
+
+        fields = None
+        if options["fields"]:
+            fields = [field.strip() for field in options["fields"].split(",")]
+            unknown = set(fields) - set(media_export.EXPORT_FIELDS)
+            if unknown:
+                raise CommandError(
+                    f"Unknown fields {', '.join(sorted(unknown))}, choose "
+                    f"from {', '.join(media_export.EXPORT_FIELDS)}"
+                )
+
+        after_pk = media_export.cursor(account, options["after"])
+        if options["after"] and after_pk is None:
+            raise CommandError(f"Unknown media ID {options['after']}")
+
+        # Exports everything catalogued as of now, not as of the last sync
+        error = media_catalog.catalog_error(account, in_background=False)
+        if error:
+            raise CommandError(f"Media sync failed: {error}")
+
+        self.exported = 0
+        self.last_id = options["after"]
+        chunks = media_export.encode(
+            self._track(media_export.record_chunks(account, fields, after_pk)),
+            options["format"],
+            fields,
+            header=after_pk is None,
+            compress=options["gzip"],
+        )
+
+        if options["output"]:
+            mode = "ab" if options["after"] else "wb"
+            output = open(options["output"], mode)
+        else:
+            output = sys.stdout.buffer
+
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
+        except KeyboardInterrupt:
+            self._report("Interrupted")
+            raise CommandError(f"Resume with --after {self.last_id}")
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+
+        self._report("Done")
+
+    def _track(self, chunks):
+        """Pass chunks through, recording the last one written"""
+        for chunk in chunks:
+            yield chunk
+            # Resumed once the chunk was encoded and written out
+            self.exported += len(chunk)
+            self.last_id = chunk[-1]["id"]
+
+    def _report(self, outcome: str):
+        self.stderr.write(
+            f"{outcome}: {self.exported} media exported, last ID "
+            f"{self.last_id}"
+        )
@@ -0,0 +1,325 @@
+"""
+Long-running worker syncing connected Instagram accounts into local storage
+"""
+
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from typing import Any, Dict, Iterator, List
+import django
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from users.models import Account
+from instagram_service import (
+    insights_backfill,
+    insights_store,
+    media_catalog,
+)
+from instagram_service.instagram_service import InstagramService
+
+logger = logging.getLogger(__name__)
+
+INSTAGRAM_PROVIDERS = ["instagram", "instagram_business"]
+# Chunks handed to the process pool per process, so a slow chunk does not
+# leave the other processes idle at the end of a pass
+CHUNKS_PER_PROCESS = 4
+
+# Set in each worker process to the pass' stop event
+_stop_event = None
+
+
+def in_shard(provider_account_id: str, shard: int, shards: int) -> bool:
+    """Stable assignment of an account to one of shards workers"""
+    return zlib.crc32(provider_account_id.encode()) % shards == shard
+
+
+def _init_process(stop_event):
+    """Set up a pool process, shutdown is driven by the parent"""
+    global _stop_event
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _stop_event = stop_event
+    # Needed with the spawn start method, a no-op after fork
+    django.setup()
+
+
+def sync_account(account_pk: int) -> Dict[str, Any]:
+    """
+    Refresh the media catalog, daily metrics and demographics of an
+    account, and resume its stalled backfills
+
+    Returns:
+        Progress record of the account
+    """
+    started = time.monotonic()
+    result = {"account": account_pk, "media": 0, "points": 0, "errors": []}
+
+    try:
+        account = Account.objects.get(pk=account_pk)
+
+        try:
+            result["media"] = media_catalog.sync_media(account)
+            media_catalog.mark_synced(account)
+        except requests.exceptions.RequestException as e:
+            result["errors"].append(f"media: {e}")
+
+        try:
+            result["points"] = insights_store.sync_account(account)
+            insights_store.mark_synced(account)
+        except requests.exceptions.RequestException as e:
+            result["errors"].append(f"insights: {e}")
+
+        # Backfills interrupted with the process that ran them
+        insights_backfill.resume_stalled(account)
+
+        demographics = InstagramService.get_demographic_insights.refresh(
+            account.provider_account_id, account.access_token
+        )
+        if "error" in demographics:
+            result["errors"].append(f"demographics: {demographics['error']}")
+
+    except Exception as e:
+        logger.exception("Sync of account %s failed", account_pk)
+        result["errors"].append(str(e))
+
+    finally:
+        # Threads of the pool do not outlive the pass, neither should
+        # their database connections
+        connections.close_all()
+
+    result["seconds"] = time.monotonic() - started
+    return result
+
+
+def iter_chunk(
+    account_pks: List[int], threads: int, stop_event=None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Sync accounts on a thread pool until the stop event is set
+
+    Yields:
+        Progress record of each account, as soon as it is synced
+    """
+    stop_event = stop_event or _stop_event
+
+    def run(account_pk):
+        if stop_event is not None and stop_event.is_set():
+            return None
+        return sync_account(account_pk)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(run, pk) for pk in account_pks]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    yield result
+        finally:
+            # Accounts not started yet are dropped if the caller stops
+            for future in futures:
+                future.cancel()
+
+
+def sync_chunk(
+    account_pks: List[int], threads: int, stop_event=None
+) -> List[Dict[str, Any]]:
+    """Progress records of iter_chunk, for the process pool"""
+    return list(iter_chunk(account_pks, threads, stop_event))
+
+
+class Progress:
+    """Counters of a sync pass"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.media = 0
+        self.points = 0
+        self.account_seconds = 0.0
+        self.started = time.monotonic()
+
+    def add(self, result: Dict[str, Any]):
+        self.done += 1
+        self.failed += bool(result["errors"])
+        self.media += result["media"]
+        self.points += result["points"]
+        self.account_seconds += result["seconds"]
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        average = self.account_seconds / self.done if self.done else 0.0
+        return (
+            f"{self.done}/{self.total} accounts synced, "
+            f"{self.failed} with errors, {self.media} media, "
+            f"{self.points} metric points, {rate:.2f} accounts/s, "
+            f"{average:.2f}s per account"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync media, daily metrics and demographics of connected Instagram "
+        "accounts, as a long-running worker"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shard",
+            type=int,
+            default=0,
+            help="Shard handled by this worker, from 0 to --shards - 1",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=1,
+            help="Number of workers sharing the accounts",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.INSTAGRAM_SYNC_PROCESSES,
+            help="Worker processes, 1 syncs in this process",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=settings.INSTAGRAM_SYNC_THREADS,
+            help="Accounts synced concurrently by each process",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=settings.INSTAGRAM_SYNC_INTERVAL,
+            help="Seconds between the start of two passes",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run a single pass and exit",
+        )
+
+    def handle(self, *args, **options):
+        shard, shards = options["shard"], options["shards"]
+        if shards < 1 or not 0 <= shard < shards:
+            raise CommandError("--shard must be between 0 and --shards - 1")
+
+        self.options = options
+        self.stop_event = multiprocessing.Event()
+        self._install_signal_handlers()
+
+        self.stdout.write(
+            f"Syncing shard {shard}/{shards} with "
+            f"{options['processes']} processes x "
+            f"{options['threads']} threads"
+        )
+
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            self.run_pass()
+
+            if options["once"]:
+                break
+
+            # Sleep until the next pass, in short steps to notice shutdown.
+            # Never wait on stop_event here: it is set from the signal
+            # handler, which would deadlock with a wait in the same thread.
+            next_pass = started + options["interval"]
+            while (
+                not self.stop_event.is_set() and time.monotonic() < next_pass
+            ):
+                time.sleep(min(1.0, next_pass - time.monotonic()))
+
+        self.stdout.write("Sync worker stopped")
+
+    def _install_signal_handlers(self):
+        def stop(signum, frame):
+            if self.stop_event.is_set():
+                return
+            self.stdout.write(
+                "Shutting down after the accounts in progress, "
+                "signal again to force"
+            )
+            self.stop_event.set()
+            # A second signal gets the default behaviour
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, stop)
+            signal.signal(signal.SIGTERM, stop)
+
+    def shard_accounts(self) -> List[int]:
+        accounts = (
+            Account.objects.filter(provider__in=INSTAGRAM_PROVIDERS)
+            .exclude(access_token__isnull=True)
+            .exclude(access_token="")
+            .exclude(provider_account_id="")
+            .values_list("pk", "provider_account_id")
+        )
+        return [
+            pk
+            for pk, provider_account_id in accounts
+            if in_shard(
+                provider_account_id,
+                self.options["shard"],
+                self.options["shards"],
+            )
+        ]
+
+    def run_pass(self):
+        account_pks = self.shard_accounts()
+        processes = self.options["processes"]
+        threads = self.options["threads"]
+        progress = Progress(len(account_pks))
+
+        if processes <= 1:
+            for result in iter_chunk(account_pks, threads, self.stop_event):
+                self.report(progress, result)
+        else:
+            size = max(
+                1, -(-len(account_pks) // (processes * CHUNKS_PER_PROCESS))
+            )
+            chunks = [
+                account_pks[i:i + size]
+                for i in range(0, len(account_pks), size)
+            ]
+
+            # Forked processes must not share the parent's connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_process,
+                initargs=(self.stop_event,),
+            ) as executor:
+                futures = [
+                    executor.submit(sync_chunk, chunk, threads)
+                    for chunk in chunks
+                ]
+                for future in as_completed(futures):
+                    for result in future.result():
+                        self.report(progress, result)
+
+        self.stdout.write(progress.summary())
+
+    def report(self, progress, result):
+        progress.add(result)
+        for error in result["errors"]:
+            logger.warning(
+                "Account %s sync error: %s", result["account"], error
+            )
+        if progress.done % settings.INSTAGRAM_SYNC_PROGRESS_EVERY == 0:
+            self.stdout.write(progress.summary())
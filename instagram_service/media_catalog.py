@@ -0,0 +1,322 @@
+"""
+Local catalog of each account's Instagram media
+
+A sync walks the media list newest first and stops once it reaches media
+older than the stored watermark (the newest catalogued post) minus
+INSTAGRAM_MEDIA_REFRESH_DAYS, so its cost grows with new posts rather
+than with total posts. The insights counters of the catalogued media are
+then refreshed on their own schedule, see media_refresh. Engagement and
+media endpoints are served from the catalog, while the sync of an account
+due for one runs in the background.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from users.models import Account
+from . import background, engagement_rollups, media_refresh
+from .instagram_service import InstagramService
+from .models import EngagementRollup, InstagramMedia
+
+logger = logging.getLogger(__name__)
+
+# Graph API caps media pages at 100 items
+SYNC_PAGE_SIZE = 100
+# Recent media the account insights averages are computed over
+RECENT_MEDIA = 10
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+LISTED_FIELDS = [
+    "media_type",
+    "permalink",
+    "timestamp",
+    "username",
+    "media_url",
+    "thumbnail_url",
+    "like_count",
+]
+
+
+def _sync_key(account: Account) -> str:
+    return f"instagram:media-sync:{account.pk}"
+
+
+def _stop_at(account: Account) -> Optional[datetime]:
+    """Oldest publish time a sync still has to go through, None for all"""
+    watermark = account.instagram_media.aggregate(last=Max("timestamp"))[
+        "last"
+    ]
+    if watermark is None:
+        return None
+    return watermark - timedelta(days=settings.INSTAGRAM_MEDIA_REFRESH_DAYS)
+
+
+def _media_row(account: Account, item: Dict[str, Any], now) -> InstagramMedia:
+    return InstagramMedia(
+        account=account,
+        media_id=item["id"],
+        media_type=item.get("media_type", ""),
+        permalink=item.get("permalink"),
+        timestamp=parse_datetime(item.get("timestamp") or ""),
+        username=item.get("username"),
+        media_url=item.get("media_url"),
+        thumbnail_url=item.get("thumbnail_url"),
+        like_count=item.get("like_count", 0) or 0,
+        updated_at=now,
+    )
+
+
+def _upsert_media(rows: List[InstagramMedia]):
+    InstagramMedia.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["media_id"],
+        update_fields=["account"] + LISTED_FIELDS + ["updated_at"],
+    )
+
+
+def sync_media(account: Account) -> int:
+    """
+    Catalog the media published since the last sync, then refresh the
+    counters that are due
+
+    Returns:
+        Number of media items synced
+
+    Raises:
+        requests.exceptions.RequestException if a page cannot be fetched
+    """
+    stop_at = _stop_at(account)
+    media_ids = []
+
+    pages = InstagramService.iter_media_pages(
+        account.provider_account_id,
+        account.access_token,
+        limit=SYNC_PAGE_SIZE,
+        fields=",".join(["id"] + LISTED_FIELDS),
+        # Incremental syncs usually end on the first page
+        read_ahead=stop_at is None,
+    )
+    for page in pages:
+        now = timezone.now()
+        items = page.get("data", [])
+        rows = [
+            row
+            for row in (_media_row(account, item, now) for item in items)
+            if stop_at is None
+            or row.timestamp is None
+            or row.timestamp >= stop_at
+        ]
+
+        _upsert_media(rows)
+        media_ids.extend(row.media_id for row in rows)
+
+        # Media are listed newest first, the rest is already catalogued
+        if len(rows) < len(items):
+            pages.close()
+            break
+
+    media_refresh.refresh_due(account)
+    return len(media_ids)
+
+
+def mark_synced(account: Account):
+    """Record a sync made elsewhere, e.g. by the sync_instagram worker"""
+    cache.set(_sync_key(account), 1, settings.INSTAGRAM_MEDIA_SYNC_INTERVAL)
+
+
+def _sync(account: Account, key: str) -> Optional[str]:
+    try:
+        sync_media(account)
+    except requests.exceptions.RequestException as e:
+        # Let the next request try again
+        cache.delete(key)
+        return str(e)
+    return None
+
+
+def _sync_in_background(account: Account, key: str):
+    error = _sync(account, key)
+    if error:
+        logger.warning(
+            "Sync of the media catalog of account %s failed: %s",
+            account.pk,
+            error,
+        )
+
+
+def ensure_synced(
+    account: Account, in_background: bool = True
+) -> Optional[str]:
+    """
+    Sync an account's media unless it was synced recently
+
+    The sync runs in the background while the catalog is served, and on
+    the caller's thread for an account with nothing catalogued yet.
+
+    Args:
+        account: Instagram account
+        in_background: Whether a sync may run in the background, off for
+            callers that need it done before they read the catalog
+
+    Returns:
+        Error message if a sync on the caller's thread failed, None
+        otherwise
+    """
+    key = _sync_key(account)
+    if not cache.add(key, 1, settings.INSTAGRAM_MEDIA_SYNC_INTERVAL):
+        return None
+
+    if in_background and account.instagram_media.exists():
+        background.submit(
+            "media catalog sync", lambda: _sync_in_background(account, key)
+        )
+        return None
+
+    return _sync(account, key)
+
+
+def catalog_error(
+    account: Account, in_background: bool = True
+) -> Optional[str]:
+    """Sync error, unless the catalog can still be served"""
+    error = ensure_synced(account, in_background)
+    if error and account.instagram_media.exists():
+        logger.warning(
+            "Serving media catalog of account %s, sync failed: %s",
+            account.pk,
+            error,
+        )
+        return None
+    return error
+
+
+def _media_item(
+    media: InstagramMedia, fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Media item in the shape listed by the Graph API, narrowed to fields"""
+    item = {
+        "id": media.media_id,
+        "media_type": media.media_type,
+        "media_url": media.media_url,
+        "like_count": media.like_count,
+        "permalink": media.permalink,
+        "thumbnail_url": media.thumbnail_url,
+        "timestamp": (
+            media.timestamp.strftime(TIMESTAMP_FORMAT)
+            if media.timestamp
+            else None
+        ),
+        "username": media.username,
+    }
+    return {
+        field: value
+        for field, value in item.items()
+        if value is not None
+        and (fields is None or field == "id" or field in fields)
+    }
+
+
+def list_media(
+    account: Account,
+    limit: int,
+    after: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Page of an account's catalogued media, newest first
+
+    Args:
+        account: Instagram account
+        limit: Page size
+        after: ID of the last media item of the previous page
+        fields: Fields of each media item, all by default. The id is
+            always returned
+
+    Returns:
+        Tuple of the page, with data and paging cursors like the Graph
+        API, and the cursor of the next page, None on the last page
+    """
+    error = catalog_error(account)
+    if error:
+        return {"error": error}, None
+
+    media = account.instagram_media.order_by("-timestamp", "-pk")
+    if after:
+        last = account.instagram_media.filter(media_id=after).first()
+        if last is None:
+            return {"error": "Invalid cursor"}, None
+        media = media.filter(
+            Q(timestamp__lt=last.timestamp)
+            | Q(timestamp=last.timestamp, pk__lt=last.pk)
+        )
+
+    rows = list(media[: limit + 1])
+    page = [_media_item(row, fields) for row in rows[:limit]]
+    next_after = page[-1]["id"] if len(rows) > limit else None
+
+    paging = {}
+    if page:
+        paging["cursors"] = {"before": page[0]["id"], "after": page[-1]["id"]}
+
+    return {"data": page, "paging": paging}, next_after
+
+
+def get_post_engagements(
+    account: Account, count: int = 6, period: str = EngagementRollup.MONTH
+) -> Tuple[Dict[str, Any], float]:
+    """
+    Average engagement per post for the last count months or weeks,
+    served from the engagement rollups
+
+    Args:
+        account: Instagram account
+        count: Number of calendar months, or weeks, to return
+        period: "month" or "week"
+
+    Returns:
+        Tuple of the engagements and the age of the counters in seconds
+    """
+    error = catalog_error(account)
+    if error:
+        return {"error": error}, 0
+
+    return engagement_rollups.post_engagements(account, period, count)
+
+
+def get_account_insights(
+    account: Account, insights_data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Basic account insights, as InstagramService.get_account_basic_insights
+    returns them, with the averages computed over the catalogued recent
+    media instead of a live media list
+
+    Args:
+        account: Instagram account
+        insights_data: Account totals response of the Graph API
+    """
+    error = catalog_error(account)
+    if error:
+        return {"error": error}
+
+    recent = account.instagram_media.order_by("-timestamp", "-pk")
+    media_items = []
+    insights_by_media = {}
+    for media in recent[:RECENT_MEDIA]:
+        media_items.append(
+            {"id": media.media_id, "like_count": media.like_count}
+        )
+        insights_by_media[media.media_id] = {
+            metric: {"value": getattr(media, metric)}
+            for metric in InstagramService.AVERAGE_METRICS.values()
+        }
+
+    return InstagramService._summarize_account_insights(
+        insights_data, media_items, insights_by_media
+    )
@@ -0,0 +1,160 @@
+"""
+Export of an account's catalogued media, one record per media item
+
+Records carry the details of each media item and its insights counters,
+as of their last scheduled refresh (insights_updated_at), so an export
+makes no upstream call per post. The export is a generator pipeline:
+media are read in keyset-paginated chunks of EXPORT_CHUNK_SIZE, turned
+into records, encoded as NDJSON or CSV and optionally gzip-compressed,
+one chunk at a time, so memory stays constant whatever the catalog size.
+
+Media are exported in the order they were catalogued, so items added
+while an export runs come last. An interrupted export is resumed with the
+id of the last record received as cursor.
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+from users.models import Account
+from .instagram_service import InstagramService
+from .media_catalog import TIMESTAMP_FORMAT
+
+FORMATS = ["ndjson", "csv"]
+EXPORT_FIELDS = InstagramService.MEDIA_FIELDS + [
+    *InstagramService.MEDIA_INSIGHT_METRICS,
+    "insights_updated_at",
+]
+EXPORT_CHUNK_SIZE = 500
+
+# Catalog column of each exported field, when named differently
+_COLUMNS = {"id": "media_id"}
+_DATETIME_FIELDS = ["timestamp", "insights_updated_at"]
+
+
+def _with_id(fields: Optional[List[str]]) -> List[str]:
+    fields = fields or EXPORT_FIELDS
+    return fields if "id" in fields else ["id"] + fields
+
+
+def cursor(account: Account, after: Optional[str]) -> Optional[int]:
+    """Position in the catalog after a media ID, None if unknown"""
+    if not after:
+        return None
+    return (
+        account.instagram_media.filter(media_id=after)
+        .values_list("pk", flat=True)
+        .first()
+    )
+
+
+def record_chunks(
+    account: Account,
+    fields: Optional[List[str]] = None,
+    after_pk: Optional[int] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Records of an account's media, in chunks of EXPORT_CHUNK_SIZE
+
+    Args:
+        account: Instagram account
+        fields: Fields of each record, from EXPORT_FIELDS, all by default.
+            The id is always exported
+        after_pk: Position to resume from, see cursor
+    """
+    fields = _with_id(fields)
+    columns = [_COLUMNS.get(field, field) for field in fields]
+
+    last_pk = after_pk or 0
+    while True:
+        # Keyset pagination, no server-side cursor is held between chunks
+        rows = list(
+            account.instagram_media.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", *columns)[:EXPORT_CHUNK_SIZE]
+        )
+        if not rows:
+            return
+
+        chunk = []
+        for row in rows:
+            record = dict(zip(fields, row[1:]))
+            for field in _DATETIME_FIELDS:
+                if record.get(field) is not None:
+                    record[field] = record[field].strftime(TIMESTAMP_FORMAT)
+            chunk.append(record)
+        yield chunk
+
+        last_pk = rows[-1][0]
+
+
+def _ndjson(chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield "".join(json.dumps(record) + "\n" for record in chunk).encode()
+
+
+def _csv(
+    chunks: Iterator[List[Dict[str, Any]]], fields: List[str], header: bool
+) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    if header:
+        writer.writeheader()
+
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """gzip stream of chunks, flushed after each one so none is held back"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def encode(
+    chunks: Iterator[List[Dict[str, Any]]],
+    format: str,
+    fields: Optional[List[str]] = None,
+    header: bool = True,
+    compress: bool = False,
+) -> Iterator[bytes]:
+    """
+    Encode record chunks as NDJSON or CSV
+
+    Args:
+        chunks: Record chunks, from record_chunks
+        format: One of FORMATS
+        fields: Fields of the records, the CSV columns
+        header: Whether to start CSV output with a header row, usually not
+            when resuming
+        compress: Whether to gzip the output
+    """
+    if format == "csv":
+        encoded = _csv(chunks, _with_id(fields), header)
+    else:
+        encoded = _ndjson(chunks)
+    return _gzip(encoded) if compress else encoded
+
+
+def export(
+    account: Account,
+    format: str,
+    fields: Optional[List[str]] = None,
+    after_pk: Optional[int] = None,
+    compress: bool = False,
+) -> Iterator[bytes]:
+    """Encoded export of an account's media, see encode"""
+    return encode(
+        record_chunks(account, fields, after_pk),
+        format,
+        fields,
+        header=after_pk is None,
+        compress=compress,
+    )
@@ -0,0 +1,213 @@
+"""
+Adaptive refresh of the insights counters of catalogued media
+
+Each media item gets its own next refresh time: posts are polled often
+during their first hours, then less and less with age, unless their
+engagement keeps changing. The rate of change is tracked per media item
+as an exponentially weighted moving average of engagements per hour.
+
+Due items are picked in next_refresh_at order from an index on
+(account, next_refresh_at), which acts as a persistent priority queue
+shared by every sync worker, and are refreshed with one batch request per
+account token. Counter changes are added to the account's engagement
+rollups in the same transaction. Items whose refresh fails are retried
+with an exponential backoff, so deleted or inaccessible media don't stay
+at the head of the queue.
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterable, List
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from users.models import Account
+from . import engagement_rollups
+from .engagement_rollups import ENGAGEMENT_FIELDS, ROLLUP_FIELDS
+from .instagram_service import InstagramService
+from .models import InstagramMedia
+
+COUNTER_FIELDS = InstagramService.MEDIA_INSIGHT_METRICS
+# Posts younger than this are refreshed at the minimum interval
+FRESH_HOURS = 48
+# Weight of the latest observation in the rate of change
+RATE_SMOOTHING = 0.3
+# Failures in a row past which the retry delay stops doubling
+MAX_BACKOFF_STEPS = 20
+
+
+def _engagement(media: InstagramMedia) -> int:
+    return sum(getattr(media, field) for field in ENGAGEMENT_FIELDS)
+
+
+def refresh_interval(age_hours: float, rate: float) -> float:
+    """
+    Seconds until the next refresh of a media item
+
+    Args:
+        age_hours: Hours since the media item was published
+        rate: Engagements per hour observed recently
+
+    Returns:
+        The shorter of an interval growing with age and the time the
+        observed rate needs to add INSTAGRAM_REFRESH_TARGET_CHANGE
+        engagements, within the configured bounds
+    """
+    minimum = settings.INSTAGRAM_REFRESH_MIN_INTERVAL
+    maximum = settings.INSTAGRAM_REFRESH_MAX_INTERVAL
+
+    interval = minimum * max(1.0, age_hours / FRESH_HOURS)
+    if rate > 0:
+        interval = min(
+            interval,
+            settings.INSTAGRAM_REFRESH_TARGET_CHANGE / rate * 3600,
+        )
+
+    return min(maximum, max(minimum, interval))
+
+
+def schedule(media: InstagramMedia, previous: int, now: datetime):
+    """
+    Update the rate of change of a refreshed media item and plan its next
+    refresh
+
+    Args:
+        media: Media item with its new counters, not saved yet
+        previous: Engagement before the refresh
+        now: Time of the refresh
+    """
+    age_hours = 0.0
+    if media.timestamp:
+        age_hours = max(0.0, (now - media.timestamp).total_seconds() / 3600)
+
+    engagement = _engagement(media)
+    if media.insights_updated_at is None:
+        # First refresh, start from the average rate since publish
+        media.engagement_rate = engagement / max(age_hours, 1.0)
+    else:
+        hours = (now - media.insights_updated_at).total_seconds() / 3600
+        observed = max(0, engagement - previous) / max(hours, 1 / 60)
+        media.engagement_rate = (
+            RATE_SMOOTHING * observed
+            + (1 - RATE_SMOOTHING) * media.engagement_rate
+        )
+
+    media.insights_updated_at = now
+    media.refresh_failures = 0
+    media.next_refresh_at = now + timedelta(
+        seconds=refresh_interval(age_hours, media.engagement_rate)
+    )
+
+
+def back_off(media: InstagramMedia, now: datetime):
+    """
+    Plan the retry of a media item whose refresh failed, the minimum
+    interval doubled with each failure in a row, up to the maximum
+
+    Args:
+        media: Media item, not saved yet
+        now: Time of the failed refresh
+    """
+    media.refresh_failures = min(media.refresh_failures + 1, MAX_BACKOFF_STEPS)
+    delay = settings.INSTAGRAM_REFRESH_MIN_INTERVAL * 2 ** (
+        media.refresh_failures - 1
+    )
+    media.next_refresh_at = now + timedelta(
+        seconds=min(settings.INSTAGRAM_REFRESH_MAX_INTERVAL, delay)
+    )
+
+
+def refresh_media(account: Account, media: Iterable[InstagramMedia]) -> int:
+    """
+    Refresh the counters of media items with batch requests and schedule
+    their next refresh
+
+    Returns:
+        Number of media items refreshed, items whose insights failed are
+        retried later, see back_off
+    """
+    media = list(media)
+    if not media:
+        return 0
+
+    insights_by_media = InstagramService.get_media_insights_batch(
+        [item.media_id for item in media], account.access_token
+    )
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Compare with the counters as stored now, another worker may have
+        # refreshed some of these media items meanwhile
+        locked = InstagramMedia.objects.select_for_update().in_bulk(
+            [item.pk for item in media]
+        )
+
+        refreshed = []
+        failed = []
+        changes = []
+        for item in locked.values():
+            insights = insights_by_media.get(item.media_id)
+            if insights is None or "error" in insights:
+                back_off(item, now)
+                failed.append(item)
+                continue
+
+            old = (
+                None
+                if item.insights_updated_at is None
+                else {field: getattr(item, field) for field in ROLLUP_FIELDS}
+            )
+            previous = _engagement(item)
+            for field in COUNTER_FIELDS:
+                value = insights.get(field, {}).get("value", 0) or 0
+                setattr(item, field, value)
+            changes.append(
+                (
+                    item.timestamp,
+                    old,
+                    {field: getattr(item, field) for field in ROLLUP_FIELDS},
+                )
+            )
+            schedule(item, previous, now)
+            refreshed.append(item)
+
+        InstagramMedia.objects.bulk_update(
+            refreshed,
+            COUNTER_FIELDS
+            + [
+                "engagement_rate",
+                "insights_updated_at",
+                "next_refresh_at",
+                "refresh_failures",
+            ],
+        )
+        InstagramMedia.objects.bulk_update(
+            failed, ["next_refresh_at", "refresh_failures"]
+        )
+        engagement_rollups.apply(account, changes)
+
+    return len(refreshed)
+
+
+def due_media(account: Account, now: datetime) -> List[InstagramMedia]:
+    """
+    Media items of an account due for a refresh, never refreshed ones
+    first, then most overdue first
+    """
+    return list(
+        account.instagram_media.filter(
+            Q(next_refresh_at__isnull=True) | Q(next_refresh_at__lte=now)
+        ).order_by(F("next_refresh_at").asc(nulls_first=True))[
+            : settings.INSTAGRAM_REFRESH_MAX_PER_SYNC
+        ]
+    )
+
+
+def refresh_due(account: Account) -> int:
+    """
+    Refresh the media items of an account that are due
+
+    Returns:
+        Number of media items refreshed
+    """
+    return refresh_media(account, due_media(account, timezone.now()))
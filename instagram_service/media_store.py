@@ -0,0 +1,188 @@
+"""
+Store of Instagram media metadata, split by how often it changes
+
+The fields of a media item that are fixed at publish time live in the
+InstagramMedia table indefinitely, while like_count and the signed media
+URLs, which change or expire, are cached per access token for
+INSTAGRAM_MEDIA_VOLATILE_TTL seconds only. Refreshing a media item then
+only asks for the volatile fields.
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from .concurrency import token_key
+
+if TYPE_CHECKING:
+    from .models import InstagramMedia
+
+CAROUSEL = "CAROUSEL_ALBUM"
+IMMUTABLE_FIELDS = ["id", "media_type", "permalink", "timestamp", "username"]
+VOLATILE_FIELDS = ["like_count", "media_url", "thumbnail_url"]
+CHILD_IMMUTABLE_FIELDS = ["id", "media_type"]
+CHILD_VOLATILE_FIELDS = ["media_url", "thumbnail_url"]
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def _media_objects():
+    # The package imports the service before the app registry is ready,
+    # so the model can only be imported on use
+    from .models import InstagramMedia
+
+    return InstagramMedia.objects
+
+
+def _volatile_key(media_id: str, access_token: str) -> str:
+    # Per token, so a stored media item is only served to callers whose
+    # token was recently accepted for it upstream
+    return f"instagram:media:{media_id}:{token_key(access_token)}:volatile"
+
+
+def _immutable_defaults(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Carousel items left out of the request are loaded on first use
+    children = None
+    if data.get("media_type") == CAROUSEL and "children" in data:
+        children = [
+            {field: child.get(field) for field in CHILD_IMMUTABLE_FIELDS}
+            for child in data.get("children", {}).get("data", [])
+        ]
+
+    return {
+        "media_type": data.get("media_type", ""),
+        "permalink": data.get("permalink"),
+        "timestamp": parse_datetime(data.get("timestamp") or ""),
+        "username": data.get("username"),
+        "children": children,
+    }
+
+
+def _volatile_entry(data: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {field: data.get(field) for field in VOLATILE_FIELDS}
+    entry["children"] = {
+        child["id"]: {
+            field: child.get(field) for field in CHILD_VOLATILE_FIELDS
+        }
+        for child in data.get("children", {}).get("data", [])
+    }
+    return entry
+
+
+def load(
+    media_id: str, access_token: str
+) -> Tuple[Optional["InstagramMedia"], Optional[Dict]]:
+    """Stored metadata and cached volatile fields of a media item"""
+    media = _media_objects().filter(media_id=media_id).first()
+    return media, cache.get(_volatile_key(media_id, access_token))
+
+
+async def aload(
+    media_id: str, access_token: str
+) -> Tuple[Optional["InstagramMedia"], Optional[Dict]]:
+    media = await _media_objects().filter(media_id=media_id).afirst()
+    return media, await cache.aget(_volatile_key(media_id, access_token))
+
+
+def save_immutable(data: Dict[str, Any]) -> "InstagramMedia":
+    """Store the immutable fields of a media item fetched upstream"""
+    media, _ = _media_objects().update_or_create(
+        media_id=data["id"], defaults=_immutable_defaults(data)
+    )
+    return media
+
+
+async def asave_immutable(data: Dict[str, Any]) -> "InstagramMedia":
+    media, _ = await _media_objects().aupdate_or_create(
+        media_id=data["id"], defaults=_immutable_defaults(data)
+    )
+    return media
+
+
+def save_volatile(
+    media_id: str, access_token: str, data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Cache the volatile fields of a media item fetched upstream"""
+    entry = _volatile_entry(data)
+    cache.set(
+        _volatile_key(media_id, access_token),
+        entry,
+        settings.INSTAGRAM_MEDIA_VOLATILE_TTL,
+    )
+    return entry
+
+
+async def asave_volatile(
+    media_id: str, access_token: str, data: Dict[str, Any]
+) -> Dict[str, Any]:
+    entry = _volatile_entry(data)
+    await cache.aset(
+        _volatile_key(media_id, access_token),
+        entry,
+        settings.INSTAGRAM_MEDIA_VOLATILE_TTL,
+    )
+    return entry
+
+
+def missing_children(media: "InstagramMedia") -> bool:
+    """Whether a stored carousel was catalogued without its items"""
+    return media.media_type == CAROUSEL and media.children is None
+
+
+def volatile_fields(media: "InstagramMedia") -> str:
+    """Fields to request to refresh the volatile part of a media item"""
+    fields = list(VOLATILE_FIELDS)
+    if media.media_type == CAROUSEL:
+        fields.append(
+            f"children{{{','.join(['id'] + CHILD_VOLATILE_FIELDS)}}}"
+        )
+    return ",".join(fields)
+
+
+def merge(
+    media: "InstagramMedia",
+    volatile: Optional[Dict[str, Any]],
+    fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Media details in the shape returned by the Graph API
+
+    Fields the Graph API did not return are left out, as upstream, and
+    so are fields not in fields, except the id.
+    """
+    volatile = volatile or {"children": {}}
+    details = {
+        "id": media.media_id,
+        "media_type": media.media_type,
+        "media_url": volatile.get("media_url"),
+        "like_count": volatile.get("like_count"),
+        "permalink": media.permalink,
+        "thumbnail_url": volatile.get("thumbnail_url"),
+        "timestamp": (
+            media.timestamp.strftime(TIMESTAMP_FORMAT)
+            if media.timestamp
+            else None
+        ),
+        "username": media.username,
+    }
+    details = {
+        field: value
+        for field, value in details.items()
+        if value is not None
+        and (fields is None or field == "id" or field in fields)
+    }
+
+    if media.children is not None and (fields is None or "children" in fields):
+        children = []
+        for child in media.children:
+            child_volatile = volatile["children"].get(child["id"], {})
+            child = {**child, **child_volatile}
+            children.append(
+                {
+                    field: value
+                    for field, value in child.items()
+                    if value is not None
+                }
+            )
+        details["children"] = {"data": children}
+
+    return details
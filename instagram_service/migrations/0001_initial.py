@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="InstagramMedia",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("media_id", models.CharField(max_length=255, unique=True)),
+                ("media_type", models.CharField(max_length=50)),
+                (
+                    "permalink",
+                    models.URLField(blank=True, max_length=500, null=True),
+                ),
+                ("timestamp", models.DateTimeField(blank=True, null=True)),
+                (
+                    "username",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                ("children", models.JSONField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
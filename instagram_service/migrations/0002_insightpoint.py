@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        ("instagram_service", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InsightPoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("metric", models.CharField(max_length=100)),
+                ("date", models.DateField()),
+                ("end_time", models.DateTimeField()),
+                ("value", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="insight_points",
+                        to="users.account",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("account", "metric", "date")},
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        ("instagram_service", "0002_insightpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="account",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="instagram_media",
+                to="users.account",
+            ),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="comments",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="impressions",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="insights_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="like_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="likes",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="media_url",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="reach",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="saved",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="shares",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="thumbnail_url",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="instagrammedia",
+            index=models.Index(
+                fields=["account", "-timestamp"],
+                name="instagram_s_account_5dde8f_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "instagram_service",
+            "0003_instagrammedia_account_instagrammedia_comments_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="engagement_rate",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="next_refresh_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="instagrammedia",
+            index=models.Index(
+                fields=["account", "next_refresh_at"],
+                name="instagram_s_account_b6d522_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+
+def build_rollups(apps, schema_editor):
+    """Roll up the media whose counters were refreshed before this table"""
+    InstagramMedia = apps.get_model("instagram_service", "InstagramMedia")
+    EngagementRollup = apps.get_model("instagram_service", "EngagementRollup")
+
+    fields = ["likes", "comments", "shares", "saved", "reach"]
+    media = InstagramMedia.objects.filter(
+        account__isnull=False,
+        timestamp__isnull=False,
+        insights_updated_at__isnull=False,
+    )
+    for period, trunc in (("month", TruncMonth), ("week", TruncWeek)):
+        buckets = (
+            media.annotate(start=trunc("timestamp"))
+            .values("account_id", "start")
+            .annotate(
+                post_count=Count("id"),
+                **{field: Sum(field) for field in fields},
+            )
+        )
+        EngagementRollup.objects.bulk_create(
+            [
+                EngagementRollup(
+                    account_id=bucket["account_id"],
+                    period=period,
+                    start=bucket["start"].date(),
+                    post_count=bucket["post_count"],
+                    **{field: bucket[field] for field in fields},
+                )
+                for bucket in buckets
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        ("instagram_service", "0004_media_refresh_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EngagementRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("month", "Month"), ("week", "Week")],
+                        max_length=10,
+                    ),
+                ),
+                ("start", models.DateField()),
+                ("post_count", models.IntegerField(default=0)),
+                ("likes", models.BigIntegerField(default=0)),
+                ("comments", models.BigIntegerField(default=0)),
+                ("shares", models.BigIntegerField(default=0)),
+                ("saved", models.BigIntegerField(default=0)),
+                ("reach", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="engagement_rollups",
+                        to="users.account",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("account", "period", "start")},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instagram_service", "0006_backfilljob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="instagrammedia",
+            name="refresh_failures",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,163 @@
+"""
+Models in Database
+"""
+
 from django.db import models
+from users.models import Account
+
+
+class InstagramMedia(models.Model):
+    """
+    Instagram media item, catalogued per account
+
+    The metadata fixed at publish time is authoritative. Media URLs are a
+    snapshot from the last catalog sync (media_catalog) and counters from
+    the last scheduled refresh (media_refresh), media details refresh
+    them through a short-lived cache instead, see media_store.
+    """
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name="instagram_media",
+        blank=True,
+        null=True,
+    )
+    media_id = models.CharField(max_length=255, unique=True)
+    media_type = models.CharField(max_length=50)
+    permalink = models.URLField(max_length=500, blank=True, null=True)
+    timestamp = models.DateTimeField(blank=True, null=True)
+    username = models.CharField(max_length=255, blank=True, null=True)
+    # IDs and types of carousel items, None for other media types or
+    # until they are first loaded
+    children = models.JSONField(blank=True, null=True)
+    media_url = models.TextField(blank=True, null=True)
+    thumbnail_url = models.TextField(blank=True, null=True)
+    like_count = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    shares = models.IntegerField(default=0)
+    saved = models.IntegerField(default=0)
+    impressions = models.IntegerField(default=0)
+    reach = models.IntegerField(default=0)
+    insights_updated_at = models.DateTimeField(blank=True, null=True)
+    # Engagements per hour, smoothed over the last refreshes, and when the
+    # counters are next due, see media_refresh
+    engagement_rate = models.FloatField(default=0)
+    next_refresh_at = models.DateTimeField(blank=True, null=True)
+    # Refreshes failed in a row, retries back off with them
+    refresh_failures = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["account", "-timestamp"]),
+            models.Index(fields=["account", "next_refresh_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.media_type} - {self.media_id}"
+
+
+class InsightPoint(models.Model):
+    """
+    Daily value of an account-level Instagram metric
+
+    Filled incrementally by insights_store, so time series can be served
+    from a range query instead of an upstream call.
+    """
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="insight_points"
+    )
+    metric = models.CharField(max_length=100)
+    date = models.DateField()
+    # end_time reported by the Graph API for the day
+    end_time = models.DateTimeField()
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("account", "metric", "date"),)
+
+    def __str__(self):
+        return f"{self.account} - {self.metric} - {self.date}"
+
+
+class EngagementRollup(models.Model):
+    """
+    Engagement totals of an account's posts published in a calendar month
+    or week
+
+    Kept up to date by engagement_rollups as media counters are refreshed,
+    so engagement charts are a range query on this table.
+    """
+
+    MONTH = "month"
+    WEEK = "week"
+    PERIOD_CHOICES = [(MONTH, "Month"), (WEEK, "Week")]
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="engagement_rollups"
+    )
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    # First day of the month, or Monday of the week, in TIME_ZONE
+    start = models.DateField()
+    post_count = models.IntegerField(default=0)
+    likes = models.BigIntegerField(default=0)
+    comments = models.BigIntegerField(default=0)
+    shares = models.BigIntegerField(default=0)
+    saved = models.BigIntegerField(default=0)
+    reach = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("account", "period", "start"),)
+
+    def __str__(self):
+        return f"{self.account} - {self.period} - {self.start}"
+
+
+class BackfillJob(models.Model):
+    """
+    Fetch of an account's daily metrics history, window by window
+
+    Windows are recorded as they complete, so an interrupted job resumes
+    with the remaining ones, see insights_backfill.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="backfill_jobs"
+    )
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    since = models.DateTimeField()
+    until = models.DateTimeField()
+    # [since, until] epoch seconds of every window, and indices of the
+    # completed ones
+    windows = models.JSONField(default=list)
+    done_windows = models.JSONField(default=list)
+    points = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["account", "-created_at"])]
 
-# Create your models here.
+    def __str__(self):
+        return f"{self.account} - {self.since:%Y-%m-%d} - {self.status}"
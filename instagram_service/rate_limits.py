@@ -0,0 +1,264 @@
+"""
+Rate-limit-aware pacing of Graph API calls
+
+Every Graph API response reports how much of the app quota (X-App-Usage)
+and of the account quota (X-Business-Use-Case-Usage) has been used, as
+percentages. Calls are paced through one token bucket for the app and one
+per access token, and both buckets slow down as the reported usage
+approaches the limit, so calls are deferred before the quota runs out
+instead of failing with a 4xx afterwards.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import httpx
+import requests
+from django.conf import settings
+from .concurrency import token_key
+
+# Cool-down when usage reaches 100% without a regain estimate
+DEFAULT_COOL_DOWN = 60
+# Buckets never pace slower than this fraction of their nominal rate,
+# fresh usage headers decide when to speed up again
+MIN_RATE_FRACTION = 0.05
+
+
+class RateLimitExceeded(requests.exceptions.RequestException, httpx.HTTPError):
+    """
+    Call deferred for longer than INSTAGRAM_RATE_LIMIT_MAX_WAIT
+
+    Raised from both the sync and the async transport, so it is handled
+    by the same error handling as any other failed upstream call.
+    """
+
+
+def _usage_percent(usage: Dict[str, Any]) -> float:
+    return float(
+        max(
+            usage.get("call_count", 0) or 0,
+            usage.get("total_time", 0) or 0,
+            usage.get("total_cputime", 0) or 0,
+        )
+    )
+
+
+def parse_usage_headers(
+    headers,
+) -> Tuple[Optional[float], Optional[float], float]:
+    """
+    Read the usage headers of a Graph API response
+
+    Args:
+        headers: Case-insensitive response headers
+
+    Returns:
+        Tuple of app usage percent, account usage percent (None when the
+        header is missing) and seconds until access is regained
+    """
+    app_usage = None
+    account_usage = None
+    regain_seconds = 0.0
+
+    try:
+        raw = headers.get("X-App-Usage")
+        if raw:
+            app_usage = _usage_percent(json.loads(raw))
+
+        raw = headers.get("X-Business-Use-Case-Usage")
+        if raw:
+            for entries in json.loads(raw).values():
+                for entry in entries:
+                    account_usage = max(
+                        account_usage or 0.0, _usage_percent(entry)
+                    )
+                    # Reported in minutes
+                    regain_seconds = max(
+                        regain_seconds,
+                        float(entry.get("estimated_time_to_regain_access", 0))
+                        * 60,
+                    )
+    except (ValueError, TypeError, AttributeError):
+        # Malformed headers never fail the call itself
+        pass
+
+    return app_usage, account_usage, regain_seconds
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate follows the reported quota usage
+    """
+
+    def __init__(self, calls_per_hour: int):
+        self.capacity = float(calls_per_hour)
+        self.base_rate = calls_per_hour / 3600
+        self.rate = self.base_rate
+        self.tokens = self.capacity
+        self.usage = None
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float, now: float) -> float:
+        """
+        Take cost tokens, possibly ahead of time
+
+        Returns:
+            Seconds the caller has to wait before sending the call
+        """
+        self._refill(now)
+
+        wait = max(0.0, self.blocked_until - now)
+        if cost > self.tokens:
+            wait = max(wait, (cost - self.tokens) / self.rate)
+
+        if wait > settings.INSTAGRAM_RATE_LIMIT_MAX_WAIT:
+            raise RateLimitExceeded(
+                f"Instagram rate limit reached, retry in {int(wait)}s"
+            )
+
+        self.tokens -= cost
+        return wait
+
+    def idle(self, now: float) -> bool:
+        """
+        Unused for long enough to have refilled and not blocked, no
+        different from a new bucket apart from the last reported usage
+        """
+        refill_horizon = self.capacity / self.base_rate
+        return (
+            now >= self.blocked_until and now - self.updated >= refill_horizon
+        )
+
+    def refund(self, cost: float):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def observe(self, usage: float, regain_seconds: float, now: float):
+        """Adapt the bucket to the usage reported by the Graph API"""
+        self._refill(now)
+        self.usage = usage
+        threshold = settings.INSTAGRAM_RATE_LIMIT_THRESHOLD
+
+        if regain_seconds or usage >= 100:
+            cool_down = regain_seconds or DEFAULT_COOL_DOWN
+            self.blocked_until = max(self.blocked_until, now + cool_down)
+            self.tokens = min(self.tokens, 0.0)
+
+        if usage >= threshold:
+            # Share of the remaining quota above the pacing threshold
+            headroom = max(0.0, (100 - usage) / (100 - threshold))
+            self.rate = self.base_rate * max(headroom, MIN_RATE_FRACTION)
+            self.tokens = min(self.tokens, self.capacity * headroom)
+        else:
+            self.rate = self.base_rate
+
+    def state(self, now: float) -> Dict[str, Any]:
+        self._refill(now)
+        return {
+            "usage_percent": self.usage,
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "calls_per_hour": round(self.rate * 3600, 2),
+            "blocked_for": round(max(0.0, self.blocked_until - now), 2),
+        }
+
+
+class UpstreamRateLimiter:
+    """
+    Per-app and per-token pacing of upstream calls in this process
+
+    Token buckets are kept least recently used first, and dropped once
+    idle so tokens seen only once do not pile up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._app_bucket = None
+        self._token_buckets = OrderedDict()
+
+    def _evict_idle(self, now: float):
+        while self._token_buckets:
+            bucket = next(iter(self._token_buckets.values()))
+            if not bucket.idle(now):
+                break
+            self._token_buckets.popitem(last=False)
+
+    def _buckets(self, access_token: str, now: float):
+        if self._app_bucket is None:
+            self._app_bucket = TokenBucket(
+                settings.INSTAGRAM_RATE_LIMIT_APP_CALLS_PER_HOUR
+            )
+
+        self._evict_idle(now)
+        key = token_key(access_token)
+        bucket = self._token_buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(
+                settings.INSTAGRAM_RATE_LIMIT_TOKEN_CALLS_PER_HOUR
+            )
+            self._token_buckets[key] = bucket
+        self._token_buckets.move_to_end(key)
+
+        return self._app_bucket, bucket
+
+    def reserve(self, access_token: str, cost: int = 1) -> float:
+        """
+        Reserve quota for a call made with access_token
+
+        Returns:
+            Seconds to wait before sending the call
+
+        Raises:
+            RateLimitExceeded if the call would have to wait too long
+        """
+        with self._lock:
+            now = time.monotonic()
+            app_bucket, token_bucket = self._buckets(access_token, now)
+
+            app_wait = app_bucket.reserve(cost, now)
+            try:
+                token_wait = token_bucket.reserve(cost, now)
+            except RateLimitExceeded:
+                app_bucket.refund(cost)
+                raise
+
+        return max(app_wait, token_wait)
+
+    def observe(self, access_token: str, headers):
+        """Feed the usage headers of a response back into the buckets"""
+        app_usage, account_usage, regain_seconds = parse_usage_headers(headers)
+        if app_usage is None and account_usage is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            app_bucket, token_bucket = self._buckets(access_token, now)
+
+            if app_usage is not None:
+                app_bucket.observe(app_usage, 0.0, now)
+            if account_usage is not None:
+                token_bucket.observe(account_usage, regain_seconds, now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current throttle state, tokens identified by their key only"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "app": (
+                    self._app_bucket.state(now) if self._app_bucket else None
+                ),
+                "tokens": {
+                    key: bucket.state(now)
+                    for key, bucket in self._token_buckets.items()
+                },
+            }
+
+
+rate_limiter = UpstreamRateLimiter()
@@ -0,0 +1,223 @@
+"""
+Retries and circuit breakers for Graph API calls
+
+Idempotent GETs that fail with a transient error (connection problems,
+5xx, or a Graph API error flagged as transient) are retried with jittered
+exponential backoff. Each endpoint family (media, insights, oauth) has its
+own circuit breaker; while it is open, calls fail fast or are answered from
+the last good response cached for the same call.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+FAMILIES = ("media", "insights", "oauth")
+# Graph API error codes for temporary upstream problems
+TRANSIENT_ERROR_CODES = {1, 2}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+FALLBACK_HEADER = "X-Instagram-Fallback"
+
+
+class CircuitOpenError(requests.exceptions.RequestException, httpx.HTTPError):
+    """
+    Call refused because the circuit of its endpoint family is open
+
+    Raised from both the sync and the async transport, so it is handled
+    by the same error handling as any other failed upstream call.
+    """
+
+
+def endpoint_family(url: str, data: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Endpoint family of a call, used to pick its circuit breaker
+
+    Args:
+        url: Absolute URL of the call
+        data: Form data, inspected for batch requests
+
+    Returns:
+        One of media, insights or oauth
+    """
+    if "/oauth/" in url or "/access_token" in url:
+        return "oauth"
+
+    if isinstance(data, dict) and "batch" in data:
+        url = data["batch"]
+
+    return "insights" if "/insights" in url else "media"
+
+
+def is_transient_response(status_code: int, content: bytes) -> bool:
+    """Whether a response reports an upstream problem worth retrying"""
+    if status_code in TRANSIENT_STATUS_CODES:
+        return True
+
+    if status_code < 400:
+        return False
+
+    try:
+        error = json.loads(content).get("error", {})
+    except (ValueError, AttributeError):
+        return False
+
+    return bool(
+        error.get("is_transient") or error.get("code") in TRANSIENT_ERROR_CODES
+    )
+
+
+def should_retry(method: str, attempt: int) -> bool:
+    """Only idempotent calls are retried, up to INSTAGRAM_RETRY_ATTEMPTS"""
+    return (
+        method.upper() in IDEMPOTENT_METHODS
+        and attempt < settings.INSTAGRAM_RETRY_ATTEMPTS
+    )
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number attempt"""
+    ceiling = min(
+        settings.INSTAGRAM_RETRY_MAX_BACKOFF,
+        settings.INSTAGRAM_RETRY_BACKOFF * (2**attempt),
+    )
+    return random.uniform(0, ceiling)
+
+
+class ResilienceMetrics:
+    """Per-family counters of retries, failures and breaker activity"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def incr(self, family: str, name: str):
+        with self._lock:
+            self._counters[family][name] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                family: dict(counters)
+                for family, counters in self._counters.items()
+            }
+
+
+metrics = ResilienceMetrics()
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After INSTAGRAM_BREAKER_FAILURES transient failures in a row the
+    circuit opens for INSTAGRAM_BREAKER_RESET_TIMEOUT seconds, then lets a
+    single probe call through: success closes it, failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, family: str):
+        self.family = family
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        """Whether a call may be sent upstream now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            # Let one probe through per reset period, a probe that ended
+            # without a verdict (e.g. deferred by the rate limiter) is
+            # replaced after the next period
+            now = time.monotonic()
+            if (
+                now - self.opened_at
+                >= settings.INSTAGRAM_BREAKER_RESET_TIMEOUT
+            ):
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.failures >= settings.INSTAGRAM_BREAKER_FAILURES
+            ):
+                if self.state != self.OPEN:
+                    metrics.incr(self.family, "breaker_opened")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def state_info(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(
+                    0.0,
+                    settings.INSTAGRAM_BREAKER_RESET_TIMEOUT
+                    - (time.monotonic() - self.opened_at),
+                )
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": round(retry_in, 2),
+            }
+
+
+breakers = {family: CircuitBreaker(family) for family in FAMILIES}
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {
+        family: breaker.state_info() for family, breaker in breakers.items()
+    }
+
+
+def fallback_key(method: str, url: str, params: Optional[Dict]) -> str:
+    """
+    Cache key of the last good response of a call, per token since the
+    access token is one of the params
+    """
+    query = urlencode(sorted((params or {}).items()))
+    digest = hashlib.sha256(f"{method} {url}?{query}".encode()).hexdigest()
+    return f"instagram:fallback:{digest}"
+
+
+def store_fallback(key: str, status_code: int, headers, content: bytes):
+    cache.set(
+        key,
+        {
+            "status_code": status_code,
+            "content_type": headers.get("Content-Type", "application/json"),
+            "content": content,
+        },
+        settings.INSTAGRAM_FALLBACK_TTL,
+    )
+
+
+def load_fallback(key: str) -> Optional[Dict[str, Any]]:
+    return cache.get(key)
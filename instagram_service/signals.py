@@ -0,0 +1,29 @@
+"""
+Signal handlers keeping cached insights consistent with accounts
+"""
+
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import receiver
+from users.models import Account
+from .cache import insights_cache
+
+
+@receiver(pre_save, sender=Account)
+def invalidate_on_token_change(sender, instance, **kwargs):
+    """Drop an account's cached insights when its access token changes"""
+    if not instance.pk or not instance.provider_account_id:
+        return
+
+    previous_token = (
+        Account.objects.filter(pk=instance.pk)
+        .values_list("access_token", flat=True)
+        .first()
+    )
+    if previous_token != instance.access_token:
+        insights_cache.invalidate(instance.provider_account_id)
+
+
+@receiver(post_delete, sender=Account)
+def invalidate_on_delete(sender, instance, **kwargs):
+    if instance.provider_account_id:
+        insights_cache.invalidate(instance.provider_account_id)
@@ -0,0 +1,114 @@
+"""
+Streamed responses of events, as Server-Sent Events or NDJSON, and of
+exported records
+
+Views pick the encoding through DRF content negotiation, with the
+renderers below: EventSource clients get text/event-stream, clients
+sending Accept: application/x-ndjson get one JSON object per line.
+
+Django buffers a sync iterator served under ASGI, and an async one
+served under WSGI, so the response is built from whichever iterator
+matches the handler of the request.
+"""
+
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renders error responses of streaming views as a JSON body"""
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class NDJSONRenderer(EventStreamRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class CSVRenderer(EventStreamRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+def encode(event: str, data: Dict[str, Any], format: str) -> bytes:
+    """One event as an SSE message or an NDJSON line"""
+    if format == NDJSONRenderer.format:
+        line = json.dumps({"event": event, **data}, cls=DjangoJSONEncoder)
+        return f"{line}\n".encode()
+
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+
+def stream(
+    request,
+    events: Callable[[], Iterator[Event]],
+    aevents: Callable[[], AsyncIterator[Event]],
+) -> StreamingHttpResponse:
+    """
+    Response streaming (event, data) tuples in the negotiated format
+
+    Args:
+        request: DRF request, after content negotiation
+        events: Returns the events as a sync iterator, served under WSGI
+        aevents: Returns the same events as an async iterator, served
+            under ASGI
+    """
+    renderer = request.accepted_renderer
+
+    if isinstance(request._request, ASGIRequest):
+
+        async def content():
+            async for event, data in aevents():
+                yield encode(event, data, renderer.format)
+
+    else:
+
+        def content():
+            for event, data in events():
+                yield encode(event, data, renderer.format)
+
+    response = StreamingHttpResponse(
+        content(),
+        content_type=f"{renderer.media_type}; charset={renderer.charset}",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Keeps nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def _aiter(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    # Stepped in the thread shared by sync code, where the iterator keeps
+    # its database connection
+    step = sync_to_async(next)
+    while True:
+        chunk = await step(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_chunks(
+    request, chunks: Iterator[bytes], content_type: str
+) -> StreamingHttpResponse:
+    """
+    Response streaming the chunks of a sync iterator, such as a database
+    export, one chunk at a time under both WSGI and ASGI
+    """
+    if isinstance(request._request, ASGIRequest):
+        chunks = _aiter(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
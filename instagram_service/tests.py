@@ -1,3 +1,1759 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from zoneinfo import ZoneInfo
+import numpy as np
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import Account, User
+from . import (
+    background,
+    benchmarks,
+    bucketing,
+    concurrency,
+    dashboard,
+    demographics,
+    insights_backfill,
+    insights_planner,
+    insights_store,
+    media_catalog,
+    media_export,
+    media_refresh,
+    rate_limits,
+    resilience,
+    transport,
+)
+from .cache import InsightsCache, cached
+from .coalescing import coalesce_key
+from .management.commands import sync_instagram
+from .resilience import FALLBACK_HEADER, CircuitOpenError, fallback_key
+from .async_instagram_service import AsyncInstagramService
+from .async_views import AsyncInsightsView
+from .models import BackfillJob, InsightPoint, InstagramMedia
+from .fake_graph import FakeGraph
+from .instagram_service import InstagramService
 
-# Create your tests here.
+
+@override_settings(
+    INSTAGRAM_CACHE_ENABLED=False, INSTAGRAM_COALESCE_REQUESTS=False
+)
+class FakeGraphTestCase(SimpleTestCase):
+    """Runs each test against a fresh fake Graph API"""
+
+    media_count = 30
+
+    def setUp(self):
+        self.graph = FakeGraph(media_count=self.media_count).start()
+        self.addCleanup(self.graph.stop)
+        patched = self.graph.patched()
+        patched.__enter__()
+        self.addCleanup(patched.__exit__, None, None, None)
+
+
+class TransportTests(FakeGraphTestCase):
+    def setUp(self):
+        super().setUp()
+        # A session of this test's own, closed with it
+        session = transport._build_session()
+        self.addCleanup(session.close)
+        for patch in [
+            mock.patch.object(transport, "_session", session),
+            mock.patch.object(
+                transport, "_session_pid", transport.os.getpid()
+            ),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_calls_share_a_connection(self):
+        for _ in range(5):
+            InstagramService.get_user_media("fake", "token", limit=5)
+
+        self.assertEqual(self.graph.requests, 5)
+        self.assertEqual(self.graph.connections, 1)
+
+    def test_session_rebuilt_after_fork(self):
+        session = transport.get_session()
+
+        with mock.patch.object(transport.os, "getpid", return_value=-1):
+            forked = transport.get_session()
+            self.assertIs(transport.get_session(), forked)
+
+        self.assertIsNot(forked, session)
+        forked.close()
+
+    def test_cookies_not_kept(self):
+        self.graph.headers = {"Set-Cookie": "session=account-a; Path=/"}
+
+        InstagramService.get_user_media("fake", "token")
+
+        self.assertEqual(len(transport.get_session().cookies), 0)
+
+
+@override_settings(
+    INSTAGRAM_RETRY_ATTEMPTS=2,
+    INSTAGRAM_RETRY_BACKOFF=0,
+    INSTAGRAM_BREAKER_FAILURES=2,
+    INSTAGRAM_BREAKER_RESET_TIMEOUT=30,
+)
+class ResilienceTests(FakeGraphTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = f"{InstagramService.BASE_URL}/fake/media"
+        self.params = {"access_token": "token"}
+        # Breakers and counters of this test's own
+        self.metrics = resilience.ResilienceMetrics()
+        for patch in [
+            mock.patch.dict(
+                transport.breakers,
+                {
+                    family: resilience.CircuitBreaker(family)
+                    for family in resilience.FAMILIES
+                },
+            ),
+            mock.patch.object(transport, "metrics", self.metrics),
+            mock.patch.object(resilience, "metrics", self.metrics),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def open_circuit(self, family: str):
+        for _ in range(settings.INSTAGRAM_BREAKER_FAILURES):
+            transport.breakers[family].record_failure()
+
+    def test_transient_errors_retried_up_to_the_limit(self):
+        self.graph.failures = 3
+
+        response = transport.get(self.url, params=self.params)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.graph.requests, 3)
+        self.assertEqual(
+            self.metrics.snapshot()["media"], {"retries": 2, "failures": 1}
+        )
+        self.assertEqual(transport.breakers["media"].failures, 1)
+
+    def test_transient_error_recovered(self):
+        self.graph.failures = 1
+
+        response = transport.get(self.url, params=self.params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.graph.requests, 2)
+        self.assertEqual(transport.breakers["media"].failures, 0)
+
+    def test_async_transient_errors_retried(self):
+        self.graph.failures = 1
+
+        response = async_to_sync(transport.async_get)(
+            self.url, params=self.params
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.graph.requests, 2)
+
+    def test_post_not_retried_or_cached(self):
+        data = {
+            "batch": json.dumps(
+                [{"method": "GET", "relative_url": "v22.0/m1/insights"}]
+            ),
+            "access_token": "token",
+        }
+        self.graph.failures = 1
+
+        self.assertEqual(
+            transport.post(InstagramService.BATCH_URL, data=data).status_code,
+            500,
+        )
+        self.assertEqual(self.graph.requests, 1)
+
+        transport.post(InstagramService.BATCH_URL, data=data)
+        self.open_circuit("insights")
+
+        with self.assertRaises(CircuitOpenError):
+            transport.post(InstagramService.BATCH_URL, data=data)
+
+    def test_oauth_not_cached(self):
+        url = f"{InstagramService.HOST_URL}/access_token"
+        transport.get(url, params=self.params)
+        self.open_circuit("oauth")
+
+        with self.assertRaises(CircuitOpenError):
+            transport.get(url, params=self.params)
+
+    def test_open_circuit_serves_the_last_good_response(self):
+        fresh = transport.get(self.url, params=self.params)
+        self.open_circuit("media")
+        self.graph.reset()
+
+        response = transport.get(self.url, params=self.params)
+
+        self.assertEqual(self.graph.requests, 0)
+        self.assertEqual(response.headers[FALLBACK_HEADER], "stale")
+        self.assertEqual(response.json(), fresh.json())
+        with self.assertRaises(CircuitOpenError):
+            transport.get(self.url, params={"access_token": "other"})
+        self.assertEqual(
+            self.metrics.snapshot()["media"],
+            {"breaker_opened": 1, "fallbacks": 1, "fast_failures": 1},
+        )
+
+    def test_half_open_probe(self):
+        breaker = transport.breakers["media"]
+        self.open_circuit("media")
+        # Reset timeout elapsed
+        breaker.opened_at -= settings.INSTAGRAM_BREAKER_RESET_TIMEOUT
+        self.graph.failures = 3
+
+        transport.get(self.url, params=self.params)
+
+        # The failed probe reopens the circuit
+        self.assertEqual(breaker.state, breaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            transport.get(self.url, params=self.params)
+
+        breaker.opened_at -= settings.INSTAGRAM_BREAKER_RESET_TIMEOUT
+        response = transport.get(self.url, params=self.params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+
+
+def graph_response(body, status: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode()
+    response.url = InstagramService.BATCH_URL
+    return response
+
+
+def batch_item(body, code: int = 200):
+    return {"code": code, "body": json.dumps(body)}
+
+
+class BatchTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        # Tests answering otherwise replace self.post
+        patch = mock.patch.object(
+            transport,
+            "post",
+            side_effect=lambda *args, **kwargs: self.post(*args, **kwargs),
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def post(self, url, data, **kwargs):
+        """Answer each batched request with its relative url"""
+        batch = json.loads(data["batch"])
+        self.batches.append(batch)
+        return graph_response(
+            [batch_item({"url": item["relative_url"]}) for item in batch]
+        )
+
+    def test_split_in_batches_of_batch_size(self):
+        urls = [f"m{index}/insights" for index in range(120)]
+
+        bodies = InstagramService.batch_get(urls, "token")
+
+        self.assertEqual([len(batch) for batch in self.batches], [50, 50, 20])
+        self.assertEqual(
+            [body["url"] for body in bodies],
+            [f"{InstagramService.API_VERSION}/{url}" for url in urls],
+        )
+
+    def test_item_errors(self):
+        self.post = lambda url, data, **kwargs: graph_response(
+            [
+                batch_item({"data": []}),
+                None,
+                batch_item({"error": {"message": "Invalid media"}}, 400),
+                batch_item({}, 500),
+                {"code": 200, "body": "not json"},
+            ]
+        )
+
+        bodies = InstagramService.batch_get(["a", "b", "c", "d", "e"], "token")
+
+        self.assertEqual(
+            bodies,
+            [
+                {"data": []},
+                {"error": "Batch request did not complete"},
+                {"error": "Invalid media"},
+                {"error": "HTTP 500"},
+                {"error": "Invalid batch response body"},
+            ],
+        )
+
+    def test_media_insights_by_media(self):
+        self.post = lambda url, data, **kwargs: graph_response(
+            [
+                batch_item(
+                    {"data": [{"name": "reach", "values": [{"value": 7}]}]}
+                ),
+                batch_item({"error": {"message": "Unsupported"}}, 400),
+            ]
+        )
+
+        insights = InstagramService.get_media_insights_batch(
+            ["m1", "m2"], "token", ["reach"]
+        )
+
+        self.assertEqual(insights["m1"]["reach"]["value"], 7)
+        self.assertEqual(insights["m2"], {"error": "Unsupported"})
+
+    def test_media_insights_fall_back_to_single_calls(self):
+        self.post = lambda url, data, **kwargs: graph_response({}, 400)
+        single = graph_response(
+            {"data": [{"name": "reach", "values": [{"value": 3}]}]}
+        )
+
+        with mock.patch.object(transport, "get", return_value=single) as get:
+            insights = InstagramService.get_media_insights_batch(
+                ["m1", "m2"], "token", ["reach"]
+            )
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(insights["m2"]["reach"]["value"], 3)
+
+
+def usage_headers(app: int = 0, account: int = 0, regain_minutes: int = 0):
+    return {
+        "X-App-Usage": json.dumps(
+            {"call_count": app, "total_time": 1, "total_cputime": 1}
+        ),
+        "X-Business-Use-Case-Usage": json.dumps(
+            {
+                "fake": [
+                    {
+                        "type": "instagram",
+                        "call_count": account,
+                        "total_time": 1,
+                        "total_cputime": 1,
+                        "estimated_time_to_regain_access": regain_minutes,
+                    }
+                ]
+            }
+        ),
+    }
+
+
+@override_settings(
+    INSTAGRAM_RATE_LIMIT_APP_CALLS_PER_HOUR=3600,
+    INSTAGRAM_RATE_LIMIT_TOKEN_CALLS_PER_HOUR=360,
+    INSTAGRAM_RATE_LIMIT_THRESHOLD=75,
+    INSTAGRAM_RATE_LIMIT_MAX_WAIT=10,
+)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = rate_limits.UpstreamRateLimiter()
+
+    def test_parse_usage_headers(self):
+        self.assertEqual(
+            rate_limits.parse_usage_headers(usage_headers(40, 90, 2)),
+            (40.0, 90.0, 120.0),
+        )
+
+    def test_parse_missing_or_malformed_headers(self):
+        self.assertEqual(
+            rate_limits.parse_usage_headers({}), (None, None, 0.0)
+        )
+        self.assertEqual(
+            rate_limits.parse_usage_headers({"X-App-Usage": "{not json"}),
+            (None, None, 0.0),
+        )
+
+    def test_calls_within_quota_do_not_wait(self):
+        for _ in range(360):
+            self.assertEqual(self.limiter.reserve("token"), 0)
+
+    def test_call_over_quota_waits_for_refill(self):
+        for _ in range(360):
+            self.limiter.reserve("token")
+
+        # 360 calls an hour refill one every 10 seconds
+        self.assertAlmostEqual(self.limiter.reserve("token"), 10, places=1)
+
+    def test_usage_above_threshold_slows_down(self):
+        self.limiter.reserve("token")
+        self.limiter.observe("token", usage_headers(account=95))
+
+        state = self.limiter.snapshot()["tokens"]
+        bucket = next(iter(state.values()))
+        self.assertEqual(bucket["usage_percent"], 95)
+        # A fifth of the headroom left above the 75% threshold
+        self.assertAlmostEqual(bucket["calls_per_hour"], 72)
+        self.assertLessEqual(bucket["tokens"], 72)
+
+    def test_regain_time_blocks_the_token(self):
+        self.limiter.observe("token", usage_headers(account=100))
+
+        with self.assertRaises(rate_limits.RateLimitExceeded):
+            self.limiter.reserve("token")
+        # The app quota taken by the refused call is given back
+        self.assertEqual(self.limiter.snapshot()["app"]["tokens"], 3600)
+        # Other tokens are not held back
+        self.assertEqual(self.limiter.reserve("other"), 0)
+
+    def test_rate_limit_exceeded_is_a_request_error(self):
+        self.limiter.observe("token", usage_headers(account=100))
+
+        with mock.patch.object(transport, "rate_limiter", self.limiter):
+            media = InstagramService.get_user_media("fake", "token")
+
+        self.assertIn("rate limit", media["error"])
+
+    def test_idle_token_buckets_dropped(self):
+        self.limiter.reserve("old")
+        self.limiter.observe(
+            "blocked", usage_headers(account=100, regain_minutes=90)
+        )
+        later = time.monotonic() + 3600
+
+        with mock.patch.object(rate_limits.time, "monotonic") as monotonic:
+            # Refilled by now, but still blocked for the other token
+            monotonic.return_value = later
+            self.limiter.reserve("new")
+            self.assertEqual(len(self.limiter.snapshot()["tokens"]), 2)
+
+            monotonic.return_value = later + 5400
+            self.limiter.reserve("new")
+
+        self.assertEqual(
+            list(self.limiter.snapshot()["tokens"]),
+            [concurrency.token_key("new")],
+        )
+
+
+class TokenSlotTests(SimpleTestCase):
+    def test_slots_dropped_once_released(self):
+        with concurrency.token_slot("token"):
+            self.assertEqual(len(concurrency._token_slots), 1)
+
+        self.assertEqual(concurrency._token_slots, {})
+
+    def test_async_slots_dropped_once_released(self):
+        async def hold():
+            slots = transport._async_token_slots
+            loop = transport.asyncio.get_running_loop()
+            async with transport._async_token_slot("token"):
+                self.assertEqual(len(slots[loop]), 1)
+            return slots[loop]
+
+        self.assertEqual(async_to_sync(hold)(), {})
+
+
+class TransportUsageTests(FakeGraphTestCase):
+    def test_usage_headers_fed_back(self):
+        self.graph.headers = usage_headers(app=20, account=80)
+        limiter = rate_limits.UpstreamRateLimiter()
+
+        with mock.patch.object(transport, "rate_limiter", limiter):
+            InstagramService.get_user_media("fake", "token")
+
+        state = limiter.snapshot()
+        self.assertEqual(state["app"]["usage_percent"], 20)
+        self.assertEqual(
+            [bucket["usage_percent"] for bucket in state["tokens"].values()],
+            [80],
+        )
+
+
+class MediaPagesTests(FakeGraphTestCase):
+    def wait_for_requests(self, count: int):
+        deadline = time.monotonic() + 5
+        while self.graph.requests < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_pages_in_order(self):
+        pages = list(InstagramService.iter_media_pages("fake", "token", 10))
+
+        self.assertEqual(
+            [item["id"] for page in pages for item in page["data"]],
+            [f"m{index}" for index in range(self.media_count)],
+        )
+        self.assertEqual(self.graph.requests, 3)
+
+    def test_user_media(self):
+        media = InstagramService.iter_user_media(
+            "fake", "token", limit=7, after="21"
+        )
+
+        self.assertEqual(
+            [item["id"] for item in media],
+            [f"m{index}" for index in range(21, self.media_count)],
+        )
+
+    def test_next_page_prefetched(self):
+        pages = InstagramService.iter_media_pages("fake", "token", 10)
+
+        next(pages)
+
+        # Fetched while the caller works on the first page
+        self.wait_for_requests(2)
+        self.assertEqual(self.graph.requests, 2)
+        next(pages)
+        self.wait_for_requests(3)
+        self.assertEqual(self.graph.requests, 3)
+        pages.close()
+
+    def test_closing_early_stops_fetching(self):
+        media = InstagramService.iter_user_media("fake", "token", limit=5)
+
+        for _, item in zip(range(7), media):
+            pass
+        media.close()
+        requests_made = self.graph.requests
+        time.sleep(0.1)
+
+        # The second page and at most its prefetched successor
+        self.assertEqual(item["id"], "m6")
+        self.assertIn(requests_made, (2, 3))
+        self.assertEqual(self.graph.requests, requests_made)
+
+    def test_no_read_ahead(self):
+        pages = InstagramService.iter_media_pages(
+            "fake", "token", 10, read_ahead=False
+        )
+
+        next(pages)
+        pages.close()
+
+        self.assertEqual(self.graph.requests, 1)
+
+
+class InsightsPlannerTests(SimpleTestCase):
+    DAY = 86400
+
+    def test_merges_compatible_requests(self):
+        calls = insights_planner.plan(
+            {
+                "totals": insights_planner.metric_request(
+                    ["follower_count", "reach"],
+                    period="day",
+                    metric_type="total_value",
+                ),
+                "reach": insights_planner.metric_request(
+                    ["reach", "likes"], period="day", metric_type="total_value"
+                ),
+                "ages": insights_planner.metric_request(
+                    ["follower_demographics"],
+                    period="lifetime",
+                    metric_type="total_value",
+                    breakdown="age",
+                ),
+            }
+        )
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0]["members"], ["totals", "reach"])
+        self.assertEqual(
+            calls[0]["params"]["metric"], "follower_count,reach,likes"
+        )
+        self.assertEqual(calls[1]["members"], ["ages"])
+
+    def test_windows_capped(self):
+        def series(since, until):
+            return insights_planner.metric_request(
+                ["follower_count"],
+                period="day",
+                metric_type="time_series",
+                since=since * self.DAY,
+                until=until * self.DAY,
+            )
+
+        calls = insights_planner.plan(
+            {"a": series(0, 20), "b": series(10, 30), "c": series(25, 40)}
+        )
+
+        self.assertEqual(
+            [call["members"] for call in calls], [["a", "b"], ["c"]]
+        )
+        self.assertEqual(
+            (calls[0]["params"]["since"], calls[0]["params"]["until"]),
+            (0, 30 * self.DAY),
+        )
+        self.assertEqual(
+            insights_planner.windows(0, 70 * self.DAY),
+            [
+                (0, 30 * self.DAY),
+                (30 * self.DAY, 60 * self.DAY),
+                (60 * self.DAY, 70 * self.DAY),
+            ],
+        )
+
+    def test_split_filters_metrics_and_window(self):
+        def value(day):
+            end_time = datetime.fromtimestamp(day * self.DAY, ZoneInfo("UTC"))
+            return {"value": day, "end_time": end_time.isoformat()}
+
+        requests_by_name = {
+            "likes": insights_planner.metric_request(
+                ["likes"],
+                period="day",
+                metric_type="time_series",
+                since=0,
+                until=10 * self.DAY,
+            ),
+            "reach": insights_planner.metric_request(
+                ["reach"],
+                period="day",
+                metric_type="time_series",
+                since=5 * self.DAY,
+                until=8 * self.DAY,
+            ),
+        }
+        (call,) = insights_planner.plan(requests_by_name)
+        body = {
+            "data": [
+                {"name": name, "values": [value(day) for day in range(1, 11)]}
+                for name in ("likes", "reach")
+            ]
+        }
+
+        likes = insights_planner.split(body, call, requests_by_name["likes"])
+        reach = insights_planner.split(body, call, requests_by_name["reach"])
+
+        self.assertEqual([item["name"] for item in likes["data"]], ["likes"])
+        self.assertEqual(len(likes["data"][0]["values"]), 10)
+        self.assertEqual(
+            [point["value"] for point in reach["data"][0]["values"]],
+            [6, 7, 8],
+        )
+        self.assertEqual(
+            insights_planner.split({"error": "x"}, call, {}), {"error": "x"}
+        )
+
+
+class PlannedInsightsTests(FakeGraphTestCase):
+    def test_audiences_share_calls(self):
+        result = InstagramService.get_audience_demographics(
+            "fake",
+            "token",
+            ["age", "city"],
+            ["this_week"],
+            ["followers", "engaged"],
+        )
+
+        # One batch request of one call per breakdown
+        self.assertEqual(self.graph.paths, ["POST /"])
+        self.assertEqual(result["errors"], [])
+        for audience in ("followers", "engaged"):
+            self.assertEqual(
+                len(
+                    result["demographics"][audience]["this_week"]["city"][
+                        "keys"
+                    ]
+                ),
+                5,
+            )
+
+    def test_dashboard_insights_in_one_request(self):
+        result = InstagramService.get_dashboard_insights(
+            "fake", "token", InstagramService.DASHBOARD_INSIGHTS
+        )
+
+        self.assertEqual(self.graph.paths, ["POST /"])
+        self.assertEqual(result["errors"], [])
+        self.assertIn(
+            "follower_count",
+            [item["name"] for item in result["account_totals"]["data"]],
+        )
+        self.assertEqual(len(result["demographics"]["countries"]), 5)
+
+
+@override_settings(INSTAGRAM_CACHE_ENABLED=True)
+class StaleWhileRevalidateTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.insights_cache = InsightsCache()
+        patch = mock.patch(
+            "instagram_service.cache.insights_cache", self.insights_cache
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.results = [{"value": 2}]
+        self.refreshing = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+        @cached("get_account_basic_insights")
+        def fetch(ig_id, access_token):
+            self.calls += 1
+            self.refreshing.set()
+            self.release.wait(5)
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.fetch = fetch
+        # Fetched 100 seconds ago, expired 40 seconds ago
+        key = InsightsCache.call_key("fake", "get_account_basic_insights", {})
+        fetched_at = time.time() - 100
+        with mock.patch("instagram_service.cache.time.time") as now:
+            now.return_value = fetched_at
+            self.insights_cache.set("fake", key, {"value": 1}, 60)
+
+    def wait_for_refresh(self):
+        self.release.set()
+        self.insights_cache._executor.shutdown(wait=True)
+        self.insights_cache._executor = None
+
+    def test_stale_served_while_one_refresh_runs(self):
+        served = [self.fetch.with_age("fake", "token") for _ in range(3)]
+
+        self.assertTrue(self.refreshing.wait(5))
+        for value, age in served:
+            self.assertEqual(value, {"value": 1})
+            self.assertGreaterEqual(age, 100)
+        self.wait_for_refresh()
+
+        self.assertEqual(self.calls, 1)
+        value, age = self.fetch.with_age("fake", "token")
+        self.assertEqual(value, {"value": 2})
+        self.assertLess(age, 5)
+        stats = self.insights_cache.stats()
+        self.assertEqual(stats["stale_served"], 3)
+        self.assertEqual(stats["refreshes"], 1)
+
+    def test_failed_refresh_keeps_the_entry(self):
+        self.results = [
+            {"error": "Upstream unavailable"},
+            requests.exceptions.ConnectionError("Upstream unavailable"),
+        ]
+
+        with self.assertLogs("instagram_service.cache", "ERROR"):
+            for _ in range(2):
+                self.fetch.with_age("fake", "token")
+                self.wait_for_refresh()
+
+        self.assertEqual(self.calls, 2)
+        value, fetched_at, expires_at = self.insights_cache.get(
+            "fake",
+            InsightsCache.call_key("fake", "get_account_basic_insights", {}),
+        )
+        self.assertEqual(value, {"value": 1})
+        self.assertLess(expires_at, time.time())
+
+
+class CoalescingTests(FakeGraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph.delay = 0.2
+
+    def fetch_concurrently(self, tokens):
+        with self.settings(INSTAGRAM_COALESCE_REQUESTS=True):
+            with ThreadPoolExecutor(max_workers=len(tokens)) as executor:
+                return list(
+                    executor.map(
+                        lambda token: InstagramService.get_user_media(
+                            "fake", token, limit=5
+                        ),
+                        tokens,
+                    )
+                )
+
+    def test_identical_calls_share_one_upstream_call(self):
+        media = self.fetch_concurrently(["token"] * 4)
+
+        self.assertEqual(self.graph.requests, 1)
+        self.assertTrue(all(page == media[0] for page in media))
+
+    def test_calls_of_other_tokens_are_not_shared(self):
+        self.fetch_concurrently(["token-a", "token-b"])
+
+        self.assertEqual(self.graph.requests, 2)
+
+    def test_keys_are_per_token(self):
+        url = f"{InstagramService.BASE_URL}/fake/media"
+        params = {"limit": 5, "access_token": "token-a"}
+        reordered = {"access_token": "token-a", "limit": 5}
+        other_token = {"limit": 5, "access_token": "token-b"}
+
+        self.assertEqual(
+            coalesce_key(url, params), coalesce_key(url, reordered)
+        )
+        self.assertNotEqual(
+            coalesce_key(url, params), coalesce_key(url, other_token)
+        )
+        self.assertNotEqual(
+            fallback_key("GET", url, params),
+            fallback_key("GET", url, other_token),
+        )
+
+
+class AccountInsightsErrorTests(FakeGraphTestCase):
+    def setUp(self):
+        super().setUp()
+        # An account of its own, so no other test's entries are cached
+        self.ig_id = uuid.uuid4().hex
+        cache_enabled = self.settings(INSTAGRAM_CACHE_ENABLED=True)
+        cache_enabled.enable()
+        self.addCleanup(cache_enabled.disable)
+
+    def test_media_list_error(self):
+        failed = mock.patch.object(
+            InstagramService,
+            "get_user_media",
+            return_value={"error": "Media list unavailable"},
+        )
+
+        def fetch():
+            return InstagramService.get_account_basic_insights(
+                self.ig_id, "token"
+            )
+
+        with failed:
+            self.assertEqual(fetch(), {"error": "Media list unavailable"})
+        # Not cached, fetched again once upstream works
+        self.assertNotIn("error", fetch())
+
+    def test_media_insights_error(self):
+        media = mock.patch.object(
+            InstagramService,
+            "get_user_media",
+            return_value={
+                "data": [
+                    {"id": "m0", "like_count": 10},
+                    {"id": "m1", "like_count": 1000},
+                ]
+            },
+        )
+        failed = mock.patch.object(
+            InstagramService,
+            "get_media_insights_batch",
+            return_value={"m0": {}, "m1": {"error": "Unsupported"}},
+        )
+
+        with media, failed:
+            result = InstagramService.get_account_basic_insights(
+                self.ig_id, "token"
+            )
+
+        # Left out of the averages, reported next to them
+        self.assertEqual(result["avg_likes"], 10)
+        self.assertEqual(
+            result["errors"], [{"media_id": "m1", "error": "Unsupported"}]
+        )
+        # Not cached, fetched again once upstream works
+        self.assertNotIn(
+            "errors",
+            InstagramService.get_account_basic_insights(self.ig_id, "token"),
+        )
+
+    def test_async_media_insights_error(self):
+        failed = mock.patch.object(
+            AsyncInstagramService,
+            "get_media_insights_batch",
+            mock.AsyncMock(return_value={"m1": {"error": "Unsupported"}}),
+        )
+        fetch = async_to_sync(AsyncInstagramService.get_account_basic_insights)
+
+        with failed:
+            result = fetch(self.ig_id, "token")
+        self.assertEqual(
+            result["errors"], [{"media_id": "m1", "error": "Unsupported"}]
+        )
+        self.assertIn("avg_likes", result)
+        self.assertNotIn("errors", fetch(self.ig_id, "token"))
+
+
+class DemographicsTests(SimpleTestCase):
+    def test_follower_demographics(self):
+        data = {
+            "data": [
+                {
+                    "name": "follower_demographics",
+                    "total_value": {
+                        "breakdowns": [
+                            {
+                                "dimension_keys": ["city"],
+                                "results": [
+                                    {
+                                        "dimension_values": ["Paris"],
+                                        "value": 3,
+                                    }
+                                ],
+                            },
+                            {
+                                "dimension_keys": ["gender", "age"],
+                                "results": [
+                                    {
+                                        "dimension_values": ["F", "18-24"],
+                                        "value": 5,
+                                    }
+                                ],
+                            },
+                        ]
+                    },
+                }
+            ]
+        }
+
+        self.assertEqual(
+            demographics.format_follower_demographics(data),
+            {
+                "countries": [],
+                "cities": [{"city": "Paris", "value": 3}],
+                "gender_split": [],
+                "age_gender_split": [
+                    {"gender": "F", "age": "18-24", "value": 5}
+                ],
+            },
+        )
+
+    def test_breakdown_without_dimensions(self):
+        breakdown = {
+            "dimension_keys": [],
+            "results": [{"dimension_values": [], "value": 7}],
+        }
+
+        self.assertEqual(
+            demographics.decode_breakdown(breakdown),
+            {"dimensions": [], "keys": [()], "values": [7]},
+        )
+        self.assertEqual(
+            demographics.decode_breakdown({}),
+            {"dimensions": [], "keys": [], "values": []},
+        )
+
+
+class BucketingTests(SimpleTestCase):
+    def test_empty_window(self):
+        now = timezone.now()
+
+        starts, index = bucketing.assign(
+            [int(now.timestamp())],
+            "month",
+            bucketing.window_start(now, "month", 0),
+            now,
+        )
+
+        self.assertEqual(starts, [])
+        self.assertEqual(index.tolist(), [-1])
+
+    def test_aggregate(self):
+        tz = ZoneInfo("UTC")
+        start = datetime(2024, 1, 1, tzinfo=tz)
+        end = datetime(2024, 3, 31, tzinfo=tz)
+        timestamps = bucketing.parse_timestamps(
+            [
+                "2023-12-31T23:00:00+0000",
+                "2024-01-10T10:00:00+0000",
+                "2024-01-20T10:00:00-0500",
+                "2024-03-01T00:00:00+0000",
+            ]
+        )
+
+        months = bucketing.aggregate(
+            timestamps, {"likes": [100, 1, 2, 6]}, "month", start, end, tz
+        )
+
+        self.assertEqual([month.month for month in months["start"]], [1, 2, 3])
+        self.assertEqual(months["count"].tolist(), [2, 0, 1])
+        likes = months["metrics"]["likes"]
+        self.assertEqual(likes["sum"].tolist(), [3, 0, 6])
+        self.assertEqual(likes["mean"][0], 1.5)
+        self.assertTrue(np.isnan(likes["median"][1]))
+
+
+class AccountTestMixin:
+    """Runs each test with a connected account of a signed-in user"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="creator@example.com", username="creator", password="x"
+        )
+        self.account = Account.objects.create(
+            user=self.user,
+            type="oauth",
+            provider="instagram",
+            provider_account_id="fake",
+            access_token="token",
+        )
+        self.auth = {
+            "Authorization": "Bearer "
+            + str(RefreshToken.for_user(self.user).access_token)
+        }
+
+    def store_points(self, metric: str, values: list):
+        now = timezone.now()
+        insights_store.upsert_points(
+            [
+                InsightPoint(
+                    account=self.account,
+                    metric=metric,
+                    date=(now - timedelta(days=day)).date(),
+                    end_time=now - timedelta(days=day),
+                    value=value,
+                    updated_at=now,
+                )
+                for day, value in enumerate(values)
+            ]
+        )
+
+    def store_media(self, count: int):
+        """Catalog count more media items, one a day, newest first"""
+        now = timezone.now()
+        stored = self.account.instagram_media.count()
+        InstagramMedia.objects.bulk_create(
+            [
+                InstagramMedia(
+                    account=self.account,
+                    media_id=f"m{index}",
+                    media_type="IMAGE",
+                    permalink=f"https://www.instagram.com/p/m{index}/",
+                    timestamp=now - timedelta(days=index),
+                    username="creator",
+                    like_count=index,
+                )
+                for index in range(stored, stored + count)
+            ]
+        )
+
+    def background_syncs(self, module, sync: str, stored):
+        """
+        Record the syncs submitted in the background, and make the given
+        sync function of module store what stored does instead of calling
+        upstream
+        """
+        submitted = []
+        for patch in [
+            mock.patch.object(
+                background,
+                "submit",
+                side_effect=lambda name, sync: submitted.append(sync),
+            ),
+            mock.patch.object(module, sync, side_effect=stored),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return submitted
+
+    def start_graph(self) -> FakeGraph:
+        """Fake Graph API answering for the account during the test"""
+        graph = FakeGraph().start()
+        self.addCleanup(graph.stop)
+        patched = graph.patched()
+        patched.__enter__()
+        self.addCleanup(patched.__exit__, None, None, None)
+        return graph
+
+
+class AccountTestCase(AccountTestMixin, TestCase):
+    pass
+
+
+class ThreadedAccountTestCase(AccountTestMixin, TransactionTestCase):
+    """Commits the account, for code reading it from worker threads"""
+
+
+class InsightsStoreTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.submitted = self.background_syncs(
+            insights_store,
+            "sync_account",
+            lambda account: self.store_points("follower_count", [12, 11]),
+        )
+
+    def test_first_sync_on_the_request(self):
+        growth, age = insights_store.get_followers_growth(self.account, 1)
+
+        self.assertEqual(
+            [point["value"] for point in growth["follower_growth"]], [11, 12]
+        )
+        self.assertEqual(self.submitted, [])
+
+    def test_due_sync_in_the_background(self):
+        self.store_points("follower_count", [10])
+
+        growth, age = insights_store.get_followers_growth(self.account, 1)
+
+        # Stored points served, the sync left to the background
+        insights_store.sync_account.assert_not_called()
+        self.assertEqual(
+            [point["value"] for point in growth["follower_growth"]], [10]
+        )
+        self.assertEqual(len(self.submitted), 1)
+
+        self.submitted[0]()
+        insights_store.sync_account.assert_called_once()
+
+    def test_synced_once_per_interval(self):
+        self.store_points("follower_count", [10])
+        self.store_points("likes", [0] * 32)
+
+        insights_store.get_followers_growth(self.account, 1)
+        insights_store.get_current_month_likes(self.account)
+
+        self.assertEqual(len(self.submitted), 1)
+
+    def test_range_not_stored_fetched_live(self):
+        self.store_points("follower_count", [10, 9])
+        live = {"follower_growth": [{"date": "2024-01-01", "value": 1}]}
+
+        with mock.patch.object(
+            InstagramService.get_followers_growth,
+            "with_age",
+            return_value=(live, 60),
+        ) as with_age:
+            growth, age = insights_store.get_followers_growth(self.account, 90)
+
+        with_age.assert_called_once_with("fake", "token", 90)
+        self.assertEqual((growth, age), (live, 60))
+
+    def test_stored_range_served(self):
+        self.store_points("follower_count", list(range(91)))
+
+        with mock.patch.object(
+            InstagramService.get_followers_growth, "with_age"
+        ) as with_age:
+            growth, age = insights_store.get_followers_growth(self.account, 90)
+
+        with_age.assert_not_called()
+        self.assertEqual(len(growth["follower_growth"]), 90)
+
+    def test_async_view_reads_the_store(self):
+        self.store_points("follower_count", [10])
+
+        response = async_to_sync(self.async_client.get)(
+            "/api/instagram/async/insights/followers-growth/?days=1",
+            headers=self.auth,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [point["value"] for point in response.json()["follower_growth"]],
+            [10],
+        )
+        self.assertIn("Age", response.headers)
+
+
+class MediaCatalogTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.submitted = self.background_syncs(
+            media_catalog, "sync_media", lambda account: self.store_media(3)
+        )
+
+    def test_first_sync_on_the_request(self):
+        page, next_after = media_catalog.list_media(self.account, 10)
+
+        self.assertEqual(len(page["data"]), 3)
+        self.assertEqual(self.submitted, [])
+
+    def test_due_sync_in_the_background(self):
+        self.store_media(1)
+
+        page, next_after = media_catalog.list_media(self.account, 10)
+
+        # Stored media served, the sync left to the background
+        media_catalog.sync_media.assert_not_called()
+        self.assertEqual(len(page["data"]), 1)
+        self.assertEqual(len(self.submitted), 1)
+
+    def test_sync_before_reading(self):
+        self.store_media(1)
+
+        self.assertIsNone(
+            media_catalog.catalog_error(self.account, in_background=False)
+        )
+
+        media_catalog.sync_media.assert_called_once()
+        self.assertEqual(self.submitted, [])
+
+    def test_async_post_engagements_from_the_catalog(self):
+        response = async_to_sync(self.async_client.get)(
+            "/api/instagram/async/insights/post-engagements/"
+            "?period=week&weeks=3",
+            headers=self.auth,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["post_engagements_by_week"]), 3)
+        self.assertIn("Age", response.headers)
+        media_catalog.sync_media.assert_called_once()
+
+    def test_async_post_engagements_period_checked(self):
+        response = async_to_sync(self.async_client.get)(
+            "/api/instagram/async/insights/post-engagements/?period=day",
+            headers=self.auth,
+        )
+
+        self.assertEqual(response.status_code, 400)
+        media_catalog.sync_media.assert_not_called()
+
+
+class MediaExportTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store_media(5)
+        self.background_syncs(media_catalog, "sync_media", lambda account: 0)
+        # Several chunks of a few records
+        patch = mock.patch.object(media_export, "EXPORT_CHUNK_SIZE", 2)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def export(self, query: str = "") -> bytes:
+        response = self.client.get(
+            f"/api/instagram/media/export/{query}", headers=self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_ndjson(self):
+        records = [
+            json.loads(line) for line in self.export().decode().splitlines()
+        ]
+
+        self.assertEqual(
+            [record["id"] for record in records],
+            ["m0", "m1", "m2", "m3", "m4"],
+        )
+        self.assertEqual(list(records[1]), media_export.EXPORT_FIELDS)
+        self.assertEqual(records[1]["like_count"], 1)
+        self.assertIsNone(records[1]["insights_updated_at"])
+
+    def test_csv(self):
+        rows = list(
+            csv.DictReader(io.StringIO(self.export("?format=csv").decode()))
+        )
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(rows[0]), media_export.EXPORT_FIELDS)
+        self.assertEqual(rows[2]["id"], "m2")
+        self.assertEqual(rows[2]["like_count"], "2")
+
+    def test_fields_keep_the_id(self):
+        records = [
+            json.loads(line)
+            for line in self.export("?fields=like_count").decode().splitlines()
+        ]
+
+        self.assertEqual(records[0], {"id": "m0", "like_count": 0})
+
+    def test_resume_after_cursor(self):
+        content = self.export("?format=csv&after=m2").decode()
+
+        # No header when resuming
+        self.assertEqual(
+            [line.split(",")[0] for line in content.splitlines()],
+            ["m3", "m4"],
+        )
+
+    def test_unknown_cursor(self):
+        response = self.client.get(
+            "/api/instagram/media/export/?after=unknown", headers=self.auth
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_gzip(self):
+        self.assertEqual(
+            gzip.decompress(self.export("?format=csv&gzip=1")),
+            self.export("?format=csv"),
+        )
+
+    def test_command_resumes_into_the_same_file(self):
+        output = os.path.join(tempfile.mkdtemp(), "media.csv")
+        self.addCleanup(os.remove, output)
+        options = {"format": "csv", "fields": "like_count", "output": output}
+
+        call_command(
+            "export_instagram_media", "fake", stderr=io.StringIO(), **options
+        )
+        call_command(
+            "export_instagram_media",
+            "fake",
+            after="m2",
+            stderr=io.StringIO(),
+            **options,
+        )
+
+        # Appended after the cursor, without a second header
+        with open(output) as exported:
+            rows = list(csv.DictReader(exported))
+        self.assertEqual(
+            [row["id"] for row in rows],
+            ["m0", "m1", "m2", "m3", "m4", "m3", "m4"],
+        )
+        self.assertEqual(rows[-1]["like_count"], "4")
+
+    def test_command_unknown_fields(self):
+        with self.assertRaises(CommandError):
+            call_command("export_instagram_media", "fake", fields="id,unknown")
+
+
+@override_settings(
+    INSTAGRAM_CACHE_ENABLED=False, INSTAGRAM_COALESCE_REQUESTS=False
+)
+class MediaDetailsTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph = self.start_graph()
+
+    def test_stored_media_checked_per_token(self):
+        InstagramService.get_media_details("m2", "token")
+        self.graph.reset()
+
+        details = InstagramService.get_media_details(
+            "m2", "other-token", ["timestamp"]
+        )
+
+        self.assertEqual(self.graph.requests, 1)
+        self.assertIn("access_token=other-token", self.graph.paths[0])
+        self.assertEqual(set(details), {"id", "timestamp"})
+
+    def test_async_stored_media_checked_per_token(self):
+        InstagramService.get_media_details("m2", "token")
+        self.graph.reset()
+
+        async_to_sync(AsyncInstagramService.get_media_details)(
+            "m2", "other-token", ["timestamp"]
+        )
+
+        self.assertEqual(self.graph.requests, 1)
+        self.assertIn("access_token=other-token", self.graph.paths[0])
+
+    def test_same_token_served_from_store(self):
+        InstagramService.get_media_details("m2", "token")
+        self.graph.reset()
+
+        InstagramService.get_media_details("m2", "token", ["timestamp"])
+
+        self.assertEqual(self.graph.requests, 0)
+
+
+@override_settings(
+    INSTAGRAM_CACHE_ENABLED=False,
+    INSTAGRAM_COALESCE_REQUESTS=False,
+    INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN=1,
+    INSTAGRAM_RETRY_ATTEMPTS=0,
+)
+class BackfillTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph = self.start_graph()
+        # Windows are fetched on the test's thread, inside its transaction
+        patch = mock.patch.object(insights_backfill.connections, "close_all")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_start(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job, started = insights_backfill.start(self.account, 90)
+
+        self.assertTrue(started)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(job.windows), 3)
+        self.assertEqual(job.windows[0][0], int(job.since.timestamp()))
+        self.assertEqual(job.windows[-1][1], int(job.until.timestamp()))
+
+        again, started = insights_backfill.start(self.account, 90)
+
+        self.assertFalse(started)
+        self.assertEqual(again.pk, job.pk)
+
+    def test_resume_failed_job_up_to_now(self):
+        until = timezone.now() - timedelta(days=40)
+        since = until - timedelta(days=60)
+        failed = BackfillJob.objects.create(
+            account=self.account,
+            status=BackfillJob.FAILED,
+            since=since,
+            until=until,
+            windows=insights_planner.windows(
+                int(since.timestamp()), int(until.timestamp())
+            ),
+            done_windows=[0],
+        )
+
+        job, started = insights_backfill.start(self.account, 90)
+
+        self.assertTrue(started)
+        self.assertEqual(job.pk, failed.pk)
+        self.assertEqual(job.status, BackfillJob.PENDING)
+        self.assertEqual(job.done_windows, [0])
+        self.assertEqual(len(job.windows), 4)
+        self.assertEqual(job.windows[1][1], int(until.timestamp()))
+        self.assertEqual(job.windows[-1][1], int(job.until.timestamp()))
+        self.assertGreater(job.until, until)
+
+    def test_run(self):
+        job, _ = insights_backfill.start(self.account, 45)
+
+        job = insights_backfill.run(job.pk)
+
+        self.assertEqual(job.status, BackfillJob.DONE)
+        self.assertEqual(sorted(job.done_windows), [0, 1])
+        self.assertEqual(self.graph.requests, 2)
+        self.assertEqual(
+            InsightPoint.objects.filter(
+                account=self.account, metric="follower_count"
+            ).count(),
+            45,
+        )
+
+    def test_run_retries_failed_windows(self):
+        job, _ = insights_backfill.start(self.account, 45)
+        self.graph.failures = 1
+
+        job = insights_backfill.run(job.pk)
+
+        self.assertEqual(job.status, BackfillJob.FAILED)
+        self.assertEqual(job.done_windows, [1])
+
+        self.graph.reset()
+        job = insights_backfill.run(job.pk)
+
+        self.assertEqual(job.status, BackfillJob.DONE)
+        self.assertEqual(self.graph.requests, 1)
+
+
+@override_settings(
+    INSTAGRAM_CACHE_ENABLED=False, INSTAGRAM_COALESCE_REQUESTS=False
+)
+class DashboardTests(ThreadedAccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph = self.start_graph()
+
+    def test_media_listed_once(self):
+        response = self.client.get(
+            "/api/instagram/dashboard/", headers=self.auth
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(list(result["panels"]), list(dashboard.PANELS))
+        self.assertEqual(result["errors"], [])
+        media_lists = [
+            path for path in self.graph.paths if "/fake/media" in path
+        ]
+        self.assertEqual(len(media_lists), 1)
+
+    def stream_in_order(self, **headers) -> str:
+        """
+        Stream two panels, the second one requested built first, and
+        return the streamed content
+        """
+        demographics_built = threading.Event()
+
+        def account_insights(account, params):
+            demographics_built.wait(5)
+            return {"follower_count": 1}, 0
+
+        def demographics(account, params):
+            demographics_built.set()
+            return {"demographics": {}}, 0
+
+        with mock.patch.dict(
+            dashboard.PANELS,
+            {
+                "account_insights": account_insights,
+                "demographics": demographics,
+            },
+        ):
+            response = self.client.get(
+                "/api/instagram/dashboard/stream/"
+                "?panels=account_insights,demographics",
+                headers={**self.auth, **headers},
+            )
+            self.assertTrue(response.streaming)
+            return b"".join(response.streaming_content).decode()
+
+    def test_stream_events(self):
+        content = self.stream_in_order()
+
+        messages = [
+            message.split("\n") for message in content.split("\n\n") if message
+        ]
+        self.assertEqual(
+            [event for event, data in messages],
+            ["event: panel", "event: panel", "event: done"],
+        )
+        events = [
+            json.loads(data.removeprefix("data: ")) for _, data in messages
+        ]
+        self.assertEqual(
+            [event["name"] for event in events[:2]],
+            ["demographics", "account_insights"],
+        )
+        self.assertEqual(events[1]["data"], {"follower_count": 1})
+        self.assertEqual(events[2]["errors"], [])
+
+    def test_stream_ndjson(self):
+        content = self.stream_in_order(Accept="application/x-ndjson")
+
+        events = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(
+            [(event["event"], event.get("name")) for event in events],
+            [
+                ("panel", "demographics"),
+                ("panel", "account_insights"),
+                ("done", None),
+            ],
+        )
+
+    def test_averages_from_the_catalog(self):
+        response = self.client.get(
+            "/api/instagram/dashboard/?panels=account_insights",
+            headers=self.auth,
+        )
+
+        insights = response.json()["panels"]["account_insights"]["data"]
+        recent = InstagramMedia.objects.order_by("-timestamp")[:10]
+        self.assertEqual(
+            insights["avg_likes"],
+            sum(media.like_count for media in recent) / 10,
+        )
+        self.assertEqual(
+            insights["avg_comments"],
+            sum(media.comments for media in recent) / 10,
+        )
+
+
+@override_settings(
+    INSTAGRAM_CACHE_ENABLED=False, INSTAGRAM_COALESCE_REQUESTS=False
+)
+class FieldsTests(AccountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph = self.start_graph()
+
+    def get(self, path: str):
+        return self.client.get(f"/api/instagram/{path}", headers=self.auth)
+
+    def aget(self, path: str):
+        return async_to_sync(self.async_client.get)(
+            f"/api/instagram/async/{path}", headers=self.auth
+        )
+
+    def test_account_insights_subset(self):
+        for get in (self.get, self.aget):
+            self.graph.reset()
+
+            response = get("insights/account/?fields=avg_likes,follower_count")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                set(response.json()), {"follower_count", "avg_likes"}
+            )
+            # Account totals and the media list, no media insights
+            self.assertEqual(len(self.graph.paths), 2)
+            self.assertNotIn("POST /", self.graph.paths)
+
+    def test_demographics_subset(self):
+        for get in (self.get, self.aget):
+            self.graph.reset()
+
+            response = get("insights/demographics/?fields=countries")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.json()), ["countries"])
+            self.assertEqual(len(response.json()["countries"]), 5)
+            (path,) = self.graph.paths
+            self.assertIn("breakdown=country&", path)
+
+    def test_unknown_fields(self):
+        for path, allowed in [
+            (
+                "insights/account/?fields=avg_likes,unknown",
+                InstagramService.ACCOUNT_INSIGHT_FIELDS,
+            ),
+            (
+                "insights/demographics/?fields=unknown",
+                InstagramService.DEMOGRAPHIC_FIELDS,
+            ),
+        ]:
+            for get in (self.get, self.aget):
+                response = get(path)
+
+                self.assertEqual(response.status_code, 400, path)
+                self.assertEqual(response.json()["fields"], allowed)
+        self.assertEqual(self.graph.requests, 0)
+
+
+class AccountLookupTests(AccountTestCase):
+    def test_views_need_a_connected_account(self):
+        Account.objects.filter(pk=self.account.pk).update(access_token="")
+
+        for path in [
+            "/api/instagram/media/",
+            "/api/instagram/media/m1/",
+            "/api/instagram/insights/backfill/",
+        ]:
+            response = self.client.get(path, headers=self.auth)
+
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(
+                response.json(), {"error": "Instagram account not connected"}
+            )
+
+    def test_async_views_need_an_account(self):
+        self.account.delete()
+
+        response = async_to_sync(self.async_client.get)(
+            "/api/instagram/async/insights/account/", headers=self.auth
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+
+class MediaRefreshTests(AccountTestCase):
+    def refresh(self, insights_by_media):
+        with mock.patch.object(
+            InstagramService,
+            "get_media_insights_batch",
+            return_value=insights_by_media,
+        ):
+            return media_refresh.refresh_due(self.account)
+
+    def test_failed_refresh_backs_off(self):
+        self.store_media(2)
+        minimum = timedelta(seconds=settings.INSTAGRAM_REFRESH_MIN_INTERVAL)
+
+        started = timezone.now()
+        refreshed = self.refresh(
+            {"m0": {"error": "Media not found"}, "m1": {"likes": {"value": 5}}}
+        )
+
+        self.assertEqual(refreshed, 1)
+        failed = InstagramMedia.objects.get(media_id="m0")
+        self.assertEqual(failed.refresh_failures, 1)
+        self.assertGreaterEqual(failed.next_refresh_at, started + minimum)
+        self.assertEqual(
+            media_refresh.due_media(self.account, timezone.now()), []
+        )
+
+        InstagramMedia.objects.update(next_refresh_at=timezone.now())
+        started = timezone.now()
+        self.refresh({"m0": {"error": "Media not found"}})
+
+        failed.refresh_from_db()
+        self.assertEqual(failed.refresh_failures, 2)
+        self.assertGreaterEqual(failed.next_refresh_at, started + 2 * minimum)
+
+    def test_refresh_resets_failures(self):
+        self.store_media(1)
+        InstagramMedia.objects.update(refresh_failures=3)
+
+        self.refresh({"m0": {"likes": {"value": 5}}})
+
+        media = InstagramMedia.objects.get(media_id="m0")
+        self.assertEqual(media.refresh_failures, 0)
+        self.assertEqual(media.likes, 5)
+
+    def test_backoff_is_bounded(self):
+        media = InstagramMedia(refresh_failures=1000)
+        now = timezone.now()
+
+        media_refresh.back_off(media, now)
+
+        self.assertEqual(
+            media.refresh_failures, media_refresh.MAX_BACKOFF_STEPS
+        )
+        self.assertEqual(
+            media.next_refresh_at,
+            now + timedelta(seconds=settings.INSTAGRAM_REFRESH_MAX_INTERVAL),
+        )
+
+
+class SyncCommandTests(SimpleTestCase):
+    def test_results_as_accounts_complete(self):
+        slow = threading.Event()
+
+        def sync_account(account_pk):
+            if account_pk == 1:
+                slow.wait(5)
+            return {"account": account_pk}
+
+        with mock.patch.object(
+            sync_instagram, "sync_account", side_effect=sync_account
+        ):
+            results = sync_instagram.iter_chunk([1, 2], threads=2)
+            self.assertEqual(next(results), {"account": 2})
+            slow.set()
+            self.assertEqual(list(results), [{"account": 1}])
+
+    def test_stop_partway(self):
+        stop_event = threading.Event()
+
+        with mock.patch.object(
+            sync_instagram,
+            "sync_account",
+            side_effect=lambda account_pk: {"account": account_pk},
+        ) as sync_account:
+            for result in sync_instagram.iter_chunk(
+                range(100), threads=1, stop_event=stop_event
+            ):
+                stop_event.set()
+
+        self.assertLess(sync_account.call_count, 100)
+
+
+class AsyncViewTests(SimpleTestCase):
+    def test_base_view_is_abstract(self):
+        with self.assertRaises(TypeError):
+            AsyncInsightsView()
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_handshakes(self):
+        per_call, pooled = benchmarks.handshakes(loads=2, handshake_ms=0)
+
+        self.assertEqual(per_call["requests/load"], pooled["requests/load"])
+        self.assertEqual(
+            per_call["connections/load"], per_call["requests/load"]
+        )
+        self.assertLessEqual(pooled["connections/load"], 1)
+
+    def test_batching(self):
+        per_media, batch = benchmarks.batching(media=60, latency_ms=0)
+
+        self.assertEqual(per_media["upstream calls"], 60)
+        self.assertEqual(batch["upstream calls"], 2)
+
+    def test_asgi(self):
+        wsgi, asgi = benchmarks.asgi(calls=4, concurrency=2, latency_ms=0)
+
+        self.assertEqual(wsgi["ok"], 4)
+        self.assertEqual(asgi["ok"], 4)
+
+    def test_refresh(self):
+        uniform, adaptive = benchmarks.refresh(posts=200, days=1)
+
+        self.assertEqual(uniform["refreshes"], 200 * 97)
+        self.assertLess(adaptive["batch requests"], uniform["batch requests"])
+
+    def test_bucketing(self):
+        (row,) = benchmarks.calendar_buckets(sizes="500")
+
+        self.assertEqual(row["posts"], 500)
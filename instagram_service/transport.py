@@ -0,0 +1,431 @@
+"""
+Pooled HTTP transport shared by every Instagram Graph API call
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional
+from http.cookiejar import DefaultCookiePolicy
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from django.conf import settings
+from .coalescing import async_single_flight, coalesce_key, single_flight
+from .concurrency import token_key, token_slot
+from .rate_limits import rate_limiter
+from .resilience import (
+    FALLBACK_HEADER,
+    CircuitOpenError,
+    backoff_delay,
+    breakers,
+    endpoint_family,
+    fallback_key,
+    is_transient_response,
+    load_fallback,
+    metrics,
+    should_retry,
+    store_fallback,
+)
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+# AsyncClient and asyncio primitives are bound to the loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+_async_token_slots = weakref.WeakKeyDictionary()
+_async_pool_slots = weakref.WeakKeyDictionary()
+
+
+def _build_session() -> requests.Session:
+    """
+    Build a keep-alive session backed by a bounded connection pool
+    """
+    session = requests.Session()
+
+    # Graph API calls are authenticated by access token only, so never
+    # let cookies from one account's response leak into another's call
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    adapter = HTTPAdapter(
+        pool_connections=settings.INSTAGRAM_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.INSTAGRAM_HTTP_POOL_MAXSIZE,
+        pool_block=settings.INSTAGRAM_HTTP_POOL_BLOCK,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Return the session for the current process
+
+    The session is created lazily and rebuilt after a fork, so pooled
+    sockets are never shared between gunicorn workers.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+
+    return _session
+
+
+def _token_from(kwargs) -> Optional[str]:
+    """Access token sent in the params or form data of a call"""
+    payload = kwargs.get("params") or kwargs.get("data")
+    return payload.get("access_token") if isinstance(payload, dict) else None
+
+
+def _call_cost(kwargs) -> int:
+    """Quota units used by a call, every batched request counts"""
+    data = kwargs.get("data")
+    if isinstance(data, dict) and "batch" in data:
+        return max(1, len(json.loads(data["batch"])))
+    return 1
+
+
+def _fallback_key(method: str, url: str, family: str, kwargs):
+    """Fallback cache key, None for calls that must not be cached"""
+    if method.upper() != "GET" or family == "oauth":
+        return None
+    return fallback_key(method, url, kwargs.get("params"))
+
+
+def _refuse(family: str, key: Optional[str]):
+    """
+    Answer a call whose circuit is open
+
+    Returns:
+        The last good response of the call, as stored by store_fallback
+
+    Raises:
+        CircuitOpenError if there is none
+    """
+    frozen = load_fallback(key) if key else None
+    if frozen:
+        metrics.incr(family, "fallbacks")
+        return frozen
+
+    metrics.incr(family, "fast_failures")
+    raise CircuitOpenError(
+        f"Instagram {family} endpoints are unavailable, retry later"
+    )
+
+
+def _thaw(frozen, url: str, fallback: bool = True) -> requests.Response:
+    headers = {"Content-Type": frozen["content_type"]}
+    if fallback:
+        headers[FALLBACK_HEADER] = "stale"
+
+    response = requests.Response()
+    response.status_code = frozen["status_code"]
+    response._content = frozen["content"]
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+
+def _async_thaw(
+    frozen, method: str, url: str, fallback: bool = True
+) -> httpx.Response:
+    headers = {"Content-Type": frozen["content_type"]}
+    if fallback:
+        headers[FALLBACK_HEADER] = "stale"
+
+    return httpx.Response(
+        frozen["status_code"],
+        headers=headers,
+        content=frozen["content"],
+        request=httpx.Request(method, url),
+    )
+
+
+def _coalesced(method: str, url: str, kwargs) -> bool:
+    """Whether identical concurrent calls may share one upstream call"""
+    return (
+        settings.INSTAGRAM_COALESCE_REQUESTS
+        and method.upper() == "GET"
+        and endpoint_family(url) != "oauth"
+        and _token_from(kwargs) is not None
+    )
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the pooled session
+
+    Identical token-authenticated GETs sent concurrently, from this or
+    another worker, share a single upstream call.
+    """
+    if not _coalesced(method, url, kwargs):
+        return _request(method, url, **kwargs)
+
+    return single_flight.do(
+        coalesce_key(url, kwargs.get("params")),
+        lambda: _request(method, url, **kwargs),
+        lambda frozen: _thaw(frozen, url, fallback=False),
+    )
+
+
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a call with retries and circuit breaking
+
+    Transient failures of idempotent calls are retried with backoff and
+    reported to the circuit breaker of the endpoint family. While the
+    circuit is open the last good response is returned instead, if any.
+    """
+    family = endpoint_family(url, kwargs.get("data"))
+    breaker = breakers[family]
+    key = _fallback_key(method, url, family, kwargs)
+
+    if not breaker.allow():
+        return _thaw(_refuse(family, key), url)
+
+    attempt = 0
+    while True:
+        try:
+            response = _send(method, url, **kwargs)
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ):
+            if should_retry(method, attempt):
+                metrics.incr(family, "retries")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            metrics.incr(family, "failures")
+            breaker.record_failure()
+            raise
+
+        if is_transient_response(response.status_code, response.content):
+            if should_retry(method, attempt):
+                metrics.incr(family, "retries")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            metrics.incr(family, "failures")
+            breaker.record_failure()
+            return response
+
+        breaker.record_success()
+        if key and response.status_code == 200:
+            store_fallback(
+                key, response.status_code, response.headers, response.content
+            )
+
+        return response
+
+
+def _send(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a single attempt of a call
+
+    Calls carrying an access token in their params or form data are paced
+    by the rate limiter and wait for one of that token's in-flight slots.
+    """
+    access_token = _token_from(kwargs)
+
+    if not access_token:
+        return get_session().request(method, url, **kwargs)
+
+    wait = rate_limiter.reserve(access_token, _call_cost(kwargs))
+    if wait:
+        time.sleep(wait)
+
+    with token_slot(access_token):
+        response = get_session().request(method, url, **kwargs)
+
+    rate_limiter.observe(access_token, response.headers)
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Send a GET request through the pooled session"""
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Send a POST request through the pooled session"""
+    return request("POST", url, **kwargs)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Return the async client for the running event loop
+
+    HTTP/2 multiplexing is used when INSTAGRAM_HTTP2 is enabled, which
+    needs the httpx[http2] extra.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+
+    if client is None:
+        limits = httpx.Limits(
+            max_connections=settings.INSTAGRAM_HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=settings.INSTAGRAM_HTTP_POOL_MAXSIZE,
+        )
+        client = httpx.AsyncClient(
+            limits=limits, http2=settings.INSTAGRAM_HTTP2
+        )
+        _async_clients[loop] = client
+
+    return client
+
+
+def _async_pool_slot() -> asyncio.Semaphore:
+    """
+    One of the connections of the async client's pool
+
+    Calls beyond the pool size wait here rather than in the client's own
+    queue, which rescans every queued call whenever a connection frees up.
+    """
+    loop = asyncio.get_running_loop()
+    slot = _async_pool_slots.get(loop)
+
+    if slot is None:
+        slot = asyncio.Semaphore(settings.INSTAGRAM_HTTP_POOL_MAXSIZE)
+        _async_pool_slots[loop] = slot
+
+    return slot
+
+
+@asynccontextmanager
+async def _async_token_slot(access_token: str):
+    """Async counterpart of token_slot, per loop"""
+    loop = asyncio.get_running_loop()
+    slots = _async_token_slots.setdefault(loop, {})
+    key = token_key(access_token)
+
+    entry = slots.get(key)
+    if entry is None:
+        entry = [
+            asyncio.Semaphore(settings.INSTAGRAM_MAX_IN_FLIGHT_PER_TOKEN),
+            0,
+        ]
+        slots[key] = entry
+
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del slots[key]
+
+
+async def async_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request through the async client of the running loop
+
+    Coalesced like request().
+    """
+    if not _coalesced(method, url, kwargs):
+        return await _async_request(method, url, **kwargs)
+
+    return await async_single_flight.do(
+        coalesce_key(url, kwargs.get("params")),
+        lambda: _async_request(method, url, **kwargs),
+        lambda frozen: _async_thaw(frozen, method, url, fallback=False),
+    )
+
+
+async def _async_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Async counterpart of _request()
+
+    Same retries, circuit breakers and fallback.
+    """
+    family = endpoint_family(url, kwargs.get("data"))
+    breaker = breakers[family]
+    key = _fallback_key(method, url, family, kwargs)
+
+    if not breaker.allow():
+        return _async_thaw(_refuse(family, key), method, url)
+
+    attempt = 0
+    while True:
+        try:
+            response = await _async_send(method, url, **kwargs)
+        except httpx.TransportError:
+            if should_retry(method, attempt):
+                metrics.incr(family, "retries")
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            metrics.incr(family, "failures")
+            breaker.record_failure()
+            raise
+
+        if is_transient_response(response.status_code, response.content):
+            if should_retry(method, attempt):
+                metrics.incr(family, "retries")
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            metrics.incr(family, "failures")
+            breaker.record_failure()
+            return response
+
+        breaker.record_success()
+        if key and response.status_code == 200:
+            store_fallback(
+                key, response.status_code, response.headers, response.content
+            )
+
+        return response
+
+
+async def _async_send(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a single attempt of a call through the async client
+
+    Same pacing as _send(), with the in-flight limit enforced per event
+    loop.
+    """
+    access_token = _token_from(kwargs)
+    client = get_async_client()
+
+    if not access_token:
+        async with _async_pool_slot():
+            return await client.request(method, url, **kwargs)
+
+    wait = rate_limiter.reserve(access_token, _call_cost(kwargs))
+    if wait:
+        await asyncio.sleep(wait)
+
+    async with _async_token_slot(access_token), _async_pool_slot():
+        response = await client.request(method, url, **kwargs)
+
+    rate_limiter.observe(access_token, response.headers)
+    return response
+
+
+async def async_get(url: str, **kwargs) -> httpx.Response:
+    """Send a GET request through the async client"""
+    return await async_request("GET", url, **kwargs)
+
+
+async def async_post(url: str, **kwargs) -> httpx.Response:
+    """Send a POST request through the async client"""
+    return await async_request("POST", url, **kwargs)
@@ -3,17 +3,38 @@ API endpoints
 """
 
 from django.urls import path
-from .views import InstagramMediaView, InstagramMediaDetailView
+from .views import (
+    InstagramMediaView,
+    InstagramMediaExportView,
+    InstagramMediaDetailView,
+)
 from .views import (
     InstagramAccountInsightsView,
     InstagramFollowersGrowthView,
     InstagramPostEngagementsView,
     InstagramCurrentMonthLikesView,
     InstagramDemographicsView,
+    InstagramAudienceDemographicsView,
+    InstagramDashboardView,
+    InstagramDashboardStreamView,
+    InstagramInsightsBackfillView,
+    InstagramUpstreamStatusView,
+)
+from .async_views import (
+    AsyncInstagramAccountInsightsView,
+    AsyncInstagramFollowersGrowthView,
+    AsyncInstagramPostEngagementsView,
+    AsyncInstagramCurrentMonthLikesView,
+    AsyncInstagramDemographicsView,
 )
 
 urlpatterns = [
     path("media/", InstagramMediaView.as_view(), name="instagram-media"),
+    path(
+        "media/export/",
+        InstagramMediaExportView.as_view(),
+        name="instagram-media-export",
+    ),
     path(
         "media/<str:media_id>/",
         InstagramMediaDetailView.as_view(),
@@ -44,4 +65,55 @@ urlpatterns = [
         InstagramDemographicsView.as_view(),
         name="instagram-demographics",
     ),
+    path(
+        "insights/audience-demographics/",
+        InstagramAudienceDemographicsView.as_view(),
+        name="instagram-audience-demographics",
+    ),
+    path(
+        "dashboard/",
+        InstagramDashboardView.as_view(),
+        name="instagram-dashboard",
+    ),
+    path(
+        "dashboard/stream/",
+        InstagramDashboardStreamView.as_view(),
+        name="instagram-dashboard-stream",
+    ),
+    path(
+        "insights/backfill/",
+        InstagramInsightsBackfillView.as_view(),
+        name="instagram-insights-backfill",
+    ),
+    path(
+        "upstream/status/",
+        InstagramUpstreamStatusView.as_view(),
+        name="instagram-upstream-status",
+    ),
+    # Async variants for ASGI deployments
+    path(
+        "async/insights/account/",
+        AsyncInstagramAccountInsightsView.as_view(),
+        name="instagram-account-insights-async",
+    ),
+    path(
+        "async/insights/followers-growth/",
+        AsyncInstagramFollowersGrowthView.as_view(),
+        name="instagram-followers-growth-async",
+    ),
+    path(
+        "async/insights/post-engagements/",
+        AsyncInstagramPostEngagementsView.as_view(),
+        name="instagram-post-engagements-async",
+    ),
+    path(
+        "async/insights/current-month-likes/",
+        AsyncInstagramCurrentMonthLikesView.as_view(),
+        name="instagram-current-month-likes-async",
+    ),
+    path(
+        "async/insights/demographics/",
+        AsyncInstagramDemographicsView.as_view(),
+        name="instagram-demographics-async",
+    ),
 ]
@@ -0,0 +1,150 @@
+"""
+Request helpers shared by the sync and async Instagram views
+"""
+
+from rest_framework import status
+from rest_framework.response import Response
+from users.models import Account
+from .models import EngagementRollup
+
+# Graph API caps media pages at 100 items
+MAX_MEDIA_PAGE_SIZE = 100
+# Ten years of weeks
+MAX_ENGAGEMENT_PERIODS = 520
+
+
+def age_headers(age: float):
+    """Age header telling clients how old cached insights are"""
+    return {"Age": str(int(age))}
+
+
+def list_param(request, name: str, allowed: list):
+    """
+    Comma-separated query param, all allowed values by default
+
+    Returns:
+        Requested values in the order of allowed, None if one is unknown
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return list(allowed)
+
+    requested = {item.strip() for item in value.split(",") if item.strip()}
+    if not requested or requested - set(allowed):
+        return None
+    return [item for item in allowed if item in requested]
+
+
+def fields_param(request, allowed: list):
+    """
+    Sparse fieldset requested with fields=
+
+    Returns:
+        Tuple of the fields, None for all of them, and an error response
+        if some field is unknown
+    """
+    fields = list_param(request, "fields", allowed)
+    if fields is None:
+        return None, Response(
+            {"error": "Invalid fields", "fields": allowed},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(fields) == len(allowed):
+        return None, None
+    return fields, None
+
+
+def int_param(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+def engagement_periods(request, period: str) -> int:
+    """Number of months or weeks of post engagements requested"""
+    count = int_param(request, f"{period}s", 6)
+    return min(max(count, 1), MAX_ENGAGEMENT_PERIODS)
+
+
+def post_engagements_params(request):
+    """
+    Period, month or week, and number of periods of post engagements
+
+    Returns:
+        Tuple of the period, the count and an error response, the first
+        two None on error
+    """
+    period = request.query_params.get("period", EngagementRollup.MONTH)
+    if period not in (EngagementRollup.MONTH, EngagementRollup.WEEK):
+        return (
+            None,
+            None,
+            Response(
+                {"error": "period must be month or week"},
+                status=status.HTTP_400_BAD_REQUEST,
+            ),
+        )
+    return period, engagement_periods(request, period), None
+
+
+def account_filter(request):
+    """Account filter for the provider the user authenticated with"""
+
+    auth_info = getattr(request, "auth", None)
+    provider = None
+
+    if isinstance(auth_info, dict) and "provider" in auth_info:
+        provider = auth_info.get("provider")
+
+    if provider == "instagram":
+        return {"provider": "instagram"}
+    if provider == "facebook" or provider == "instagram_business":
+        return {"provider__in": ["instagram_business", "facebook"]}
+
+    # If no specific provider in token, try instagram first, then facebook
+    return {"provider__in": ["instagram", "instagram_business", "facebook"]}
+
+
+def _accounts(request):
+    return Account.objects.filter(
+        user=request.user, **account_filter(request)
+    ).order_by("-updated_at")
+
+
+def _checked(account):
+    """The account and an error response if it can't call Instagram"""
+    if not account:
+        return None, Response(
+            {"error": "No Instagram account found for this user"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    if account.provider not in ("instagram", "instagram_business"):
+        return None, Response(
+            {"error": "Instagram business account not available"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if not account.provider_account_id or not account.access_token:
+        return None, Response(
+            {"error": "Instagram account not connected"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    return account, None
+
+
+def get_instagram_account(request):
+    """
+    Get the connected Instagram account of the user
+
+    Returns:
+        Tuple of the account and an error response, one of them None
+    """
+    return _checked(_accounts(request).first())
+
+
+async def aget_instagram_account(request):
+    """Async counterpart of get_instagram_account"""
+    return _checked(await _accounts(request).afirst())
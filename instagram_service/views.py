@@ -3,12 +3,35 @@ API for user media
 """
 
 import logging
+from urllib.parse import urlencode
+from django.conf import settings
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from users.models import Account
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from . import (
+    dashboard,
+    insights_backfill,
+    insights_store,
+    media_catalog,
+    media_export,
+    streaming,
+)
+from .cache import insights_cache
 from .instagram_service import InstagramService
+from .models import EngagementRollup
+from .rate_limits import rate_limiter
+from .resilience import breaker_states, metrics
+from .utils import (
+    MAX_MEDIA_PAGE_SIZE,
+    age_headers,
+    engagement_periods,
+    fields_param,
+    get_instagram_account,
+    int_param,
+    list_param,
+    post_engagements_params,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,105 +44,125 @@ class InstagramMediaView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        """Get user from the request"""
-
-        user = request.user
-
-        # Attempt to get provider info from the authentication
-        auth_info = getattr(request, "auth", None)
-        provider = None
-
-        if isinstance(auth_info, dict) and "provider" in auth_info:
-            provider = auth_info.get("provider")
-
-        # Determine which provider to use based on available info
-        if provider == "instagram":
-            account_filter = {"provider": "instagram"}
-        elif provider == "facebook" or provider == "instagram_business":
-            account_filter = {
-                "provider__in": ["instagram_business", "facebook"]
-            }
-        else:
-            # If no specific provider in token,
-            # try instagram first, then facebook
-            account_filter = {
-                "provider__in": ["instagram", "instagram_business", "facebook"]
-            }
-
-        # Get the appropriate account for the user
-        account = (
-            Account.objects.filter(user=user, **account_filter)
-            .order_by("-updated_at")
-            .first()
-        )
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
 
-        if not account:
-            return Response(
-                {"error": "No Instagram account found for this user"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
+        # Get limit from query params, default to 25
+        limit = request.query_params.get("limit", 25)
+        try:
+            limit = min(max(int(limit), 1), MAX_MEDIA_PAGE_SIZE)
+        except ValueError:
+            limit = 25
 
-        # Determine the correct ID to use
-        if account.provider == "instagram":
-            ig_id = account.provider_account_id
-        elif account.provider == "instagram_business":
-            ig_id = account.provider_account_id
-        else:  # Facebook account
-            # For Facebook, we don't have direct
-            # Instagram ID in our current implementation
-            # This would need to be enhanced to properly
-            # fetch linked Instagram accounts
-            return Response(
-                {"error": "Instagram business account details not available"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+        # Cursor of the page to fetch, from paging.cursors.after
+        after = request.query_params.get("after")
 
-        # # Get limit from query params, default to 25
-        # limit = request.query_params.get("limit", 25)
-        # try:
-        #     limit = int(limit)
-        # except ValueError:
-        #     limit = 25
+        fields, error_response = fields_param(
+            request, InstagramService.MEDIA_FIELDS
+        )
+        if error_response:
+            return error_response
 
-        # Get the user's media from Instagram
-        media_data = InstagramService.get_user_media(
-            ig_id=ig_id, access_token=account.access_token
+        # Get the user's media from the catalog, synced from Instagram
+        media_data, next_after = media_catalog.list_media(
+            account, limit, after, fields
         )
 
         # Check if there was an error
         if "error" in media_data:
             return Response(media_data, status=status.HTTP_400_BAD_REQUEST)
 
+        if next_after:
+            query = {"limit": limit, "after": next_after}
+            if fields:
+                query["fields"] = ",".join(fields)
+            media_data["paging"]["next"] = request.build_absolute_uri(
+                "?" + urlencode(query)
+            )
+
         return Response(media_data)
 
 
-class InstagramMediaDetailView(APIView):
+class InstagramMediaExportView(APIView):
     """
-    API view to fetch details for a specific Instagram media
+    View streaming every catalogued media item of the user's account with
+    its insights, as NDJSON (format=ndjson) or CSV (format=csv), see
+    media_export
     """
 
     permission_classes = [IsAuthenticated]
+    renderer_classes = [streaming.NDJSONRenderer, streaming.CSVRenderer]
 
-    def get(self, request, media_id):
-        # Get user and account similar to InstagramMediaView
-        user = request.user
-        account = (
-            Account.objects.filter(
-                user=user, provider__in=["instagram", "instagram_business"]
-            )
-            .order_by("-updated_at")
-            .first()
+    def get(self, request):
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
+
+        fields, error_response = fields_param(
+            request, media_export.EXPORT_FIELDS
         )
+        if error_response:
+            return error_response
 
-        if not account:
+        # Resumes after the id of the last record received
+        after = request.query_params.get("after")
+        after_pk = media_export.cursor(account, after)
+        if after and after_pk is None:
             return Response(
-                {"error": "No Instagram account found for this user"},
-                status=status.HTTP_404_NOT_FOUND,
+                {"error": "Invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        error = media_catalog.catalog_error(account)
+        if error:
+            logger.error("Error syncing media for export: %s", error)
+            return Response(
+                {"error": "Failed to fetch media"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+        renderer = request.accepted_renderer
+        compress = request.query_params.get("gzip") in ("1", "true")
+        filename = f"instagram-media-{account.provider_account_id}"
+        filename += f".{renderer.format}"
+        content_type = f"{renderer.media_type}; charset={renderer.charset}"
+        if compress:
+            filename += ".gz"
+            content_type = "application/gzip"
+
+        response = streaming.stream_chunks(
+            request,
+            media_export.export(
+                account, renderer.format, fields, after_pk, compress
+            ),
+            content_type,
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class InstagramMediaDetailView(APIView):
+    """
+    API view to fetch details for a specific Instagram media
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, media_id):
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
+
+        fields, error_response = fields_param(
+            request, InstagramService.MEDIA_DETAIL_FIELDS
+        )
+        if error_response:
+            return error_response
+
         # Get details for the specific media
         media_details = InstagramService.get_media_details(
-            media_id=media_id, access_token=account.access_token
+            media_id=media_id, access_token=account.access_token, fields=fields
         )
 
         if "error" in media_details:
@@ -137,67 +180,20 @@ class InstagramAccountInsightsView(APIView):
 
     def get(self, request):
         try:
-            user = request.user
-
-            # Attempt to get provider info from the authentication
-            auth_info = getattr(request, "auth", None)
-            provider = None
-
-            if isinstance(auth_info, dict) and "provider" in auth_info:
-                provider = auth_info.get("provider")
-
-            # Determine which provider to use based on available info
-            if provider == "instagram":
-                account_filter = {"provider": "instagram"}
-            elif provider == "facebook" or provider == "instagram_business":
-                account_filter = {
-                    "provider__in": ["instagram_business", "facebook"]
-                }
-            else:
-                # If no specific provider in token,
-                # try instagram first, then facebook
-                account_filter = {
-                    "provider__in": [
-                        "instagram",
-                        "instagram_business",
-                        "facebook",
-                    ]
-                }
-
-            # Get the appropriate account for the user
-            account = (
-                Account.objects.filter(user=user, **account_filter)
-                .order_by("-updated_at")
-                .first()
-            )
-
-            if not account:
-                return Response(
-                    {"error": "No Instagram account found for this user"},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-            # Determine the correct ID to use
-            if account.provider == "instagram":
-                instagram_id = account.provider_account_id
-            elif account.provider == "instagram_business":
-                instagram_id = account.provider_account_id
-            else:
-                return Response(
-                    {"error": "Instagram business account not available"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
 
-            access_token = account.access_token
+            fields, error_response = fields_param(
+                request, InstagramService.ACCOUNT_INSIGHT_FIELDS
+            )
+            if error_response:
+                return error_response
 
-            if not instagram_id or not access_token:
-                return Response(
-                    {"error": "Instagram account not connected"},
-                    status=status.HTTP_400_BAD_REQUEST,
+            insights, age = (
+                InstagramService.get_account_basic_insights.with_age(
+                    account.provider_account_id, account.access_token, fields
                 )
-
-            insights = InstagramService.get_account_basic_insights(
-                instagram_id, access_token
             )
 
             if "error" in insights:
@@ -210,7 +206,9 @@ class InstagramAccountInsightsView(APIView):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            return Response(insights, status=status.HTTP_200_OK)
+            return Response(
+                insights, status=status.HTTP_200_OK, headers=age_headers(age)
+            )
 
         except Exception as e:
             logger.exception(
@@ -231,73 +229,14 @@ class InstagramFollowersGrowthView(APIView):
 
     def get(self, request):
         try:
-            user = request.user
-
-            # Attempt to get provider info from the authentication
-            auth_info = getattr(request, "auth", None)
-            provider = None
-
-            if isinstance(auth_info, dict) and "provider" in auth_info:
-                provider = auth_info.get("provider")
-
-            # Determine which provider to use based on available info
-            if provider == "instagram":
-                account_filter = {"provider": "instagram"}
-            elif provider == "facebook" or provider == "instagram_business":
-                account_filter = {
-                    "provider__in": ["instagram_business", "facebook"]
-                }
-            else:
-                # If no specific provider in token, try instagram first,
-                #  then facebook
-                account_filter = {
-                    "provider__in": [
-                        "instagram",
-                        "instagram_business",
-                        "facebook",
-                    ]
-                }
-
-            # Get the appropriate account for the user
-            account = (
-                Account.objects.filter(user=user, **account_filter)
-                .order_by("-updated_at")
-                .first()
-            )
-
-            if not account:
-                return Response(
-                    {"error": "No Instagram account found for this user"},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-            # Determine the correct ID to use
-            if account.provider == "instagram":
-                instagram_id = account.provider_account_id
-            elif account.provider == "instagram_business":
-                instagram_id = account.provider_account_id
-            else:
-                return Response(
-                    {"error": "Instagram business account not available"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            access_token = account.access_token
-            days = request.query_params.get("days", 30)
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
 
-            try:
-                days = int(days)
-            except ValueError:
-                days = 30
+            days = int_param(request, "days", 30)
 
-            if not instagram_id or not access_token:
-                return Response(
-                    {"error": "Instagram account not connected"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            growth_data = InstagramService.get_followers_growth(
-                instagram_id, access_token, days
+            growth_data, age = insights_store.get_followers_growth(
+                account, days
             )
 
             if "error" in growth_data:
@@ -309,7 +248,11 @@ class InstagramFollowersGrowthView(APIView):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            return Response(growth_data, status=status.HTTP_200_OK)
+            return Response(
+                growth_data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age),
+            )
 
         except Exception as e:
             logger.exception(
@@ -330,73 +273,16 @@ class InstagramPostEngagementsView(APIView):
 
     def get(self, request):
         try:
-            user = request.user
-
-            # Attempt to get provider info from the authentication
-            auth_info = getattr(request, "auth", None)
-            provider = None
-
-            if isinstance(auth_info, dict) and "provider" in auth_info:
-                provider = auth_info.get("provider")
-
-            # Determine which provider to use based on available info
-            if provider == "instagram":
-                account_filter = {"provider": "instagram"}
-            elif provider == "facebook" or provider == "instagram_business":
-                account_filter = {
-                    "provider__in": ["instagram_business", "facebook"]
-                }
-            else:
-                # If no specific provider in token, try instagram first,
-                #  then facebook
-                account_filter = {
-                    "provider__in": [
-                        "instagram",
-                        "instagram_business",
-                        "facebook",
-                    ]
-                }
-
-            # Get the appropriate account for the user
-            account = (
-                Account.objects.filter(user=user, **account_filter)
-                .order_by("-updated_at")
-                .first()
-            )
-
-            if not account:
-                return Response(
-                    {"error": "No Instagram account found for this user"},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-            # Determine the correct ID to use
-            if account.provider == "instagram":
-                instagram_id = account.provider_account_id
-            elif account.provider == "instagram_business":
-                instagram_id = account.provider_account_id
-            else:
-                return Response(
-                    {"error": "Instagram business account not available"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
 
-            access_token = account.access_token
-            months = request.query_params.get("months", 6)
+            period, count, error_response = post_engagements_params(request)
+            if error_response:
+                return error_response
 
-            try:
-                months = int(months)
-            except ValueError:
-                months = 6
-
-            if not instagram_id or not access_token:
-                return Response(
-                    {"error": "Instagram account not connected"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            engagement_data = InstagramService.get_post_engagements(
-                instagram_id, access_token, months
+            engagement_data, age = media_catalog.get_post_engagements(
+                account, count, period
             )
 
             if "error" in engagement_data:
@@ -406,7 +292,11 @@ class InstagramPostEngagementsView(APIView):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            return Response(engagement_data, status=status.HTTP_200_OK)
+            return Response(
+                engagement_data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age),
+            )
 
         except Exception as e:
             logger.exception(
@@ -427,68 +317,11 @@ class InstagramCurrentMonthLikesView(APIView):
 
     def get(self, request):
         try:
-            user = request.user
-
-            # Attempt to get provider info from the authentication
-            auth_info = getattr(request, "auth", None)
-            provider = None
-
-            if isinstance(auth_info, dict) and "provider" in auth_info:
-                provider = auth_info.get("provider")
-
-            # Determine which provider to use based on available info
-            if provider == "instagram":
-                account_filter = {"provider": "instagram"}
-            elif provider == "facebook" or provider == "instagram_business":
-                account_filter = {
-                    "provider__in": ["instagram_business", "facebook"]
-                }
-            else:
-                # If no specific provider in token, try instagram first,
-                #  then facebook
-                account_filter = {
-                    "provider__in": [
-                        "instagram",
-                        "instagram_business",
-                        "facebook",
-                    ]
-                }
-
-            # Get the appropriate account for the user
-            account = (
-                Account.objects.filter(user=user, **account_filter)
-                .order_by("-updated_at")
-                .first()
-            )
-
-            if not account:
-                return Response(
-                    {"error": "No Instagram account found for this user"},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-            # Determine the correct ID to use
-            if account.provider == "instagram":
-                instagram_id = account.provider_account_id
-            elif account.provider == "instagram_business":
-                instagram_id = account.provider_account_id
-            else:
-                return Response(
-                    {"error": "Instagram business account  not available"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            access_token = account.access_token
-
-            if not instagram_id or not access_token:
-                return Response(
-                    {"error": "Instagram account not connected"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
 
-            likes_data = InstagramService.get_current_month_likes(
-                instagram_id, access_token
-            )
+            likes_data, age = insights_store.get_current_month_likes(account)
 
             if "error" in likes_data:
                 logger.error(
@@ -499,7 +332,11 @@ class InstagramCurrentMonthLikesView(APIView):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            return Response(likes_data, status=status.HTTP_200_OK)
+            return Response(
+                likes_data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age),
+            )
 
         except Exception as e:
             logger.exception(
@@ -520,85 +357,272 @@ class InstagramDemographicsView(APIView):
 
     def get(self, request):
         try:
-            user = request.user
-
-            # Attempt to get provider info from the authentication
-            auth_info = getattr(request, "auth", None)
-            provider = None
-
-            if isinstance(auth_info, dict) and "provider" in auth_info:
-                provider = auth_info.get("provider")
-
-            # Determine which provider to use based on available info
-            if provider == "instagram":
-                account_filter = {"provider": "instagram"}
-            elif provider == "facebook" or provider == "instagram_business":
-                account_filter = {
-                    "provider__in": ["instagram_business", "facebook"]
-                }
-            else:
-                # If no specific provider in token, try instagram first,
-                # then facebook
-                account_filter = {
-                    "provider__in": [
-                        "instagram",
-                        "instagram_business",
-                        "facebook",
-                    ]
-                }
-
-            # Get the appropriate account for the user
-            account = (
-                Account.objects.filter(user=user, **account_filter)
-                .order_by("-updated_at")
-                .first()
-            )
-
-            if not account:
-                return Response(
-                    {"error": "No Instagram account found for this user"},
-                    status=status.HTTP_404_NOT_FOUND,
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
+
+            fields, error_response = fields_param(
+                request, InstagramService.DEMOGRAPHIC_FIELDS
+            )
+            if error_response:
+                return error_response
+
+            demographic_data, age = (
+                InstagramService.get_demographic_insights.with_age(
+                    account.provider_account_id, account.access_token, fields
                 )
+            )
 
-            # Determine the correct ID to use
-            if account.provider == "instagram":
-                instagram_id = account.provider_account_id
-            elif account.provider == "instagram_business":
-                instagram_id = account.provider_account_id
-            else:
+            if "error" in demographic_data:
+                logger.error(
+                    f"Err  Instagram demographics: {demographic_data['error']}"
+                )
                 return Response(
-                    {"error": "Instagram business account  not available"},
-                    status=status.HTTP_400_BAD_REQUEST,
+                    {"error": "Failed to fetch demographic insights"},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            access_token = account.access_token
+            return Response(
+                demographic_data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age),
+            )
+
+        except Exception as e:
+            logger.exception(
+                "Unexpected error in InstagramDemographicsView", str(e)
+            )
+            return Response(
+                {"error": "An unexpected error occurred"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
+class InstagramAudienceDemographicsView(APIView):
+    """
+    View to get demographics of several audiences, breakdowns and
+    timeframes in one request
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
 
-            if not instagram_id or not access_token:
+            breakdowns = list_param(
+                request, "breakdowns", InstagramService.DEMOGRAPHIC_BREAKDOWNS
+            )
+            timeframes = list_param(
+                request, "timeframes", InstagramService.DEMOGRAPHIC_TIMEFRAMES
+            )
+            audiences = list_param(
+                request, "audiences", list(InstagramService.AUDIENCE_METRICS)
+            )
+            if not (breakdowns and timeframes and audiences):
                 return Response(
-                    {"error": "Instagram account not connected"},
+                    {
+                        "error": "Invalid breakdowns, timeframes or audiences",
+                        "breakdowns": InstagramService.DEMOGRAPHIC_BREAKDOWNS,
+                        "timeframes": InstagramService.DEMOGRAPHIC_TIMEFRAMES,
+                        "audiences": list(InstagramService.AUDIENCE_METRICS),
+                    },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            demographic_data = InstagramService.get_demographic_insights(
-                instagram_id, access_token
+            demographic_data, age = (
+                InstagramService.get_audience_demographics.with_age(
+                    account.provider_account_id,
+                    account.access_token,
+                    breakdowns,
+                    timeframes,
+                    audiences,
+                )
             )
 
             if "error" in demographic_data:
                 logger.error(
-                    f"Err  Instagram demographics: {demographic_data['error']}"
+                    "Err  Instagram audience demographics: %s",
+                    demographic_data["error"],
                 )
                 return Response(
-                    {"error": "Failed to fetch demographic insights"},
+                    {"error": "Failed to fetch audience demographics"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            return Response(demographic_data, status=status.HTTP_200_OK)
+            return Response(
+                demographic_data,
+                status=status.HTTP_200_OK,
+                headers=age_headers(age),
+            )
 
-        except Exception as e:
+        except Exception:
             logger.exception(
-                "Unexpected error in InstagramDemographicsView", str(e)
+                "Unexpected error in InstagramAudienceDemographicsView"
+            )
+            return Response(
+                {"error": "An unexpected error occurred"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
+def _dashboard_params(request):
+    """
+    Panels and panel params of a dashboard request
+
+    Returns:
+        Tuple of the panels, their params and an error response, the
+        first two None on error
+    """
+    panels = list_param(request, "panels", list(dashboard.PANELS))
+    period = request.query_params.get("period", EngagementRollup.MONTH)
+    if not panels or period not in (
+        EngagementRollup.MONTH,
+        EngagementRollup.WEEK,
+    ):
+        return (
+            None,
+            None,
+            Response(
+                {
+                    "error": "Invalid panels or period",
+                    "panels": list(dashboard.PANELS),
+                    "periods": [EngagementRollup.MONTH, EngagementRollup.WEEK],
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            ),
+        )
+
+    params = {
+        "days": int_param(request, "days", 30),
+        "period": period,
+        "count": engagement_periods(request, period),
+    }
+    return panels, params, None
+
+
+class InstagramDashboardView(APIView):
+    """
+    View to get several insights panels of the user's account in one
+    request, see dashboard
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            account, error_response = get_instagram_account(request)
+            if error_response:
+                return error_response
+
+            panels, params, error_response = _dashboard_params(request)
+            if error_response:
+                return error_response
+
+            result = dashboard.build(account, panels, params)
+
+            age = max(
+                (panel.get("age", 0) for panel in result["panels"].values()),
+                default=0,
+            )
+            return Response(
+                result, status=status.HTTP_200_OK, headers=age_headers(age)
             )
+
+        except Exception:
+            logger.exception("Unexpected error in InstagramDashboardView")
             return Response(
                 {"error": "An unexpected error occurred"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+class InstagramDashboardStreamView(APIView):
+    """
+    View streaming the panels of the dashboard as each one is built, as
+    Server-Sent Events or, with Accept: application/x-ndjson, NDJSON
+    """
+
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [
+        streaming.EventStreamRenderer,
+        streaming.NDJSONRenderer,
+    ]
+
+    def get(self, request):
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
+
+        panels, params, error_response = _dashboard_params(request)
+        if error_response:
+            return error_response
+
+        return streaming.stream(
+            request,
+            lambda: dashboard.events(account, panels, params),
+            lambda: dashboard.aevents(account, panels, params),
+        )
+
+
+class InstagramInsightsBackfillView(APIView):
+    """
+    View to start backfilling the daily metrics history of the user's
+    account, and to follow its progress
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
+
+        job = account.backfill_jobs.order_by("-created_at").first()
+        if job is None:
+            return Response(
+                {"error": "No backfill started for this account"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        return Response(
+            insights_backfill.progress(job), status=status.HTTP_200_OK
+        )
+
+    def post(self, request):
+        account, error_response = get_instagram_account(request)
+        if error_response:
+            return error_response
+
+        days = request.data.get("days", settings.INSTAGRAM_BACKFILL_DAYS)
+        try:
+            days = min(max(int(days), 1), settings.INSTAGRAM_BACKFILL_DAYS)
+        except (TypeError, ValueError):
+            days = settings.INSTAGRAM_BACKFILL_DAYS
+
+        job, started = insights_backfill.start(account, days)
+        return Response(
+            insights_backfill.progress(job),
+            status=status.HTTP_202_ACCEPTED if started else status.HTTP_200_OK,
+        )
+
+
+class InstagramUpstreamStatusView(APIView):
+    """
+    View to inspect how Graph API calls are being throttled
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {
+                "rate_limits": rate_limiter.snapshot(),
+                "circuit_breakers": breaker_states(),
+                "resilience": metrics.snapshot(),
+                "cache": insights_cache.stats(),
+            },
+            status=status.HTTP_200_OK,
+        )